@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Run flash jobs on a remote machine that has the devices attached.
+
+The agent receives a whole job, runs it against the local device and only
+sends back progress and the result, so the latency of the network is paid
+once per job instead of once per HID report.
+
+The protocol is one JSON object per line over TCP. The client sends a
+single job per connection, and the agent replies with any number of
+`progress` messages followed by one `result` message.
+
+The agent only listens on the loopback interface by default. To accept
+jobs from other machines it needs a shared token, which every job must
+carry.
+
+Example:
+
+    # on the machine with the fixture
+    FlashAgent('0.0.0.0', AGENT_PORT, token="s3cret").serve_forever()
+
+    # on the controller
+    remote = RemoteBootloader("fixture-3", mcu="EFM8UB10F16G_QFN28", token="s3cret")
+    remote.write_flash_hex("app.hex", reset=True)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import binascii
+import hmac
+import io
+import json
+import socket
+import threading
+
+from timeit import default_timer
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import efm8boot.ids
+from efm8boot.bootloader import (
+    EFM8BootloaderError, EFM8BootloaderProtocolError, EFM8BootloaderHexError,
+    EFM8BootloaderVerifyError, EFM8BootloaderTimeoutError, EFM8BootloaderObserver
+)
+from efm8boot.hid_bootloader import find_devices
+from efm8boot.image import load_image
+from efm8boot.records import (
+    Record, CMD_ERASE, CMD_WRITE, CMD_SETUP, CMD_VERIFY, CMD_RUN_APP
+)
+
+AGENT_PORT = 9548
+
+# Records a plan job may send, anything else like a lock is refused
+PLAN_COMMANDS = (CMD_SETUP, CMD_ERASE, CMD_WRITE, CMD_VERIFY)
+
+def _is_loopback(host):
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+class EFM8BootloaderAgentError(EFM8BootloaderError):
+    """
+    Error reported by a flash agent, or when the agent can't be reached.
+    """
+    pass
+
+def _send(wfile, message):
+    wfile.write((json.dumps(message) + "\n").encode('utf-8'))
+    wfile.flush()
+
+def _error_result(err):
+    result = {
+        'ok': False,
+        'error': type(err).__name__,
+        'message': str(err),
+    }
+    if isinstance(err, EFM8BootloaderProtocolError):
+        result['code'] = err.code
+    if isinstance(err, EFM8BootloaderVerifyError):
+        result['start'] = err.start
+        result['end'] = err.end
+    if isinstance(err, EFM8BootloaderTimeoutError):
+        result['cmd'] = err.cmd
+        result['elapsed'] = err.elapsed
+    return result
+
+class _ProgressObserver(EFM8BootloaderObserver):
+    """
+    Sends the number of records and flash bytes done, at most once every
+    `interval` seconds.
+    """
+
+    def __init__(self, send, interval):
+        self._send = send
+        self._interval = interval
+        self._lastTime = default_timer()
+        self.records = 0
+        self.bytes = 0
+
+    def record_finished(self, boot, record, resp, elapsed):
+        self.records += 1
+        if record.cmd in (CMD_ERASE, CMD_WRITE):
+            self.bytes += len(record.data) - 2
+        now = default_timer()
+        if now - self._lastTime >= self._interval:
+            self._lastTime = now
+            self.flush()
+
+    def flush(self):
+        self._send({
+            'event': 'progress',
+            'records': self.records,
+            'bytes': self.bytes,
+        })
+
+class FlashAgent(object):
+    """
+    Serves flash jobs for the devices attached to this machine.
+
+    Jobs for the same device are run one at a time, jobs for different
+    devices run in parallel.
+
+    Parameters:
+        host: the address to listen on
+        port: the TCP port to listen on, 0 picks a free port
+        findDevices: function used to find the target of a job, called like
+            `efm8boot.find_devices(vid, pid, mcu, path)`
+        progressInterval: minimum time between progress messages
+        token: shared secret that jobs must carry, needed to listen on an
+            address other than loopback
+
+    Raises:
+        ValueError: if `host` isn't a loopback address and no token is given
+    """
+
+    def __init__(self, host='127.0.0.1', port=AGENT_PORT, findDevices=find_devices,
+                 progressInterval=0.1, token=None):
+        if token is None and not _is_loopback(host):
+            raise ValueError(
+                "A token is needed to serve flash jobs on '{}'".format(host)
+            )
+        self.findDevices = findDevices
+        self.token = token
+        self.progressInterval = progressInterval
+        self._deviceLocks = {}
+        self._deviceLocksLock = threading.Lock()
+
+        agent = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                agent._handle(self.rfile, self.wfile)
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server((host, port), JobHandler)
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """
+        Serve jobs on a daemon thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _device_lock(self, path):
+        with self._deviceLocksLock:
+            return self._deviceLocks.setdefault(path, threading.Lock())
+
+    def _handle(self, rfile, wfile):
+        line = rfile.readline()
+        if not line:
+            return
+
+        def send(message):
+            _send(wfile, message)
+
+        try:
+            job = json.loads(line.decode('utf-8'))
+            result = self._run_job(job, send)
+        except Exception as err:
+            result = _error_result(err)
+        result['event'] = 'result'
+        send(result)
+
+    def _check_token(self, job):
+        if self.token is None:
+            return
+        expected = self.token
+        if not isinstance(expected, bytes):
+            expected = expected.encode('utf-8')
+        token = job.get('token')
+        if not isinstance(token, type('')) or \
+                not hmac.compare_digest(token.encode('utf-8'), expected):
+            raise EFM8BootloaderAgentError("Invalid agent token")
+
+    def _plan_records(self, job, info):
+        part = job.get('part')
+        if part is not None and part != info.name:
+            raise EFM8BootloaderAgentError(
+                "The plan is for a {}, but the target is a {}"
+                .format(part, info.name)
+            )
+        planRecords = [
+            Record.from_bytes(binascii.unhexlify(data)) for data in job['records']
+        ]
+        for record in planRecords:
+            if record.cmd not in PLAN_COMMANDS:
+                raise EFM8BootloaderAgentError(
+                    "Plans can't send 0x{:02X} records".format(record.cmd)
+                )
+        return planRecords
+
+    def _open_target(self, selector):
+        """
+        Find the target of a job.
+
+        The devices are enumerated without opening them, and when `mcu` is
+        given, each candidate is identified while holding its device lock,
+        so it isn't used by another job at the same time.
+        """
+        mcu = selector.get('mcu')
+        devices = self.findDevices(
+            selector.get('vid', efm8boot.ids.SILICON_LABS_USB_ID),
+            selector.get('pid', 0x0000),
+            None,
+            selector.get('path'),
+        )
+        if mcu:
+            matches = []
+            for boot in devices:
+                if not efm8boot.ids.REGISTRY.pid_has_part(boot.pid, mcu):
+                    continue
+                with self._device_lock(boot.path):
+                    with boot:
+                        if boot.is_part(mcu):
+                            matches.append(boot)
+            devices = matches
+        if len(devices) != 1:
+            raise EFM8BootloaderAgentError(
+                "Expected one device matching {}, found {}".format(
+                    selector, len(devices)
+                )
+            )
+        return devices[0]
+
+    def _run_job(self, job, send):
+        self._check_token(job)
+        boot = self._open_target(job.get('target', {}))
+        progress = _ProgressObserver(send, self.progressInterval)
+        boot.observers.append(progress)
+        startTime = default_timer()
+        result = {'ok': True}
+
+        with self._device_lock(boot.path):
+            with boot:
+                kind = job['job']
+                if kind in ('flash', 'verify'):
+                    image = load_image(
+                        binascii.a2b_base64(job['image']), job.get('hexFormat', 'hex')
+                    )
+                    if kind == 'flash':
+                        boot.write_flash_hex(image, verifyEvery=job.get('verifyEvery'))
+                    else:
+                        result['matches'] = boot.verify_flash_hex(image)
+                elif kind == 'plan':
+                    for record in self._plan_records(job, boot.info):
+                        boot._write_flash_record(record)
+                else:
+                    raise EFM8BootloaderAgentError("Unknown job '{}'".format(kind))
+
+                if job.get('reset'):
+                    boot.reset_mcu()
+
+        progress.flush()
+        result['bytes'] = progress.bytes
+        result['elapsed'] = default_timer() - startTime
+        result['device'] = str(boot.path)
+        return result
+
+class RemoteBootloader(object):
+    """
+    Runs jobs on a device attached to a `FlashAgent`, with the same methods
+    as `EFM8Bootloader` for flashing.
+
+    Parameters:
+        host: the host name of the agent
+        port: the port of the agent
+        vid, pid, mcu, path: select the target device, like
+            `efm8boot.find_devices()`
+        timeout: socket timeout in seconds, or None to wait forever
+        token: the shared token of the agent
+    """
+
+    def __init__(self, host, port=AGENT_PORT, vid=efm8boot.ids.SILICON_LABS_USB_ID,
+                 pid=0x0000, mcu=None, path=None, timeout=None, token=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.token = token
+        self.target = {'vid': vid, 'pid': pid, 'mcu': mcu, 'path': path}
+
+    def _encode_image(self, hexFile, hexFormat):
+        image = load_image(hexFile, hexFormat)
+        text = io.StringIO()
+        image.ihex.write_hex_file(text)
+        return binascii.b2a_base64(text.getvalue().encode('ascii')).decode('ascii')
+
+    def _run(self, job, progress):
+        job['target'] = self.target
+        if self.token is not None:
+            job['token'] = self.token
+        try:
+            conn = socket.create_connection((self.host, self.port), self.timeout)
+        except socket.error as err:
+            raise EFM8BootloaderAgentError(
+                "Couldn't connect to agent {}:{}: {}".format(self.host, self.port, err)
+            )
+
+        try:
+            f = conn.makefile('rwb')
+            _send(f, job)
+            for line in f:
+                message = json.loads(line.decode('utf-8'))
+                if message['event'] == 'progress':
+                    if progress:
+                        progress(message['records'], message['bytes'])
+                elif message['event'] == 'result':
+                    break
+            else:
+                raise EFM8BootloaderAgentError("The agent closed the connection")
+        finally:
+            conn.close()
+
+        if not message['ok']:
+            if message['error'] == 'EFM8BootloaderVerifyError':
+                raise EFM8BootloaderVerifyError(message['start'], message['end'])
+            elif message['error'] == 'EFM8BootloaderTimeoutError':
+                raise EFM8BootloaderTimeoutError(message['cmd'], message['elapsed'])
+            elif 'code' in message:
+                raise EFM8BootloaderProtocolError(message['code'])
+            elif message['error'] == 'EFM8BootloaderHexError':
+                raise EFM8BootloaderHexError(message['message'])
+            raise EFM8BootloaderAgentError(
+                "{}: {}".format(message['error'], message['message'])
+            )
+        return message
+
+    def write_flash_hex(self, hexFile, hexFormat='hex', verifyEvery=None,
+                        reset=False, progress=None):
+        """
+        Write a hex file to the remote device, see
+        `EFM8Bootloader.write_flash_hex()`.
+
+        The hex files are loaded and merged locally, and the agent receives
+        the merged image.
+
+        Parameters:
+            reset: reset the device after writing it
+            progress: called with the number of records sent and flash bytes
+                written while the job runs
+
+        Returns:
+            The result message from the agent
+        """
+        return self._run({
+            'job': 'flash',
+            'image': self._encode_image(hexFile, hexFormat),
+            'verifyEvery': verifyEvery,
+            'reset': reset,
+        }, progress)
+
+    def verify_flash_hex(self, hexFile, hexFormat='hex'):
+        """
+        Check that the flash of the remote device matches a hex file, see
+        `EFM8Bootloader.verify_flash_hex()`.
+        """
+        return self._run({
+            'job': 'verify',
+            'image': self._encode_image(hexFile, hexFormat),
+        }, None)['matches']
+
+    def run_plan(self, plan, progress=None):
+        """
+        Send the records of a `efm8boot.plan.FlashPlan` to the remote device.
+        The agent checks that the plan was made for the part of the device.
+
+        The agent only runs setup, erase, write and verify records, a reset
+        at the end of the plan is sent as the `reset` option of the job.
+        """
+        planRecords = list(plan.records)
+        reset = bool(planRecords) and planRecords[-1].cmd == CMD_RUN_APP
+        if reset:
+            planRecords.pop()
+        return self._run({
+            'job': 'plan',
+            'part': plan.info.name,
+            'records': [
+                binascii.hexlify(bytes(record.to_bytes())).decode('ascii')
+                for record in planRecords
+            ],
+            'reset': reset,
+        }, progress)
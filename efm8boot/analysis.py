@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Analysis of many firmware images against many parts at once.
+
+The images are loaded into one NumPy array, so page maps, blank frames,
+CRCs, size checks and flash cost estimates are computed for the whole batch
+with array operations instead of a Python loop per image and part.
+
+NumPy is only needed for this module, install it with `pip install numpy`.
+
+Example:
+
+    batch = ImageBatch.load(["app-a.hex", "app-b.hex"])
+    report = batch.report()
+    print(json.dumps(report, indent=2))
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import efm8boot.ids
+from efm8boot.bootloader import FRAME_SIZE
+from efm8boot.image import compute_crc, load_image
+from efm8boot.plan import LatencyProfile
+from efm8boot.records import (
+    RunAppRecord, SetupRecord, VerifyRecord, WriteRecord, EraseRecord
+)
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError(
+            "efm8boot.analysis needs numpy, install it with 'pip install numpy'"
+        )
+
+def all_targets():
+    """
+    Return the `EFM8Info` of every known part.
+    """
+    return [part.info for part in efm8boot.ids.REGISTRY.byName.values()]
+
+_crcTable = None
+_shiftTables = {}
+
+def _crc_table():
+    global _crcTable
+    if _crcTable is None:
+        _crcTable = numpy.array(
+            [compute_crc(bytearray([value])) for value in range(256)],
+            dtype=numpy.uint16
+        )
+    return _crcTable
+
+def _crc_rows(rows):
+    """
+    Return the XModem CRC of each row of a 2D array of bytes.
+    """
+    table = _crc_table()
+    # iterate over the columns, so each step works on a contiguous array
+    columns = numpy.ascontiguousarray(rows.T)
+    crc = numpy.zeros(rows.shape[0], dtype=numpy.uint16)
+    for column in columns:
+        crc = (crc << 8) ^ table[(crc >> 8) ^ column]
+    return crc
+
+def _crc_shift(crcs, length):
+    """
+    Return `crc_combine(crcs, 0, length)` for an array of CRCs, i.e. the
+    CRCs after `length` more zero bytes.
+
+    The CRC is linear, so this is the XOR of the shifts of the high and low
+    bytes, which are looked up in tables.
+    """
+    if length not in _shiftTables:
+        zeros = b'\x00' * length
+        _shiftTables[length] = (
+            numpy.array([compute_crc(zeros, value << 8) for value in range(256)],
+                        dtype=numpy.uint16),
+            numpy.array([compute_crc(zeros, value) for value in range(256)],
+                        dtype=numpy.uint16),
+        )
+    (high, low) = _shiftTables[length]
+    return high[crcs >> 8] ^ low[crcs & 0xFF]
+
+def _record_reports(record, maxPacketSize):
+    return int(math.ceil(len(record.to_bytes()) / maxPacketSize))
+
+class ImageBatch(object):
+    """
+    A batch of firmware images held in one array.
+
+    Parameters:
+        names: the names of the images
+        data: `uint8` array of shape (images, size) with unused bytes set to
+            0xFF
+        used: `bool` array of the same shape, true for bytes set by an image
+        maxAddrs: the highest address of each image, or -1 if it is empty
+    """
+
+    def __init__(self, names, data, used, maxAddrs):
+        _require_numpy()
+        self.names = list(names)
+        self.data = data
+        self.used = used
+        self.maxAddrs = numpy.asarray(maxAddrs)
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def load(cls, sources, hexFormat='hex', names=None, size=None):
+        """
+        Load a batch of images.
+
+        Data above `size` is left out of the array, but still counts for
+        the size checks.
+
+        Parameters:
+            sources: a list of `FirmwareImage`, file names or file-like objects
+            hexFormat: file format ('hex' or 'bin')
+            names: the names of the images, defaults to the file names
+            size: the size of the array, defaults to the largest flash of
+                the known parts
+        """
+        _require_numpy()
+        if size is None:
+            size = max(info.flashSize for info in all_targets())
+        if names is None:
+            names = [str(source) for source in sources]
+
+        data = numpy.full((len(sources), size), 0xFF, dtype=numpy.uint8)
+        used = numpy.zeros((len(sources), size), dtype=bool)
+        maxAddrs = []
+        for (index, source) in enumerate(sources):
+            ihex = load_image(source, hexFormat).ihex
+            for (start, end) in ihex.segments():
+                end = min(end, size)
+                if start >= end:
+                    continue
+                data[index, start:end] = numpy.frombuffer(
+                    bytes(ihex.tobinstr(start=start, end=end - 1)), dtype=numpy.uint8
+                )
+                used[index, start:end] = True
+            maxAddr = ihex.maxaddr()
+            maxAddrs.append(-1 if maxAddr is None else maxAddr)
+
+        return cls(names, data, used, maxAddrs)
+
+    def _memoize(self, key, func):
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = func()
+            return value
+
+    def _pages(self, array, pageSize):
+        return array.reshape(len(self), -1, pageSize)
+
+    def occupancy(self, pageSize):
+        """
+        Return a `bool` array of shape (images, pages) that is true for the
+        pages each image writes.
+        """
+        return self._memoize(
+            ('occupancy', pageSize),
+            lambda: self._pages(self.used, pageSize).any(axis=2)
+        )
+
+    def page_counts(self, pageSize):
+        """
+        Return the number of pages each image writes.
+        """
+        return self.occupancy(pageSize).sum(axis=1)
+
+    def blank_frames(self, pageSize, frameSize=FRAME_SIZE):
+        """
+        Return a `bool` array of shape (images, pages, frames) that is true
+        for the frames that only contain 0xFF, see
+        `FirmwareImage.blank_frames()`.
+        """
+        def compute():
+            frames = self.data.reshape(len(self), -1, pageSize // frameSize, frameSize)
+            return (frames == 0xFF).all(axis=3)
+        return self._memoize(('blank_frames', pageSize, frameSize), compute)
+
+    def page_crcs(self, pageSize):
+        """
+        Return a `uint16` array of shape (images, pages) with the CRC of
+        every page, including the pages an image doesn't write.
+        """
+        def compute():
+            rows = self.data.reshape(-1, pageSize)
+            return _crc_rows(rows).reshape(len(self), -1)
+        return self._memoize(('page_crcs', pageSize), compute)
+
+    def verify_ranges(self, pageSize):
+        """
+        Return the verify ranges of each image, see
+        `FirmwareImage.verify_ranges()`.
+
+        Returns:
+            A list with a list of `(start, end, crc)` tuples for each image
+        """
+        return self._memoize(
+            ('verify_ranges', pageSize), lambda: self._verify_ranges(pageSize)
+        )
+
+    def _verify_ranges(self, pageSize):
+        occupied = self.occupancy(pageSize)
+        pageCrcs = self.page_crcs(pageSize)
+
+        # CRC of the run of pages ending at each page, built up one page
+        # column at a time for all the images
+        runCrcs = numpy.zeros_like(pageCrcs)
+        runCrcs[:, 0] = pageCrcs[:, 0]
+        for page in range(1, occupied.shape[1]):
+            continues = occupied[:, page - 1] & occupied[:, page]
+            runCrcs[:, page] = numpy.where(
+                continues,
+                _crc_shift(runCrcs[:, page - 1], pageSize) ^ pageCrcs[:, page],
+                pageCrcs[:, page],
+            )
+
+        # runs end on an occupied page that isn't followed by one
+        following = numpy.zeros_like(occupied)
+        following[:, :-1] = occupied[:, 1:]
+        runEnds = occupied & ~following
+        runStarts = occupied.copy()
+        runStarts[:, 1:] &= ~occupied[:, :-1]
+
+        ranges = []
+        for index in range(len(self)):
+            starts = numpy.flatnonzero(runStarts[index])
+            ends = numpy.flatnonzero(runEnds[index])
+            ranges.append([
+                (int(start) * pageSize, (int(end) + 1) * pageSize - 1,
+                 int(runCrcs[index, end]))
+                for (start, end) in zip(starts, ends)
+            ])
+        return ranges
+
+    def fits(self, info):
+        """
+        Return a `bool` array that is true for the images that fit below the
+        bootloader of a part.
+        """
+        return self.maxAddrs < info.bootloaderStart
+
+    def flash_cost(self, info, maxPacketSize=EFM8BootloaderHID.HID_OUT_SIZE,
+                   reset=True):
+        """
+        Count the records `write_flash_hex()` sends for each image, the same
+        as `efm8boot.plan.FlashPlan.summary()` does for a single image.
+
+        Returns:
+            A dict of arrays with an entry for each image
+        """
+        pageSize = info.pageSize
+        occupied = self.occupancy(pageSize)
+        blank = self.blank_frames(pageSize)
+        written = ~blank & occupied[:, :, None]
+
+        # Page 0 is erased without data first and all of its frames are
+        # written at the end, the other pages carry their first frame in the
+        # erase record.
+        erases = occupied.sum(axis=1)
+        erasesWithData = written[:, 1:, 0].sum(axis=1)
+        writes = written[:, 1:, 1:].sum(axis=(1, 2)) + written[:, 0, :].sum(axis=1)
+        verifies = (occupied[:, 0].astype(int) +
+                    (occupied[:, 1:] & ~occupied[:, :-1]).sum(axis=1))
+        hasPages = erases > 0
+        setups = 2 * hasPages
+        resets = numpy.full(len(self), 1 if reset else 0)
+
+        frame = b'\x00' * FRAME_SIZE
+        frameReports = _record_reports(WriteRecord(0, frame), maxPacketSize)
+        eraseReports = _record_reports(EraseRecord(0, b''), maxPacketSize)
+        verifyReports = _record_reports(VerifyRecord(0, 0, 0), maxPacketSize)
+        setupReports = _record_reports(SetupRecord(), maxPacketSize)
+        resetReports = _record_reports(RunAppRecord(), maxPacketSize)
+
+        records = erases + writes + verifies + setups + resets
+        outReports = (
+            (erases - erasesWithData) * eraseReports +
+            (erasesWithData + writes) * frameReports +
+            verifies * verifyReports +
+            setups * setupReports +
+            resets * resetReports
+        )
+        return {
+            'records': records,
+            'erases': erases,
+            'writes': writes,
+            'verifies': verifies,
+            'setups': setups,
+            'resets': resets,
+            'writeFrames': erasesWithData + writes,
+            'dataBytes': (erasesWithData + writes) * FRAME_SIZE,
+            'hidReports': outReports + records,
+        }
+
+    def estimate_time(self, info, profile=None, reset=True):
+        """
+        Estimate the time to flash each image in seconds, see
+        `efm8boot.plan.FlashPlan.estimate_time()`.
+        """
+        if profile is None:
+            profile = LatencyProfile()
+        cost = self.flash_cost(info, reset=reset)
+        commandTimes = profile.commandTimes
+        return (
+            cost['hidReports'] * profile.reportTime +
+            cost['erases'] * commandTimes.get('erase', 0.0) +
+            cost['writes'] * commandTimes.get('write', 0.0) +
+            cost['verifies'] * commandTimes.get('verify', 0.0) +
+            cost['setups'] * commandTimes.get('setup', 0.0) +
+            cost['resets'] * commandTimes.get('reset', 0.0)
+        )
+
+    def report(self, targets=None, profile=None):
+        """
+        Return the analysis of every image for every target as a dict that
+        can be written as JSON.
+
+        Parameters:
+            targets: a list of `EFM8Info`, defaults to all known parts
+            profile: the `LatencyProfile` used for time estimates
+        """
+        if targets is None:
+            targets = all_targets()
+
+        images = []
+        pageSizes = sorted(set(info.pageSize for info in targets))
+        for (index, name) in enumerate(self.names):
+            layouts = {}
+            for pageSize in pageSizes:
+                occupied = self.occupancy(pageSize)[index]
+                blank = self.blank_frames(pageSize)[index]
+                pageAddrs = numpy.flatnonzero(occupied) * pageSize
+                layouts[str(pageSize)] = {
+                    'pageCount': int(occupied.sum()),
+                    'pageMap': "".join("1" if page else "0" for page in occupied),
+                    'pageCrcs': dict(
+                        ("0x{:04X}".format(int(pageAddr)),
+                         int(self.page_crcs(pageSize)[index, pageAddr // pageSize]))
+                        for pageAddr in pageAddrs
+                    ),
+                    'blankFrames': dict(
+                        ("0x{:04X}".format(int(pageAddr)),
+                         [bool(frame) for frame in blank[pageAddr // pageSize]])
+                        for pageAddr in pageAddrs
+                    ),
+                    'verifyRanges': [
+                        list(verifyRange)
+                        for verifyRange in self.verify_ranges(pageSize)[index]
+                    ],
+                }
+            images.append({
+                'name': name,
+                'maxAddr': int(self.maxAddrs[index]),
+                'layouts': layouts,
+            })
+
+        results = []
+        for info in targets:
+            fits = self.fits(info)
+            cost = self.flash_cost(info)
+            times = self.estimate_time(info, profile)
+            for (index, name) in enumerate(self.names):
+                result = {
+                    'image': name,
+                    'target': info.name,
+                    'fits': bool(fits[index]),
+                    'estimatedTime': float(times[index]),
+                }
+                for (key, values) in cost.items():
+                    result[key] = int(values[index])
+                results.append(result)
+
+        return {
+            'images': images,
+            'targets': [info.name for info in targets],
+            'results': results,
+        }
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Batching of flash operations, see `EFM8Bootloader.batch()`.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+from efm8boot.records import EraseRecord, WriteRecord, VerifyRecord, BANK_SIZE
+from efm8boot.image import crc_combine
+
+class _PageState(object):
+    def __init__(self):
+        self.erased = False
+        self.data = {}
+
+class BatchScheduler(object):
+    """
+    Queues erase, write and verify operations and schedules them as few
+    records as possible.
+
+    The scheduler keeps a model of the pending changes to each flash page:
+
+    * An erase drops the writes queued for the page before it, and repeated
+      erases of a page are sent once.
+    * Writes to the same byte are combined the same way the flash does,
+      by AND'ing them together.
+    * Written bytes are packed into frames of up to `frameSize` bytes. Gaps
+      between them are filled with 0xFF, which doesn't change the flash.
+    * Verifies are sent after all the writes, with duplicates removed and
+      adjacent ranges merged into one.
+
+    Pages are sent in address order, except that when page 0 is erased it is
+    erased first and written last, like `write_flash_hex()` does. On parts
+    with more than one flash bank, the records are grouped by bank, and bank
+    0 is written last when page 0 is erased.
+
+    Parameters:
+        pageSize: the flash page size of the device
+        frameSize: the largest amount of data sent in one record
+    """
+
+    def __init__(self, pageSize, frameSize):
+        self.pageSize = pageSize
+        self.frameSize = frameSize
+        self._pages = {}
+        self._verifies = []
+
+    def _page(self, addr):
+        pageAddr = addr - addr % self.pageSize
+        if pageAddr not in self._pages:
+            self._pages[pageAddr] = _PageState()
+        return self._pages[pageAddr]
+
+    @property
+    def modifiesFlash(self):
+        return len(self._pages) != 0
+
+    def erase(self, addr):
+        page = self._page(addr)
+        page.erased = True
+        page.data.clear()
+
+    def write(self, addr, data, erase=False):
+        if erase:
+            self.erase(addr)
+        for (offset, value) in enumerate(bytearray(data)):
+            page = self._page(addr + offset)
+            page.data[addr + offset] = page.data.get(addr + offset, 0xff) & value
+
+    def verify(self, start, end, crc):
+        self._verifies.append((start, end, crc))
+
+    def _page_records(self, pageAddr, page, erase):
+        addrs = sorted(page.data)
+        chunks = []
+        i = 0
+        while i < len(addrs):
+            start = addrs[i]
+            limit = min(start + self.frameSize, pageAddr + self.pageSize)
+            while i < len(addrs) and addrs[i] < limit:
+                i += 1
+            end = addrs[i-1] + 1
+            chunks.append((start, bytearray(
+                page.data.get(addr, 0xff) for addr in range(start, end)
+            )))
+
+        # addresses in the records are relative to the selected bank
+        if erase:
+            if chunks:
+                (addr, data) = chunks.pop(0)
+                yield EraseRecord(addr % BANK_SIZE, data)
+            else:
+                yield EraseRecord(pageAddr % BANK_SIZE, [])
+        for (addr, data) in chunks:
+            yield WriteRecord(addr % BANK_SIZE, data)
+
+    def _bank_records(self, pageAddrs):
+        for pageAddr in pageAddrs:
+            page = self._pages[pageAddr]
+            for record in self._page_records(pageAddr, page, page.erased):
+                yield record
+
+    def _merged_verifies(self):
+        merged = []
+        for (start, end, crc) in sorted(set(self._verifies)):
+            # a verify record can't cross into the next bank
+            if merged and merged[-1][1] + 1 == start and start % BANK_SIZE != 0:
+                (prevStart, _, prevCrc) = merged[-1]
+                merged[-1] = (prevStart, end, crc_combine(prevCrc, crc, end - start + 1))
+            else:
+                merged.append((start, end, crc))
+        return merged
+
+    def groups(self):
+        """
+        Generate the scheduled records, grouped by the flash bank they need
+        selected.
+
+        Returns:
+            A generator of tuples `(bank, records)`, where the addresses in
+            `records` are relative to the bank
+        """
+        banks = OrderedDict()
+        for pageAddr in sorted(self._pages):
+            banks.setdefault(pageAddr // BANK_SIZE, []).append(pageAddr)
+        firstPage = self._pages.get(0x0000)
+        deferFirstPage = firstPage is not None and firstPage.erased
+
+        bankOrder = list(banks)
+        if deferFirstPage:
+            # Erase page 0 first, so the bootloader still runs if the batch
+            # is interrupted before page 0 is written
+            yield (0, [EraseRecord(0x0000, [])])
+            firstPage.erased = False
+            bankOrder = bankOrder[1:] + bankOrder[:1]
+            banks[0] = banks[0][1:] + [0x0000]
+
+        for bank in bankOrder:
+            yield (bank, self._bank_records(banks[bank]))
+
+        # verify the last bank written first, to select each bank once
+        verifyBanks = OrderedDict()
+        for (start, end, crc) in self._merged_verifies():
+            assert(start // BANK_SIZE == end // BANK_SIZE)
+            verifyBanks.setdefault(start // BANK_SIZE, []).append(
+                VerifyRecord(start % BANK_SIZE, end % BANK_SIZE, crc)
+            )
+        lastBank = bankOrder[-1] if bankOrder else 0
+        for bank in sorted(verifyBanks, key=lambda bank: bank != lastBank):
+            yield (bank, verifyBanks[bank])
+
+class EFM8Batch(object):
+    """
+    Context manager returned by `EFM8Bootloader.batch()`.
+    """
+
+    def __init__(self, boot, frameSize):
+        self._boot = boot
+        self._frameSize = frameSize
+        self._isOuter = False
+
+    def __enter__(self):
+        if self._boot._batch is None:
+            self._boot._batch = BatchScheduler(
+                self._boot.info.pageSize, self._frameSize
+            )
+            self._isOuter = True
+        return self._boot._batch
+
+    def __exit__(self, err_type, err_value, traceback):
+        if not self._isOuter:
+            return
+        scheduler = self._boot._batch
+        self._boot._batch = None
+        if err_type is None:
+            self._boot._run_batch(scheduler)
@@ -7,13 +7,20 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 from efm8boot.records import (
     Record, IdentifyRecord, RunAppRecord, SetupRecord, EraseRecord,
-    WriteRecord, LockRecord, VerifyRecord, RECORD_HEADER_SIZE, ERROR_TO_STRING
+    WriteRecord, LockRecord, VerifyRecord, RECORD_HEADER_SIZE, ERROR_TO_STRING,
+    CMD_ERASE, CMD_SETUP, CMD_VERIFY, BANK_SIZE, FLASH_KEYS
 )
 import efm8boot.ids
+from efm8boot.pipeline import RecordPipeline
+from efm8boot.image import (
+    load_hex, load_image, page_crc_ranges, compute_crc
+)
+from efm8boot.batch import EFM8Batch
+from efm8boot.flight import FlightRecorder
+from efm8boot.timeouts import TransferThread
 
-import intelhex
-import crcmod
-import math
+from collections import OrderedDict
+from timeit import default_timer
 
 DEBUG_ENABLED = 0
 
@@ -28,16 +35,123 @@ class EFM8BootloaderProtocolError(EFM8BootloaderError):
     """
     def __init__(self, code):
         super(EFM8BootloaderProtocolError, self).__init__(
-            "EFM8 bootloader error: {}".format(ERROR_TO_STRING[code])
+            "EFM8 bootloader error: {}".format(
+                ERROR_TO_STRING.get(code, "unknown response 0x{:02X}".format(code))
+            )
         )
         self.code = code
 
+class EFM8BootloaderVerifyError(EFM8BootloaderProtocolError):
+    """
+    Error used when the CRC of a flash region doesn't match while flashing.
+
+    The failing region is given by `start` and `end` (inclusive).
+    """
+    def __init__(self, start, end):
+        super(EFM8BootloaderVerifyError, self).__init__(efm8boot.records.CRC_ERROR)
+        self.args = (
+            "EFM8 bootloader error: CRC_ERROR in flash region 0x{:04X}-0x{:04X}"
+            .format(start, end),
+        )
+        self.start = start
+        self.end = end
+
+class EFM8BootloaderTimeoutError(EFM8BootloaderError):
+    """
+    Error used when a device doesn't respond to a record in time.
+    """
+    def __init__(self, cmd, elapsed):
+        super(EFM8BootloaderTimeoutError, self).__init__(
+            "EFM8 bootloader error: no response to {} record after {:.3f}s".format(
+                efm8boot.records.CMD_TO_STRING.get(cmd, "0x{:02X}".format(cmd)),
+                elapsed
+            )
+        )
+        self.cmd = cmd
+        self.elapsed = elapsed
+
+class EFM8BootloaderAppTimeoutError(EFM8BootloaderError):
+    """
+    Error used when the application doesn't enumerate in time after a reset.
+    """
+    def __init__(self, timeout):
+        super(EFM8BootloaderAppTimeoutError, self).__init__(
+            "EFM8 bootloader error: the application didn't enumerate within "
+            "{:.3f}s of the reset".format(timeout)
+        )
+        self.timeout = timeout
+
+class EFM8BootloaderFallbackError(EFM8BootloaderError):
+    """
+    Error used when a device re-enumerates as the bootloader after a reset,
+    instead of running the application.
+    """
+    def __init__(self, path):
+        super(EFM8BootloaderFallbackError, self).__init__(
+            "EFM8 bootloader error: the device came back as the bootloader "
+            "at {} instead of running the application".format(path)
+        )
+        self.path = path
+
 class EFM8BootloaderHexError(EFM8BootloaderError):
     """
     Error used when a hex file is incompatible with the bootloader.
     """
     pass
 
+class EFM8BootloaderObserver(object):
+    """
+    Base class for objects that are notified of the activity of a bootloader.
+
+    Observers are added to the `observers` list of a bootloader. They are
+    called from the thread using the bootloader, so should be quick.
+    """
+
+    def record_started(self, boot, record):
+        """
+        Called before a record is sent to the device.
+        """
+        pass
+
+    def record_finished(self, boot, record, resp, elapsed):
+        """
+        Called when the response to a record has been read.
+
+        Parameters:
+            resp: the response code from the device
+            elapsed: time taken to send the record and read the response
+        """
+        pass
+
+    def flash_started(self, boot):
+        """
+        Called when `write_flash_hex()` starts writing to the device.
+        """
+        pass
+
+    def flash_finished(self, boot, nbytes, elapsed, error):
+        """
+        Called when `write_flash_hex()` finishes.
+
+        Parameters:
+            nbytes: number of bytes of flash written
+            elapsed: time taken by the flash
+            error: the exception that stopped the flash, or None on success
+        """
+        pass
+
+    def app_started(self, boot, elapsed, error):
+        """
+        Called when `reset_mcu()` finishes waiting for the application.
+
+        Parameters:
+            elapsed: time from the reset to the application enumerating, or
+                to the failure
+            error: the exception raised if the application didn't start, or
+                None on success
+        """
+        pass
+
 class EFM8BootloaderSMBus(object):
     """ TODO: Support SMBus bootloader """
     pass
@@ -48,13 +162,46 @@ class EFM8Bootloader(object):
     EFM8 bootloader base class
     """
 
+    # Gang setups keep hundreds of these alive at once, so the per-device
+    # state is kept in slots. Subclasses that don't declare `__slots__` still
+    # get a `__dict__`.
+    __slots__ = (
+        '_mcuHasBeenReset', '_hasLoadedInfo', '_isConnected', '_isWritingEnabled',
+        '_bank', '_info', '_maxPacketSize', '_autoDisable', '_batch',
+        '_prepareHook', '_transferThread', 'observers', 'flightRecorder',
+        'timeouts', '__weakref__',
+    )
+
+    # Errors from `_transfer()` after which a record can be sent again
+    _transportErrors = (IOError, OSError)
+
+    # The CRC function is stateless, so all devices share the module one
+    compute_crc = staticmethod(compute_crc)
+
     def __init__(self):
         self._mcuHasBeenReset = False
         self._hasLoadedInfo = False
         self._isConnected = False
         self._isWritingEnabled = False
+        # flash bank selected by the last setup record
+        self._bank = 0
+        self._autoDisable = False
 
-        self.compute_crc = crcmod.predefined.mkCrcFun('xmodem')
+        # list of EFM8BootloaderObserver objects
+        self.observers = []
+
+        # BatchScheduler used inside `batch()`
+        self._batch = None
+
+        # Keeps the last records sent, set to None to turn it off
+        self.flightRecorder = FlightRecorder()
+
+        # efm8boot.timeouts.AdaptiveTimeouts, or None to wait forever
+        self.timeouts = None
+        self._transferThread = None
+
+        # Replaces `_encode_record()` when set, see efm8boot.profiling
+        self._prepareHook = None
 
     @property
     def info(self):
@@ -75,26 +222,174 @@ class EFM8Bootloader(object):
     def __exit__(self, err_type, err_value, traceback):
         self.disconnet()
 
-    def _write_record(self, record, raiseError=True):
+    def _pad_report(self, data):
         """
-        Send data to the efm8 bootloader using the efm8 bootloader record format.
+        Return the report sent to the device for a packet of record data.
+        """
+        return data
+
+    def _prepare_record(self, record):
+        """
+        Encode a record into the list of reports sent to the device.
         """
+        if self._prepareHook is not None:
+            return self._prepareHook(record)
+        return self._encode_record(record)
 
+    def _encode_record(self, record):
+        """
+        Split the bytes of a record into reports of `_maxPacketSize`.
+        """
         recordData = record.to_bytes()
 
         # Can only send 64 bytes at a time, so packetize the data if necessary
-        for offset in range(0, len(recordData), self._maxPacketSize):
-            self._write(recordData[offset : offset+self._maxPacketSize])
+        return [
+            self._pad_report(recordData[offset : offset+self._maxPacketSize])
+            for offset in range(0, len(recordData), self._maxPacketSize)
+        ]
 
-        # Read the response and check for errors
-        resp = self._read(1)[0]
+    def _write_record(self, record, raiseError=True, reports=None):
+        """
+        Send data to the efm8 bootloader using the efm8 bootloader record format.
+
+        Parameters:
+            record: the record to send
+            raiseError: if true, raise an error if the response isn't an ACK,
+                otherwise return the response
+            reports: the reports from `_prepare_record()` if the record has
+                already been encoded
+        """
+
+        observers = self.observers
+        if observers:
+            for observer in observers:
+                observer.record_started(self, record)
+            startTime = default_timer()
+
+        if reports is None:
+            reports = self._prepare_record(record)
+
+        recorder = self.flightRecorder
+        if recorder is not None and not recorder.enabled:
+            recorder = None
+
+        try:
+            if self.timeouts is None:
+                response = self._transfer(reports)
+            else:
+                response = self._timed_transfer(record, reports)
+        except Exception as err:
+            if recorder is not None:
+                recorder.add(record, None, reports)
+                recorder.dump(err)
+            raise
+        resp = response[0]
+
+        if recorder is not None:
+            recorder.add(record, resp, reports, response)
+
+        if observers:
+            elapsed = default_timer() - startTime
+            for observer in observers:
+                observer.record_finished(self, record, resp, elapsed)
 
         if raiseError:
             if resp != efm8boot.records.ACK:
-                raise EFM8BootloaderProtocolError(resp)
+                raise self._error(EFM8BootloaderProtocolError(resp))
         else:
             return resp
 
+    def _transfer(self, reports):
+        """
+        Send the reports of a record and read the response.
+        """
+        for report in reports:
+            self._write(report)
+
+        # Read the response and check for errors
+        return self._read(1)
+
+    def _timed_transfer(self, record, reports):
+        """
+        `_transfer()` with the deadline and retries given by `timeouts`.
+        """
+        timeouts = self.timeouts
+        thread = self._transferThread
+        if thread is None:
+            thread = self._transferThread = TransferThread()
+
+        timeout = timeouts.timeout(record)
+        startTime = default_timer()
+        if not thread.wait(timeout):
+            # still blocked on an earlier record that timed out
+            raise EFM8BootloaderTimeoutError(record.cmd, default_timer() - startTime)
+
+        # A transport error while writing a record of several reports may
+        # leave the start of the record in the device, which would take the
+        # header of a resent record as the rest of it. So these records are
+        # only resent if the error came after all their reports were written.
+        written = [0]
+        def transfer():
+            written[0] = 0
+            for report in reports:
+                self._write(report)
+                written[0] += 1
+            return self._read(1)
+
+        retries = timeouts.retries
+        waitTime = timeout
+        startTime = default_timer()
+        thread.start(transfer)
+        while True:
+            if thread.wait(waitTime):
+                try:
+                    response = thread.result()
+                except self._transportErrors:
+                    if retries == 0 or not timeouts.can_resend(record):
+                        raise
+                    if len(reports) > 1 and written[0] != len(reports):
+                        raise
+                    retries -= 1
+                    waitTime = timeout
+                    startTime = default_timer()
+                    thread.start(transfer)
+                    continue
+                timeouts.add(record, default_timer() - startTime)
+                return response
+
+            if retries == 0:
+                raise EFM8BootloaderTimeoutError(record.cmd, default_timer() - startTime)
+            # A slow device may still answer, give it longer before giving up
+            retries -= 1
+            waitTime *= timeouts.backoff
+
+    def _stop_transfers(self):
+        """
+        Stop the transfer thread.
+
+        Returns:
+            False if a transfer that timed out is still blocked on the device
+        """
+        thread = self._transferThread
+        if thread is None:
+            return True
+        if thread.busy and not thread.wait(0):
+            return False
+        thread.stop()
+        self._transferThread = None
+        return True
+
+    def _error(self, err):
+        """
+        Dump the flight recorder for an error before it is raised.
+
+        Returns:
+            The error
+        """
+        if self.flightRecorder is not None and self.flightRecorder.enabled:
+            self.flightRecorder.dump(err)
+        return err
+
     def identify(self, id):
         """
         Checks if the bootloader device against the given id.
@@ -117,7 +412,7 @@ class EFM8Bootloader(object):
             A named tuple with device information, or None if an unknown device
             was found
         """
-        deviceFamily = efm8boot.ids.EFM8UB_HID_DEVICES[self._hidDevice.product_id]
+        deviceFamily = efm8boot.ids.REGISTRY.parts_for_pid(self._hidDevice.product_id)
 
         for id in deviceFamily:
             if self.identify(id):
@@ -127,6 +422,33 @@ class EFM8Bootloader(object):
 
         raise EFM8BootloaderError("Could not identify EFM8 HID device")
 
+    def is_part(self, name):
+        """
+        Check if the device is the given part.
+
+        Unlike comparing against `info.name`, this only sends a single
+        identify record instead of trying every part in the device family.
+
+        Parameters:
+            name: the part name to match, e.g. "EFM8UB10F16G_QFN20"
+
+        Returns:
+            True if the device is the given part
+        """
+        if self._hasLoadedInfo:
+            return self._info.name == name
+
+        part = efm8boot.ids.REGISTRY.part(name)
+        if part is None:
+            return False
+
+        if not self.identify(part.identId):
+            return False
+
+        self._info = part.info
+        self._hasLoadedInfo = True
+        return True
+
     def get_version(self):
         """
         Get the bootloader version.
@@ -144,6 +466,7 @@ class EFM8Bootloader(object):
 
         self._write_record(SetupRecord())
         self._isWritingEnabled = True
+        self._bank = 0
 
     def disable_modifications(self):
         """
@@ -151,6 +474,19 @@ class EFM8Bootloader(object):
         """
         self._write_record(SetupRecord(keys=0x0000))
         self._isWritingEnabled = False
+        self._bank = 0
+
+    def _select_bank(self, addr):
+        """
+        Send a setup record to select the flash bank of `addr`, unless it is
+        already selected.
+        """
+        bank = addr // BANK_SIZE
+        if bank == self._bank:
+            return
+        keys = FLASH_KEYS if self._isWritingEnabled else 0x0000
+        self._write_record(SetupRecord(bank, keys))
+        self._bank = bank
 
     def erase_page(self, addr):
         """
@@ -163,7 +499,15 @@ class EFM8Bootloader(object):
             addr: a pointer anywhere inside the page
         """
         assert(addr < self.info.bootloaderStart)
-        self._write_record(EraseRecord(addr, []))
+        if self._batch is not None:
+            self._batch.erase(addr)
+            return
+        self._select_bank(addr)
+        self._write_record(self._erase_record(addr))
+
+    def _erase_record(self, addr):
+        assert(addr < self.info.bootloaderStart)
+        return EraseRecord(addr % BANK_SIZE, [])
 
     def erase_application_flash(self):
         """
@@ -186,15 +530,24 @@ class EFM8Bootloader(object):
             data: the data to write to the page. Length must be less than 128 bytes
             erase: set to true to erase the flash page before writing
         """
+        record = self._packet_record(addr, data, erase)
+        if self._batch is not None:
+            self._batch.write(addr, data, erase)
+            return
+        self._select_bank(addr)
+        self._write_record(record)
+
+    def _packet_record(self, addr, data, erase):
         assert(addr < self.info.bootloaderStart)
         assert(len(data) <= FRAME_SIZE)
 
+        # the address in the record is relative to the selected bank
         if erase:
             # Erase before write
-            self._write_record(EraseRecord(addr, data))
+            return EraseRecord(addr % BANK_SIZE, data)
         else:
             # Don't erase before write
-            self._write_record(WriteRecord(addr, data))
+            return WriteRecord(addr % BANK_SIZE, data)
 
     def write_page(self, pageAddr, data, erase=True):
         """
@@ -208,79 +561,182 @@ class EFM8Bootloader(object):
             data: the data to write to the page.
             erase: set to true to erase the flash page before writing
         """
+        if self._batch is None:
+            self._select_bank(pageAddr)
+        for record in self._page_records(pageAddr, data, erase):
+            if self._batch is not None:
+                bankStart = pageAddr - pageAddr % BANK_SIZE
+                self._batch.write(
+                    bankStart + record.addr, record.data[2:], record.cmd == CMD_ERASE
+                )
+            else:
+                self._write_record(record)
+
+    def _page_records(self, pageAddr, data, erase, blankFrames=None):
+        """
+        Generate the records used by `write_page()`.
+
+        Frames that only contain 0xFF are skipped, since writing them doesn't
+        change the flash.
+
+        Parameters:
+            blankFrames: a bool for each frame of the page that is true if the
+                frame only contains 0xFF, see `FirmwareImage.blank_frames()`
+        """
         assert(pageAddr < self.info.bootloaderStart)
         assert(pageAddr % self.info.pageSize == 0)
         assert(len(data) == self.info.pageSize)
 
-        for offset in range(0, self.info.pageSize, FRAME_SIZE):
+        for (index, offset) in enumerate(range(0, self.info.pageSize, FRAME_SIZE)):
+            frame = data[offset : offset + FRAME_SIZE]
+            if blankFrames is None:
+                isBlank = (frame == b'\xff' * len(frame))
+            else:
+                isBlank = blankFrames[index]
+
             # only erase if this is the first packet in the page to write
-            shouldErase = (offset == 0) and erase
+            if offset == 0 and erase:
+                yield self._packet_record(
+                    pageAddr, b'' if isBlank else frame, True
+                )
+            elif not isBlank:
+                yield self._packet_record(pageAddr + offset, frame, False)
 
-            self.write_packet(
-                pageAddr + offset,
-                data[offset : offset + FRAME_SIZE],
-                shouldErase
+    def _check_image_size(self, image):
+        # check that the hex file fits into the application section
+        maxAddr = image.maxaddr()
+        if maxAddr is not None and maxAddr >= self.info.bootloaderStart:
+            raise EFM8BootloaderHexError(
+                "Hex file too large. Available space for application is {} "
+                "bytes, but got {} bytes.".format(
+                    self.info.bootloaderStart,
+                    maxAddr,
+                )
             )
 
-    def _packetizeHex(self, ihex, pageSize):
+    def write_flash_hex(self, hexFile, hexFormat='hex', verifyEvery=None):
         """
-        Return all the pages in an intelhex file that contain data.
+        Write a hex file to the bootloader.
+
+        When a list of hex files is given, they are merged into a single image
+        first, so every flash page is erased and written exactly once and the
+        whole image is verified in one pass.
+
+        Images are loaded with `efm8boot.image.load_image()`, so the work of
+        parsing and encoding an image is shared between calls that flash the
+        same image.
+
+        By default the image is verified once all of it is written. With
+        `verifyEvery`, each group of that many pages is verified right after
+        it is written, so a device with a bad flash page fails early instead
+        of after the whole image is written, at the cost of extra verify
+        records.
 
         Parameters:
-            ihex: an intelhex.IntelHex file object
-            pageSize: the size of the pages
+            hexFile: a `FirmwareImage`, file name or file-like object, or a
+                list of them
+            hexFormat: file format ('hex' or 'bin')
+            verifyEvery: number of pages written between verifies, or None to
+                verify at the end
 
-        Returns:
-            An array of page tuples in the form `(pageAddr, pageData)`.
+        Raises:
+            EFM8BootloaderHexError: if the hex files overlap or don't fit in
+                the application section
+            EFM8BootloaderVerifyError: if the written flash doesn't match the
+                image
         """
-        pages = []
-        nextPage = 0x0000
+        if verifyEvery is not None and verifyEvery < 1:
+            raise ValueError("verifyEvery must be at least 1")
+
+        image = load_image(hexFile, hexFormat)
+        self._check_image_size(image)
 
-        # iterate through all the bytes in the hex file
-        for curAddr in ihex.addresses():
-            if curAddr < nextPage:
-                continue
+        # get a list of flash pages from the hex file
+        pages = image.pages(self.info.pageSize)
+
+        if len(pages) == 0:
+            return
 
-            pageStart = int(math.floor(curAddr / self.info.pageSize) * self.info.pageSize)
-            newPage = ihex.tobinstr(start=pageStart, size=self.info.pageSize)
-            pages.append((pageStart, newPage))
+        for observer in self.observers:
+            observer.flash_started(self)
+        startTime = default_timer()
 
-            nextPage = pageStart + self.info.pageSize
+        try:
+            self._write_image(image, verifyEvery)
+        except Exception as err:
+            for observer in self.observers:
+                observer.flash_finished(self, 0, default_timer() - startTime, err)
+            raise
 
-        return pages
+        nbytes = sum(len(pageData) for (_, pageData) in pages)
+        for observer in self.observers:
+            observer.flash_finished(self, nbytes, default_timer() - startTime, None)
 
-    def write_flash_hex(self, hexFile, hexFormat='hex'):
+    def _write_image(self, image, verifyEvery=None):
         """
-        Write a hex file to the bootloader.
+        Write and verify a `FirmwareImage`.
 
-        Parameters:
-            hexFile: file name or file-like object
-            hexFormat: file format ('hex' or 'bin')
+        The first time an image is written to a type of device, its records
+        are built and encoded on a background thread while the device
+        processes the previous ones, see `RecordPipeline`. The encoded
+        records are then kept in the image and reused for other devices.
         """
-        ihex = intelhex.IntelHex()
-        ihex.fromfile(hexFile, hexFormat)
+        # Enable writing to flash, the records start from bank 0
+        self._auto_modify_enable()
+        self._select_bank(0)
 
-        # check that the hex file fits into the application section
-        if ihex.maxaddr() >= self.info.bootloaderStart:
-            raise EFM8BootloaderHexError(
-                "Hex file too large. Available space for application is {} "
-                "bytes, but got {} bytes.".format(
-                    self.info.bootloaderStart,
-                    ihex.maxaddr(),
-                )
+        key = ('records', type(self), self.info, self._maxPacketSize, verifyEvery)
+        encoded = image.get_memo(key)
+
+        if encoded is None:
+            encoded = []
+            pipeline = RecordPipeline(
+                self._flash_records(image, verifyEvery), self._prepare_record
             )
+            for (record, reports) in pipeline:
+                self._write_flash_record(record, reports)
+                encoded.append((record, reports))
+            image.set_memo(key, encoded)
+        else:
+            for (record, reports) in encoded:
+                self._write_flash_record(record, reports)
 
-        # get a list of flash pages from the hex file
-        pages = self._packetizeHex(ihex, self.info.pageSize)
+        # Disable further flash modifications
+        self._auto_modify_disable()
 
-        if len(pages) == 0:
+    def _write_flash_record(self, record, reports=None):
+        """
+        Send a record while flashing an image, reporting which region
+        failed to verify.
+        """
+        if record.cmd != CMD_VERIFY:
+            self._write_record(record, reports=reports)
+            if record.cmd == CMD_SETUP:
+                self._bank = record.bank
             return
 
+        resp = self._write_record(record, raiseError=False, reports=reports)
+        if resp == efm8boot.records.CRC_ERROR:
+            raise self._error(EFM8BootloaderVerifyError(record.start, record.end))
+        elif resp != efm8boot.records.ACK:
+            raise self._error(EFM8BootloaderProtocolError(resp))
+
+    def _flash_records(self, image, verifyEvery=None):
+        """
+        Generate the records needed to write and verify a `FirmwareImage`.
+
+        The records assume flash bank 0 is selected. On parts with more than
+        one bank, the pages are written and verified one bank at a time, so
+        each bank is selected once.
+        """
+        pageSize = self.info.pageSize
+        pages = image.pages(pageSize)
+        blankFrames = image.blank_frames(pageSize)
         firstPageAddr = pages[0][0]
-        firstPageData = pages[0][1]
 
-        # Enable writing to flash
-        self._auto_modify_enable()
+        banks = OrderedDict()
+        for (pageAddr, pageData) in pages:
+            banks.setdefault(pageAddr // BANK_SIZE, []).append((pageAddr, pageData))
 
         # The bootloader checks the flash byte at 0x0000 to determine if the
         # flash is empty and will run the bootloader at start up if it is.
@@ -288,27 +744,124 @@ class EFM8Bootloader(object):
         # To help improve reliability erase this page first and write it last.
         # This way, if the bootloader is interrupted before it can write this
         # page, when the device is reset, it will still enter the bootloader.
+        # Bank 0 is then written last, so it is the only bank selected twice.
+        bankOrder = list(banks)
         if firstPageAddr == 0x0000:
             # Erase the page at start of flash
-            self.erase_page(firstPageAddr)
-        else:
-            # If the hex file doesn't write to 0x0000, then write the page now
-            self.write_page(firstPageAddr, firstPageData)
+            yield self._erase_record(firstPageAddr)
+            bankOrder = bankOrder[1:] + bankOrder[:1]
+
+        selectedBank = 0
+        for bank in bankOrder:
+            if bank != selectedBank:
+                yield SetupRecord(bank)
+                selectedBank = bank
+
+            bankPages = banks[bank]
+            if bankPages[0][0] == 0x0000:
+                # Finish with the page at start of flash
+                writeOrder = bankPages[1:] + bankPages[:1]
+            else:
+                writeOrder = bankPages
+
+            written = []
+            for (pageAddr, pageData) in writeOrder:
+                # page 0 was already erased above
+                erase = pageAddr != 0x0000
+                for record in self._page_records(pageAddr, pageData, erase,
+                                                 blankFrames[pageAddr]):
+                    yield record
+
+                if verifyEvery is not None:
+                    written.append((pageAddr, pageData))
+                    if len(written) == verifyEvery:
+                        for verifyRange in page_crc_ranges(written):
+                            yield self._verify_record(*verifyRange)
+                        written = []
+
+            if verifyEvery is not None:
+                verifyRanges = page_crc_ranges(written)
+            elif len(banks) == 1:
+                verifyRanges = image.verify_ranges(pageSize)
+            else:
+                verifyRanges = page_crc_ranges(bankPages)
+            for verifyRange in verifyRanges:
+                yield self._verify_record(*verifyRange)
+
+    def write_patch(self, patch, baseFile, hexFormat='hex', verifyBase=False,
+                    verifyEvery=None):
+        """
+        Write a per unit patch to a device that already holds the base image.
+
+        Only the pages touched by the patch are erased and written again,
+        using the contents of the base image for the rest of these pages,
+        and only these pages are verified afterwards.
+
+        Parameters:
+            patch: an `efm8boot.patch.ImagePatch`
+            baseFile: a `FirmwareImage`, file name or file-like object, or a
+                list of them, holding the common image
+            hexFormat: file format ('hex' or 'bin')
+            verifyBase: first check that the pages not touched by the patch
+                match the base image
+            verifyEvery: see `write_flash_hex()`
 
-        # Write all the other pages
-        for (pageAddr, pageData) in pages[1:]:
-            self.write_page(pageAddr, pageData)
+        Raises:
+            EFM8BootloaderVerifyError: if the device doesn't hold the base
+                image, or the patched pages don't verify
+        """
+        pageSize = self.info.pageSize
+        base = load_image(baseFile, hexFormat)
+        pageAddrs = patch.page_addrs(pageSize)
 
-        # Finally, write the page at start of flash
-        if firstPageAddr == 0x0000:
-            self.write_page(firstPageAddr, firstPageData, erase=False)
+        if verifyBase:
+            unpatched = [
+                (pageAddr, pageData) for (pageAddr, pageData) in base.pages(pageSize)
+                if pageAddr not in pageAddrs
+            ]
+            for (start, end, crc) in page_crc_ranges(unpatched):
+                self._select_bank(start)
+                self._write_flash_record(self._verify_record(start, end, crc))
 
-        for (segStart, segEnd) in ihex.segments():
-            crc = self.compute_crc(ihex.tobinstr(segStart, segEnd))
-            self.verify(segStart, segEnd, crc)
+        patched = base.patched(patch).select_pages(pageAddrs, pageSize)
+        self.write_flash_hex(patched, verifyEvery=verifyEvery)
 
-        # Disable further flash modifications
-        self._auto_modify_disable()
+    def verify_flash_hex(self, hexFile, hexFormat='hex'):
+        """
+        Check that the flash of the device matches a hex file, without
+        modifying it.
+
+        Only verify records are sent, using one CRC for each run of
+        consecutive flash pages in the hex file. The padding around the data
+        in these pages is expected to be erased (0xFF), which is the case for
+        devices flashed with `write_flash_hex()`.
+
+        Parameters:
+            hexFile: a `FirmwareImage`, file name or file-like object, or a
+                list of them
+            hexFormat: file format ('hex' or 'bin')
+
+        Returns:
+            True if the flash matches the hex file
+
+        Raises:
+            EFM8BootloaderHexError: if the hex files overlap or don't fit in
+                the application section
+        """
+        image = load_image(hexFile, hexFormat)
+        self._check_image_size(image)
+
+        for (start, end, crc) in image.verify_ranges(self.info.pageSize):
+            self._select_bank(start)
+            resp = self._write_record(
+                self._verify_record(start, end, crc), raiseError=False
+            )
+            if resp == efm8boot.records.CRC_ERROR:
+                return False
+            elif resp != efm8boot.records.ACK:
+                raise self._error(EFM8BootloaderProtocolError(resp))
+
+        return True
 
     def disable_bootloader(self):
         """
@@ -348,9 +901,6 @@ class EFM8Bootloader(object):
         Compute a CRC16 (CCITT-16, XModem) on the given flash region, and
         compare it against the given `crc` value.
 
-        Note:
-            Must call enable_modifications() before this function will work.
-
         Parameters:
             start: start address of the flash region
             end: end address of the flash region (inclusive)
@@ -360,10 +910,82 @@ class EFM8Bootloader(object):
             EFM8BootloaderProtocolError: if the crc does not match
         """
         assert(start <= end)
-        self._write_record(VerifyRecord(start, end, crc))
+        if self._batch is not None:
+            self._batch.verify(start, end, crc)
+            return
+        self._select_bank(start)
+        self._write_record(self._verify_record(start, end, crc))
+
+    def _verify_record(self, start, end, crc):
+        assert(start // BANK_SIZE == end // BANK_SIZE)
+        return VerifyRecord(start % BANK_SIZE, end % BANK_SIZE, crc)
 
-    def reset_mcu(self):
+    def batch(self):
         """
-        Resets the device and runs the application code.
+        Queue flash operations and send them together.
+
+        Inside the `with boot.batch():` block, calls to `erase_page()`,
+        `write_packet()`, `write_page()` and `verify()` are queued instead of
+        being sent. When the block exits, the queued operations are sorted by
+        address, redundant erases are dropped, small writes are merged into
+        full frames and verifies are merged and sent last, all inside a
+        single enable/disable modifications bracket. See `BatchScheduler`.
+
+        If the block raises an exception, the queued operations are dropped.
+        """
+        return EFM8Batch(self, FRAME_SIZE)
+
+    def _run_batch(self, scheduler):
+        """
+        Send the records scheduled by a `BatchScheduler`.
         """
-        self._write_record(RunAppRecord())
+        if scheduler.modifiesFlash:
+            self._auto_modify_enable()
+
+        for (bank, records) in scheduler.groups():
+            self._select_bank(bank * BANK_SIZE)
+            pipeline = RecordPipeline(records, self._prepare_record)
+            for (record, reports) in pipeline:
+                self._write_record(record, reports=reports)
+
+        if scheduler.modifiesFlash:
+            self._auto_modify_disable()
+
+    def reset_mcu(self, appWatcher=None):
+        """
+        Resets the device and runs the application code.
+
+        Parameters:
+            appWatcher: an `efm8boot.readiness.AppWatcher` used to wait for the
+                application to enumerate, or None to return once the reset
+                is acknowledged
+
+        Returns:
+            The time from the reset to the application enumerating, if
+            `appWatcher` is given
+
+        Raises:
+            EFM8BootloaderAppTimeoutError: if the application didn't enumerate
+                in time
+            EFM8BootloaderFallbackError: if the device came back as the
+                bootloader
+        """
+        if appWatcher is None:
+            self._write_record(RunAppRecord())
+            return None
+
+        appWatcher.start(self)
+        startTime = default_timer()
+        try:
+            self._write_record(RunAppRecord())
+            elapsed = appWatcher.wait(startTime)
+        except Exception as err:
+            for observer in self.observers:
+                observer.app_started(self, default_timer() - startTime, err)
+            raise
+        finally:
+            appWatcher.stop()
+
+        for observer in self.observers:
+            observer.app_started(self, elapsed, None)
+        return elapsed
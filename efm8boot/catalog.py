@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Find out which of a set of known firmware images a device holds.
+
+Example:
+
+    catalog = FirmwareCatalog()
+    catalog.add("v1.0", "app-1.0.hex")
+    catalog.add("v1.1", "app-1.1.hex")
+    with boot:
+        version = catalog.identify(boot)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+import efm8boot.records
+from efm8boot.bootloader import EFM8BootloaderProtocolError
+from efm8boot.image import compute_crc, crc_combine, load_image
+from efm8boot.records import BANK_SIZE
+
+class _Probe(object):
+    """
+    A node of the decision tree: a verify of a flash range, followed by the
+    `match` node if the CRC matches and the `mismatch` node otherwise.
+    """
+    def __init__(self, start, end, crc, match, mismatch):
+        self.start = start
+        self.end = end
+        self.crc = crc
+        self.match = match
+        self.mismatch = mismatch
+
+class _Leaf(object):
+    """
+    A leaf of the decision tree: the images that are still possible.
+    """
+    def __init__(self, names):
+        self.names = names
+
+class FirmwareCatalog(object):
+    """
+    A set of known firmware images that devices can be matched against.
+
+    The flash ranges the images differ in are used to build a decision tree
+    of verify probes, so finding which image a device holds takes about
+    log2(N) probes for N images, plus the verifies that confirm the match.
+    Pages that an image doesn't use are not known for a device holding it,
+    so they are never used as evidence against that image.
+    """
+
+    def __init__(self):
+        self._images = OrderedDict()
+        self._trees = {}
+
+    def __len__(self):
+        return len(self._images)
+
+    def add(self, name, source, hexFormat='hex'):
+        """
+        Add a known image.
+
+        Parameters:
+            name: the name returned by `identify()` for this image
+            source: a `FirmwareImage`, file name or file-like object, or a
+                list of them
+            hexFormat: file format ('hex' or 'bin')
+        """
+        self._images[name] = load_image(source, hexFormat)
+        self._trees.clear()
+
+    def _probe_ranges(self, pageSize):
+        """
+        Return the flash ranges that can tell the images apart, as a list of
+        `(start, end, crcs)` where `crcs` maps the image names to the CRC of
+        the range, or None if the image doesn't set all of it.
+        """
+        pageCrcs = OrderedDict(
+            (name, dict(
+                (pageAddr, compute_crc(pageData))
+                for (pageAddr, pageData) in image.pages(pageSize)
+            ))
+            for (name, image) in self._images.items()
+        )
+        allPages = set(
+            pageAddr for crcs in pageCrcs.values() for pageAddr in crcs
+        )
+        # pages that are different in at least one image
+        diffPages = sorted(
+            pageAddr for pageAddr in allPages
+            if len(set(crcs.get(pageAddr) for crcs in pageCrcs.values())) > 1
+        )
+
+        # ranges that start and end on a different page, the CRCs of larger
+        # ranges are built from the smaller ones. A verify record can't
+        # cross a flash bank, so neither can the ranges.
+        diffPageSet = set(diffPages)
+        ranges = OrderedDict()
+        for firstPage in diffPages:
+            bankEnd = firstPage - firstPage % BANK_SIZE + BANK_SIZE
+            lastPage = min(diffPages[-1], bankEnd - pageSize)
+            for (name, crcs) in pageCrcs.items():
+                crc = 0
+                for pageAddr in range(firstPage, lastPage + 1, pageSize):
+                    if crc is not None and pageAddr in crcs:
+                        crc = crc_combine(crc, crcs[pageAddr], pageSize)
+                    else:
+                        crc = None
+                    if pageAddr in diffPageSet:
+                        key = (firstPage, pageAddr + pageSize - 1)
+                        ranges.setdefault(key, {})[name] = crc
+
+        return sorted(
+            ((start, end, crcs) for ((start, end), crcs) in ranges.items()),
+            key=lambda item: (item[1] - item[0], item[0])
+        )
+
+    def decision_tree(self, pageSize):
+        """
+        Return the decision tree used by `identify()` for a page size.
+        """
+        if pageSize not in self._trees:
+            self._trees[pageSize] = self._build(
+                list(self._images), self._probe_ranges(pageSize)
+            )
+        return self._trees[pageSize]
+
+    def _build(self, names, probeRanges):
+        # Pick the probe that splits the remaining images most evenly, with
+        # ties going to the smallest range
+        best = None
+        for (start, end, crcs) in probeRanges:
+            for crc in sorted(set(crcs[name] for name in names) - set([None])):
+                match = [name for name in names if crcs[name] in (crc, None)]
+                mismatch = [name for name in names if crcs[name] != crc]
+                if len(match) == len(names):
+                    # the probe can't rule anything out
+                    continue
+                score = max(len(match), len(mismatch))
+                if best is None or score < best[0]:
+                    best = (score, start, end, crc, match, mismatch)
+
+        if best is None:
+            return _Leaf(names)
+
+        (_, start, end, crc, match, mismatch) = best
+        return _Probe(
+            start, end, crc,
+            self._build(match, probeRanges),
+            self._build(mismatch, probeRanges),
+        )
+
+    def _probe(self, boot, start, end, crc):
+        boot._select_bank(start)
+        resp = boot._write_record(boot._verify_record(start, end, crc), raiseError=False)
+        if resp == efm8boot.records.ACK:
+            return True
+        elif resp == efm8boot.records.CRC_ERROR:
+            return False
+        raise boot._error(EFM8BootloaderProtocolError(resp))
+
+    def identify(self, boot):
+        """
+        Find which of the images in the catalog a device holds.
+
+        Parameters:
+            boot: a connected `EFM8Bootloader`
+
+        Returns:
+            The name of the matching image, or None if none of them match
+        """
+        pageSize = boot.info.pageSize
+        node = self.decision_tree(pageSize)
+        while isinstance(node, _Probe):
+            if self._probe(boot, node.start, node.end, node.crc):
+                node = node.match
+            else:
+                node = node.mismatch
+
+        # The tree only shows which image it can be, so check all of it. If
+        # one image contains another, try the one with the most pages first.
+        candidates = sorted(
+            node.names,
+            key=lambda name: -len(self._images[name].pages(pageSize))
+        )
+        for name in candidates:
+            ranges = self._images[name].verify_ranges(pageSize)
+            if all(self._probe(boot, *verifyRange) for verifyRange in ranges):
+                return name
+        return None
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+A flight recorder that keeps the last records exchanged with a device.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import deque, namedtuple
+import binascii
+
+from timeit import default_timer
+
+from efm8boot.records import (
+    ACK, CMD_ERASE, CMD_WRITE, CMD_VERIFY, CMD_TO_STRING, ERROR_TO_STRING
+)
+
+FlightEntry = namedtuple('FlightEntry', "time cmd addr resp sent received")
+
+class FlightRecorder(object):
+    """
+    Fixed size ring buffer of the last records sent to a bootloader.
+
+    Adding an entry only appends a tuple to a `deque`, so the recorder is
+    cheap enough to leave on. The entries are only decoded when they are
+    read. When the bootloader raises a protocol error, or the transport
+    raises an error like a timeout, the recorder is dumped: the text is
+    attached to the exception as `flightLog` and written to `dumpFile`.
+
+    Parameters:
+        size: number of records kept
+        raw: also keep the HID reports sent and received
+        dumpFile: a file name or file-like object that dumps are appended
+            to, or None to only attach them to the exception
+    """
+
+    __slots__ = ('enabled', 'raw', 'dumpFile', '_entries')
+
+    def __init__(self, size=64, raw=False, dumpFile=None):
+        self.enabled = True
+        self.raw = raw
+        self.dumpFile = dumpFile
+        self._entries = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, record, resp, reports=None, response=None):
+        """
+        Add a record and the response to it, which is None if no response
+        was received.
+        """
+        if self.raw:
+            self._entries.append((default_timer(), record, resp, reports, response))
+        else:
+            self._entries.append((default_timer(), record, resp))
+
+    def clear(self):
+        self._entries.clear()
+
+    def entries(self):
+        """
+        Return the recorded entries, oldest first, as `FlightEntry` tuples.
+        """
+        result = []
+        for entry in list(self._entries):
+            if len(entry) == 5:
+                (time, record, resp, reports, response) = entry
+            else:
+                (time, record, resp) = entry
+                reports = response = None
+            if record.cmd == CMD_VERIFY:
+                addr = (record.start, record.end)
+            elif record.cmd in (CMD_ERASE, CMD_WRITE):
+                addr = record.addr
+            else:
+                addr = None
+            sent = None
+            if reports is not None:
+                sent = b''.join(bytes(bytearray(report)) for report in reports)
+            received = bytes(bytearray(response)) if response is not None else None
+            result.append(FlightEntry(time, record.cmd, addr, resp, sent, received))
+        return result
+
+    def format(self):
+        """
+        Return the entries as text, one record per line, with times relative
+        to the last record.
+        """
+        entries = self.entries()
+        if not entries:
+            return "(no records)"
+
+        lastTime = entries[-1].time
+        lines = []
+        for entry in entries:
+            if isinstance(entry.addr, tuple):
+                where = "0x{:04X}-0x{:04X}".format(*entry.addr)
+            elif entry.addr is not None:
+                where = "0x{:04X}".format(entry.addr)
+            else:
+                where = ""
+            if entry.resp is None:
+                resp = "no response"
+            elif entry.resp == ACK:
+                resp = "ACK"
+            else:
+                resp = ERROR_TO_STRING.get(entry.resp, "0x{:02X}".format(entry.resp))
+            lines.append("{:+10.6f} {:8} {:13} {}".format(
+                entry.time - lastTime,
+                CMD_TO_STRING.get(entry.cmd, "0x{:02X}".format(entry.cmd)),
+                where, resp,
+            ))
+            if entry.sent is not None:
+                lines.append("    sent     {}".format(
+                    binascii.hexlify(entry.sent).decode('ascii')
+                ))
+            if entry.received is not None:
+                lines.append("    received {}".format(
+                    binascii.hexlify(entry.received).decode('ascii')
+                ))
+        return "\n".join(lines)
+
+    def dump(self, error):
+        """
+        Dump the recorded entries for an error.
+
+        Returns:
+            The text of the dump
+        """
+        text = "EFM8 bootloader flight recorder, last {} record(s) before: {}\n{}\n".format(
+            len(self._entries), error, self.format()
+        )
+        try:
+            error.flightLog = text
+        except AttributeError:
+            pass
+
+        if self.dumpFile is None:
+            return text
+        if hasattr(self.dumpFile, 'write'):
+            self.dumpFile.write(text)
+        else:
+            with open(self.dumpFile, 'a') as f:
+                f.write(text)
+        return text
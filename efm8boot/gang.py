@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Flash many devices at once, scheduled by their place in the USB topology.
+
+Devices on the same USB bus share its bandwidth, and devices behind the same
+hub share the hub's transaction translator, so flashing all of them at once
+doesn't make things faster. `GangFlasher` runs one worker process per bus,
+and limits how many devices behind each hub are flashed at the same time.
+
+Example:
+
+    devices = efm8boot.find_devices()
+    report = GangFlasher("app.hex", maxPerHub=2).run(devices)
+    print(report.format())
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple, OrderedDict
+import ctypes
+import functools
+import multiprocessing
+import multiprocessing.sharedctypes
+import os
+import re
+import struct
+import threading
+
+from timeit import default_timer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import intelhex
+
+from efm8boot.bootloader import EFM8BootloaderError
+from efm8boot.hid_bootloader import find_devices
+from efm8boot.image import FirmwareImage, load_image
+from efm8boot.timeouts import AdaptiveTimeouts
+
+UsbLocation = namedtuple('UsbLocation', "bus hub")
+
+GangResult = namedtuple('GangResult', "path bus hub error elapsed nbytes")
+
+# hidapi libusb backend paths: "<bus>:<device>:<interface>" in hex
+_LIBUSB_PATH_RE = re.compile(r'^([0-9a-fA-F]{4}):([0-9a-fA-F]{4}):([0-9a-fA-F]{2})$')
+# sysfs names of USB devices: "<bus>-<port>.<port>..."
+_SYSFS_USB_RE = re.compile(r'^(\d+)-(\d+(?:\.\d+)*)$')
+
+SYSFS_HIDRAW = '/sys/class/hidraw'
+
+# Page size of all the known parts, see `efm8boot.ids`
+DEFAULT_PAGE_SIZE = 512
+
+# count, page size, minaddr and maxaddr of a shared image
+_SHARED_HEADER = struct.Struct('< I I i i')
+
+def usb_location(path, sysfsRoot=SYSFS_HIDRAW):
+    """
+    Find the USB bus and hub a HID device is connected to from its path.
+
+    Paths from the hidraw backend (`/dev/hidrawN`) are looked up in sysfs,
+    which gives the bus and the hub port chain. Paths from the libusb backend
+    only give the bus, so all devices on it are treated as one hub. For other
+    paths the topology is unknown, and the device is put in a group of its
+    own.
+
+    Returns:
+        A `UsbLocation` tuple of strings naming the bus and hub
+    """
+    if isinstance(path, bytes):
+        path = path.decode('utf-8')
+
+    match = _LIBUSB_PATH_RE.match(path)
+    if match:
+        bus = "usb{}".format(int(match.group(1), 16))
+        return UsbLocation(bus, bus)
+
+    if path.startswith('/dev/hidraw'):
+        devicePath = os.path.realpath(
+            os.path.join(sysfsRoot, os.path.basename(path), 'device')
+        )
+        # use the last USB device in the path, the ones before it are hubs
+        usbDevice = None
+        for component in devicePath.split(os.sep):
+            match = _SYSFS_USB_RE.match(component)
+            if match:
+                usbDevice = match
+        if usbDevice:
+            (busNum, ports) = usbDevice.groups()
+            bus = "usb{}".format(busNum)
+            if '.' in ports:
+                hub = "{}-{}".format(busNum, ports.rsplit('.', 1)[0])
+            else:
+                # connected to a port of the root hub
+                hub = bus
+            return UsbLocation(bus, hub)
+
+    return UsbLocation(path, path)
+
+def group_by_bus(paths, sysfsRoot=SYSFS_HIDRAW):
+    """
+    Group device paths by their USB bus.
+
+    Returns:
+        An `OrderedDict` mapping bus names to lists of `(path, hub)` tuples
+    """
+    groups = OrderedDict()
+    for path in paths:
+        location = usb_location(path, sysfsRoot)
+        groups.setdefault(location.bus, []).append((path, location.hub))
+    return groups
+
+def open_device(path, backend='hidapi'):
+    """
+    Open the bootloader with the given HID path.
+    """
+    devices = find_devices(path=path, backend=backend)
+    if not devices:
+        raise EFM8BootloaderError("Couldn't find device {}".format(path))
+    return devices[0]
+
+def _shared_view(shared):
+    try:
+        return memoryview(shared).cast('B')
+    except (AttributeError, TypeError):
+        # python 2 can't make a memoryview of a ctypes array
+        return None
+
+def _share_image(image, pageSize):
+    """
+    Copy the pages of an image to shared memory, so worker processes can
+    read them without each receiving a copy through a pipe.
+    """
+    pages = image.pages(pageSize)
+    minAddr = image.minaddr()
+    maxAddr = image.maxaddr()
+    header = _SHARED_HEADER.pack(
+        len(pages), pageSize,
+        -1 if minAddr is None else minAddr,
+        -1 if maxAddr is None else maxAddr,
+    ) + b''.join(struct.pack('< I', pageAddr) for (pageAddr, _) in pages)
+    shared = multiprocessing.sharedctypes.RawArray(
+        ctypes.c_ubyte, len(header) + len(pages) * pageSize
+    )
+
+    view = _shared_view(shared)
+    offset = len(header)
+    if view is not None:
+        view[:offset] = header
+        for (_, pageData) in pages:
+            view[offset : offset + pageSize] = pageData
+            offset += pageSize
+    else:
+        ctypes.memmove(shared, header, offset)
+        for (_, pageData) in pages:
+            ctypes.memmove(ctypes.addressof(shared) + offset, pageData, pageSize)
+            offset += pageSize
+    return shared
+
+class _SharedImage(FirmwareImage):
+    """
+    A `FirmwareImage` read from the shared memory written by `_share_image()`.
+
+    Its pages for the shared page size are views into the shared memory, so
+    the workers don't copy the image. The `intelhex.IntelHex` object is only
+    built from the pages if something needs it, like another page size.
+    """
+
+    def __init__(self, shared):
+        self._memo = {}
+        self._ihex = None
+        view = _shared_view(shared)
+        if view is None:
+            view = ctypes.string_at(shared, len(shared))
+        (count, pageSize, minAddr, maxAddr) = _SHARED_HEADER.unpack_from(view)
+        self._minAddr = None if minAddr < 0 else minAddr
+        self._maxAddr = None if maxAddr < 0 else maxAddr
+        pageAddrs = struct.unpack_from(
+            '< {}I'.format(count), view, _SHARED_HEADER.size
+        )
+        offset = _SHARED_HEADER.size + count * 4
+        self._sharedPageSize = pageSize
+        self.set_memo(('pages', pageSize), [
+            (pageAddr, view[offset + index * pageSize : offset + (index + 1) * pageSize])
+            for (index, pageAddr) in enumerate(pageAddrs)
+        ])
+
+    @property
+    def ihex(self):
+        if self._ihex is None:
+            ihex = intelhex.IntelHex()
+            for (pageAddr, pageData) in self.pages(self._sharedPageSize):
+                ihex.puts(pageAddr, bytes(pageData))
+            self._ihex = ihex
+        return self._ihex
+
+    def minaddr(self):
+        return self._minAddr
+
+    def maxaddr(self):
+        return self._maxAddr
+
+def _flash_device(openDevice, image, path, bus, hub, options):
+    startTime = default_timer()
+    try:
+        boot = openDevice(path)
+        if options['timeouts'] and boot.timeouts is None:
+            boot.timeouts = AdaptiveTimeouts()
+        with boot:
+            boot.write_flash_hex(image, verifyEvery=options['verifyEvery'])
+            if options['reset']:
+                boot.reset_mcu()
+        error = None
+        nbytes = sum(
+            len(pageData) for (_, pageData) in image.pages(boot.info.pageSize)
+        )
+    except Exception as err:
+        error = "{}: {}".format(type(err).__name__, err)
+        nbytes = 0
+    return GangResult(path, bus, hub, error, default_timer() - startTime, nbytes)
+
+def _bus_worker(bus, devices, sharedImage, openDevice, options, results):
+    """
+    Flash the devices on one bus, running at most `maxPerHub` devices behind
+    each hub at once.
+    """
+    image = _SharedImage(sharedImage)
+    hubLimits = dict(
+        (hub, threading.Semaphore(options['maxPerHub']))
+        for (_, hub) in devices
+    )
+
+    def flash(path, hub):
+        with hubLimits[hub]:
+            results.put(_flash_device(openDevice, image, path, bus, hub, options))
+
+    threads = [
+        threading.Thread(target=flash, args=(path, hub))
+        for (path, hub) in devices
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+class GangReport(object):
+    """
+    The results of flashing a group of devices.
+
+    Parameters:
+        results: a list of `GangResult`
+        elapsed: the total time taken
+    """
+
+    def __init__(self, results, elapsed):
+        self.results = sorted(results, key=lambda result: str(result.path))
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.error is None]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if result.error is not None]
+
+    def format(self):
+        """
+        Return a text summary of the results, one device per line.
+        """
+        lines = []
+        for result in self.results:
+            lines.append("{} ({}, hub {}): {} in {:.3f}s".format(
+                result.path, result.bus, result.hub,
+                "ok" if result.error is None else result.error,
+                result.elapsed,
+            ))
+        lines.append("{} succeeded, {} failed in {:.3f}s".format(
+            len(self.succeeded), len(self.failed), self.elapsed
+        ))
+        return "\n".join(lines)
+
+class GangFlasher(object):
+    """
+    Flashes an image to many devices, with one worker process per USB bus.
+
+    The pages of the image are built once and copied to shared memory, then
+    each worker builds the records for them once and reuses them for all of
+    its devices. Devices are opened again in the workers by their HID path.
+
+    Parameters:
+        hexFile: a `FirmwareImage`, file name or file-like object, or a list
+            of them
+        hexFormat: file format ('hex' or 'bin')
+        maxPerHub: number of devices behind the same hub to flash at once
+        verifyEvery: see `EFM8Bootloader.write_flash_hex()`
+        reset: reset the devices after they are flashed
+        useProcesses: run the bus workers in processes, if false they run in
+            threads of this process
+        openDevice: function that opens the bootloader for a HID path, by
+            default `open_device()` with `backend`. When `useProcesses` is
+            true it must be a module level function
+        sysfsRoot: directory used to look up hidraw devices
+        timeouts: give each device `efm8boot.timeouts.AdaptiveTimeouts`, so
+            a device that stops responding fails instead of blocking
+        backend: 'hidapi' or 'hidraw', see `efm8boot.find_devices()`
+        pageSize: page size of the devices, the pages of the image are
+            shared with the workers for this size
+    """
+
+    def __init__(self, hexFile, hexFormat='hex', maxPerHub=2, verifyEvery=None,
+                 reset=True, useProcesses=True, openDevice=None,
+                 sysfsRoot=SYSFS_HIDRAW, timeouts=False, backend='hidapi',
+                 pageSize=DEFAULT_PAGE_SIZE):
+        if maxPerHub < 1:
+            raise ValueError("maxPerHub must be at least 1")
+        if openDevice is None:
+            openDevice = functools.partial(open_device, backend=backend)
+        self.image = load_image(hexFile, hexFormat)
+        self.maxPerHub = maxPerHub
+        self.useProcesses = useProcesses
+        self.openDevice = openDevice
+        self.sysfsRoot = sysfsRoot
+        self.pageSize = pageSize
+        self._options = {
+            'maxPerHub': maxPerHub,
+            'verifyEvery': verifyEvery,
+            'reset': reset,
+            'timeouts': timeouts,
+        }
+
+    def plan(self, devices):
+        """
+        Return how the devices are grouped, see `group_by_bus()`.
+
+        Parameters:
+            devices: a list of bootloaders or HID paths
+        """
+        paths = [getattr(device, 'path', device) for device in devices]
+        return group_by_bus(paths, self.sysfsRoot)
+
+    def run(self, devices):
+        """
+        Flash the devices and wait for all of them to finish.
+
+        Errors are reported in the results instead of being raised.
+
+        Parameters:
+            devices: a list of bootloaders or HID paths
+
+        Returns:
+            A `GangReport`
+        """
+        startTime = default_timer()
+        groups = self.plan(devices)
+        sharedImage = _share_image(self.image, self.pageSize)
+
+        if self.useProcesses:
+            results = self._run_processes(groups, sharedImage)
+        else:
+            results = self._run_threads(groups, sharedImage)
+
+        return GangReport(results, default_timer() - startTime)
+
+    def _run_threads(self, groups, sharedImage):
+        resultQueue = queue.Queue()
+        workers = [
+            threading.Thread(target=_bus_worker, args=(
+                bus, busDevices, sharedImage, self.openDevice, self._options,
+                resultQueue
+            ))
+            for (bus, busDevices) in groups.items()
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        results = []
+        while not resultQueue.empty():
+            results.append(resultQueue.get())
+        return results
+
+    def _run_processes(self, groups, sharedImage):
+        resultQueue = multiprocessing.Queue()
+        workers = OrderedDict(
+            (bus, multiprocessing.Process(target=_bus_worker, args=(
+                bus, busDevices, sharedImage, self.openDevice, self._options,
+                resultQueue
+            )))
+            for (bus, busDevices) in groups.items()
+        )
+        for worker in workers.values():
+            worker.start()
+
+        results = {}
+        expected = sum(len(busDevices) for busDevices in groups.values())
+        while len(results) < expected:
+            try:
+                result = resultQueue.get(timeout=0.1)
+                results[result.path] = result
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers.values()):
+                    # all workers stopped, so only results already queued
+                    # can still arrive
+                    try:
+                        while True:
+                            result = resultQueue.get(timeout=0.1)
+                            results[result.path] = result
+                    except queue.Empty:
+                        break
+
+        for worker in workers.values():
+            worker.join()
+
+        # report the devices of workers that crashed
+        for (bus, busDevices) in groups.items():
+            for (path, hub) in busDevices:
+                if path not in results:
+                    results[path] = GangResult(
+                        path, bus, hub,
+                        "worker exited with code {}".format(workers[bus].exitcode),
+                        0.0, 0,
+                    )
+
+        return list(results.values())
@@ -8,13 +8,16 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import efm8boot
 from efm8boot.bootloader import (EFM8Bootloader, DEBUG_ENABLED)
 
+import efm8boot.hidraw
+
 import easyhid
 import sys
 
 if DEBUG_ENABLED:
     from hexdump import hexdump
 
-def find_devices(vid=efm8boot.ids.SILICON_LABS_USB_ID, pid=0x0000, mcu=None, path=None):
+def find_devices(vid=efm8boot.ids.SILICON_LABS_USB_ID, pid=0x0000, mcu=None, path=None,
+                 backend='hidapi'):
     """
     Find all EFM8 HID bootloaders that are connected
 
@@ -22,21 +25,36 @@ def find_devices(vid=efm8boot.ids.SILICON_LABS_USB_ID, pid=0x0000, mcu=None, pat
         vid: USB vendor id to match
         pid: USB product id to match
         mcu: microcontroller part name to match
+        backend: 'hidapi' to use easyhid, or 'hidraw' to use the Linux
+            hidraw devices directly, see `efm8boot.hidraw`
     """
     # Find all Silicon Labs USB IDs
-    en = easyhid.Enumeration(vid=vid, pid=pid)
+    if backend == 'hidraw':
+        en = efm8boot.hidraw.Enumeration(vid=vid, pid=pid)
+    else:
+        en = easyhid.Enumeration(vid=vid, pid=pid)
 
     devices = []
 
     for hidDevice in en.find(path=path):
-        if hidDevice.product_id in efm8boot.ids.EFM8UB_HID_DEVICES:
-            boot = efm8boot.EFM8BootloaderHID(hidDevice)
+        if hidDevice.product_id not in efm8boot.ids.EFM8UB_HID_DEVICES:
+            continue
+
+        # if given, check that the mcu part matches. Devices whose PID can't
+        # be the part are skipped without opening them.
+        if mcu:
+            if not efm8boot.ids.REGISTRY.pid_has_part(hidDevice.product_id, mcu):
+                continue
 
-            # if given, check that the mcu part matches
-            if mcu and boot.info.name != mcu:
+            boot = efm8boot.EFM8BootloaderHID(hidDevice)
+            with boot:
+                isMatch = boot.is_part(mcu)
+            if not isMatch:
                 continue
+        else:
+            boot = efm8boot.EFM8BootloaderHID(hidDevice)
 
-            devices.append(boot)
+        devices.append(boot)
 
     return devices
 
@@ -44,17 +62,38 @@ class EFM8BootloaderHID(EFM8Bootloader):
     HID_IN_SIZE = 4
     HID_OUT_SIZE = 64
 
+    __slots__ = ('_hidDevice', '_useOutputReports')
+
+    _transportErrors = (IOError, OSError, easyhid.HIDException)
+
     def __init__(self, hidDevice):
         """
         Create the EFM8 bootloader device
 
         Parameters:
-            hidDevice: an easyhid.HIDDevice
+            hidDevice: an easyhid.HIDDevice or efm8boot.hidraw.HidrawDevice
         """
         super(EFM8BootloaderHID, self).__init__()
         self._maxPacketSize = self.HID_OUT_SIZE
         self._hidDevice = hidDevice
 
+        # Need to send the data over the control endpoint (EP0), the behaviour
+        # of the HID drivers differs between platforms.
+        #
+        # On windows, the windows HID driver will use the EP0 if we send an
+        # output report to the interface, and won't allow data to be send
+        # using send_feature_report(). macOS has always used the same path.
+        #
+        # On Linux the using write()/read() on the HID Device don't use
+        # EP0, instead they use the endpoints associated with the HID
+        # interface. To write to the HID device on Linux, need to use
+        # send_feature_report() as this will be send across EP0.
+        #
+        # hidraw devices are only on Linux and only have feature reports.
+        self._useOutputReports = (
+            sys.platform.startswith('win') or sys.platform == 'darwin'
+        ) and not isinstance(hidDevice, efm8boot.hidraw.HidrawDevice)
+
     @property
     def path(self):
         return self._hidDevice.path
@@ -80,36 +119,40 @@ class EFM8BootloaderHID(EFM8Bootloader):
         """
         if self._mcuHasBeenReset:
             return
+        if not self._stop_transfers():
+            # A timed out transfer is still using the device, closing it
+            # under hidapi isn't safe, so leave it open.
+            self._isConnected = False
+            return
         self._hidDevice.close()
         self._isConnected = False
 
+    def _pad_report(self, data):
+        """
+        Pad a packet to match the HID report size.
+        """
+        data = bytearray(data)
+        data += bytearray(self._maxPacketSize - len(data))
+        return data
+
     def _write(self, data):
         """
         Send data to the HID bootloader.
         """
-        data = bytearray(data)
         assert(len(data) <= self._maxPacketSize)
 
-        # Pad to match HID report size
-        data += bytearray(self._maxPacketSize - len(data))
+        # Pad to match HID report size, unless already done by `_prepare_record()`
+        if len(data) != self._maxPacketSize:
+            data = self._pad_report(data)
 
         if DEBUG_ENABLED:
             print("Writing to device -> ")
             hexdump(bytes(data))
 
-        # Need to send the data over the control endpoint (EP0), the behaviour
-        # of the HID drivers differs between platforms.
-        if 'win' in sys.platform:
-            # On windows, the windows HID driver will use the EP0 if we
-            # send an output report to the interface, and won't allow data to
-            # be send using send_feature_report().
+        # See `__init__()` for how reports are sent on each platform
+        if self._useOutputReports:
             self._hidDevice.write(data)
         else:
-            # On Linux the using write()/read() on the HID Device don't use
-            # EP0, instead they use the endpoints associated with the HID
-            # interface.
-            # To write to the HID device on Linux, need to use
-            # send_feature_report() as this will be send across EP0.
             self._hidDevice.send_feature_report(data)
 
     def _read(self, size):
@@ -121,8 +164,8 @@ class EFM8BootloaderHID(EFM8Bootloader):
             print("Read from device -> ")
 
         # NOTE: Force reads to match HID_IN_SIZE
-        # NOTE: See note in `_write()` function above
-        if 'win' in sys.platform:
+        # NOTE: See note in `__init__()` function above
+        if self._useOutputReports:
             data = self._hidDevice.read(self.HID_IN_SIZE)
         else:
             data = self._hidDevice.get_feature_report(self.HID_IN_SIZE)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Direct access to Linux hidraw devices, without hidapi.
+
+Feature reports are sent with the `HIDIOCSFEATURE`/`HIDIOCGFEATURE` ioctls
+using buffers that are allocated once per device. `HidrawDevice` has the
+feature report methods of `easyhid.HIDDevice`, which `EFM8BootloaderHID`
+always uses for it, so it can be used in its place:
+
+    devices = efm8boot.find_devices(backend='hidraw')
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import re
+
+SYSFS_HIDRAW = '/sys/class/hidraw'
+
+# ioctl request numbers from <linux/hidraw.h>
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+def _IOC(direction, ioctlType, number, size):
+    return (direction << 30) | (size << 16) | (ord(ioctlType) << 8) | number
+
+def HIDIOCSFEATURE(size):
+    return _IOC(_IOC_WRITE | _IOC_READ, 'H', 0x06, size)
+
+def HIDIOCGFEATURE(size):
+    return _IOC(_IOC_WRITE | _IOC_READ, 'H', 0x07, size)
+
+# HID_ID=<bus>:<vid>:<pid> in the uevent file of the HID device
+_HID_ID_RE = re.compile(r'^HID_ID=([0-9A-Fa-f]+):([0-9A-Fa-f]+):([0-9A-Fa-f]+)$', re.M)
+
+def _default_ioctl(fd, request, buf, mutate):
+    # imported here, as fcntl doesn't exist on windows
+    import fcntl
+    return fcntl.ioctl(fd, request, buf, mutate)
+
+class HidrawDevice(object):
+    """
+    A hidraw device node, e.g. `/dev/hidraw0`.
+
+    Parameters:
+        path: the path of the device node
+        vendor_id: the USB vendor ID of the device
+        product_id: the USB product ID of the device
+        ioctl: function called like `fcntl.ioctl(fd, request, buf, True)`
+        openFile: function called like `os.open(path, flags)`
+        closeFile: function called like `os.close(fd)`
+    """
+
+    __slots__ = (
+        'path', 'vendor_id', 'product_id', '_ioctl', '_openFile', '_closeFile',
+        '_fd', '_sendBuffers', '_getBuffers',
+    )
+
+    def __init__(self, path, vendor_id=0, product_id=0, ioctl=_default_ioctl,
+                 openFile=os.open, closeFile=os.close):
+        self.path = path
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self._ioctl = ioctl
+        self._openFile = openFile
+        self._closeFile = closeFile
+        self._fd = None
+        # buffers and ioctl requests, by report size
+        self._sendBuffers = {}
+        self._getBuffers = {}
+
+    def open(self):
+        self._fd = self._openFile(self.path, os.O_RDWR)
+
+    def close(self):
+        if self._fd is not None:
+            self._closeFile(self._fd)
+            self._fd = None
+
+    def _buffer(self, buffers, size, makeRequest):
+        try:
+            return buffers[size]
+        except KeyError:
+            # the first byte is the report ID
+            entry = (bytearray(size + 1), makeRequest(size + 1))
+            buffers[size] = entry
+            return entry
+
+    def send_feature_report(self, data, report_id=0x00):
+        (buf, request) = self._buffer(self._sendBuffers, len(data), HIDIOCSFEATURE)
+        buf[0] = report_id
+        buf[1:] = data
+        return self._ioctl(self._fd, request, buf, True)
+
+    def get_feature_report(self, size, report_id=0x00):
+        (buf, request) = self._buffer(self._getBuffers, size, HIDIOCGFEATURE)
+        buf[0] = report_id
+        # `fcntl.ioctl()` raises OSError if the ioctl fails
+        self._ioctl(self._fd, request, buf, True)
+        # copy the report, as the buffer is reused
+        return bytearray(buf[1:1 + size])
+
+class Enumeration(object):
+    """
+    Finds hidraw devices by their USB IDs, with the same interface as
+    `easyhid.Enumeration`.
+
+    Parameters:
+        vid: USB vendor ID to match, or 0 for any
+        pid: USB product ID to match, or 0 for any
+        sysfsRoot: directory listing the hidraw devices
+    """
+
+    def __init__(self, vid=0, pid=0, sysfsRoot=SYSFS_HIDRAW):
+        self.vid = vid
+        self.pid = pid
+        self.sysfsRoot = sysfsRoot
+
+    def find(self, path=None):
+        if not os.path.isdir(self.sysfsRoot):
+            return []
+
+        devices = []
+        for name in sorted(os.listdir(self.sysfsRoot)):
+            devicePath = os.path.join('/dev', name)
+            if path is not None and path != devicePath:
+                continue
+            try:
+                with open(os.path.join(self.sysfsRoot, name, 'device', 'uevent')) as f:
+                    match = _HID_ID_RE.search(f.read())
+            except IOError:
+                continue
+            if not match:
+                continue
+            vid = int(match.group(2), 16)
+            pid = int(match.group(3), 16)
+            if (self.vid == 0 or vid == self.vid) and (self.pid == 0 or pid == self.pid):
+                devices.append(HidrawDevice(devicePath, vid, pid))
+        return devices
@@ -13,6 +13,10 @@ EFM8UB1_PREFIX = 0x3200
 EFM8UB2_PREFIX = 0x2800
 EFM8UB3_PREFIX = 0x3600
 
+EFM8UB1_USB_PID = 0xEAC9
+EFM8UB2_USB_PID = 0xEACA
+EFM8UB3_USB_PID = 0xEACB
+
 EFM8Info = namedtuple(
     'EFM8Info',
     " ".join([
@@ -26,34 +30,114 @@ EFM8Info = namedtuple(
     ])
 )
 
-EFM8UB1_USB_PID = 0xEAC9
-EFM8UB1_DEVICES = {
-    EFM8UB1_PREFIX | 0x41 : EFM8Info(0x41 , "EFM8UB10F16G_QFN28"  , 16 * 2**10 , 28 , "qfn28"  , 512 , 0x3A00) ,
-    EFM8UB1_PREFIX | 0x43 : EFM8Info(0x43 , "EFM8UB10F16G_QFN20"  , 16 * 2**10 , 20 , "qfn20"  , 512 , 0x3A00) ,
-    EFM8UB1_PREFIX | 0x45 : EFM8Info(0x45 , "EFM8UB11F16G_QSOP24" , 16 * 2**10 , 24 , "qsop24" , 512 , 0x3A00) ,
-    EFM8UB1_PREFIX | 0x49 : EFM8Info(0x49 , "EFM8UB10F8G_QFN20"   , 8 * 2**10  , 20 , "qfn20"  , 512 , 0x1A00) ,
-    EFM8UB1_PREFIX | 0x4A : EFM8Info(0x4A , "EFM8UB11F16G_QFN24"  , 16 * 2**10 , 24 , "qfn24"  , 512 , 0x3A00) ,
-}
+# family, USB PID of the bootloader, prefix of the identify ID
+EFM8_FAMILY_TABLE = [
+    ("EFM8UB1" , EFM8UB1_USB_PID , EFM8UB1_PREFIX) ,
+    ("EFM8UB2" , EFM8UB2_USB_PID , EFM8UB2_PREFIX) ,
+    ("EFM8UB3" , EFM8UB3_USB_PID , EFM8UB3_PREFIX) ,
+]
 
-EFM8UB2_USB_PID = 0xEACA
-EFM8UB2_DEVICES = {
-    EFM8UB2_PREFIX | 0x60 : EFM8Info(0x60 , "EFM8UB20F64G_QFP48" , 64 * 2**10 , 48 , "qfp48" , 512 , 0xF600) ,
-    EFM8UB2_PREFIX | 0x61 : EFM8Info(0x61 , "EFM8UB20F64G_QFP32" , 64 * 2**10 , 32 , "qfp32" , 512 , 0xF600) ,
-    EFM8UB2_PREFIX | 0x62 : EFM8Info(0x62 , "EFM8UB20F64G_QFN32" , 64 * 2**10 , 32 , "qfn32" , 512 , 0xF600) ,
-    EFM8UB2_PREFIX | 0x63 : EFM8Info(0x63 , "EFM8UB20F32G_QFP48" , 32 * 2**10 , 48 , "qfp48" , 512 , 0x7A00) ,
-    EFM8UB2_PREFIX | 0x64 : EFM8Info(0x64 , "EFM8UB20F32G_QFP32" , 32 * 2**10 , 32 , "qfp32" , 512 , 0x7A00) ,
-    EFM8UB2_PREFIX | 0x65 : EFM8Info(0x65 , "EFM8UB20F32G_QFN32" , 32 * 2**10 , 32 , "qfn32" , 512 , 0x7A00) ,
-}
+# To support a new part, add a row to this table. The identify ID of a part
+# is the identify prefix of its family OR'd with its chipID.
+EFM8_PART_TABLE = [
+    ("EFM8UB1" , EFM8Info(0x41 , "EFM8UB10F16G_QFN28"  , 16 * 2**10 , 28 , "qfn28"  , 512 , 0x3A00)) ,
+    ("EFM8UB1" , EFM8Info(0x43 , "EFM8UB10F16G_QFN20"  , 16 * 2**10 , 20 , "qfn20"  , 512 , 0x3A00)) ,
+    ("EFM8UB1" , EFM8Info(0x45 , "EFM8UB11F16G_QSOP24" , 16 * 2**10 , 24 , "qsop24" , 512 , 0x3A00)) ,
+    ("EFM8UB1" , EFM8Info(0x49 , "EFM8UB10F8G_QFN20"   , 8 * 2**10  , 20 , "qfn20"  , 512 , 0x1A00)) ,
+    ("EFM8UB1" , EFM8Info(0x4A , "EFM8UB11F16G_QFN24"  , 16 * 2**10 , 24 , "qfn24"  , 512 , 0x3A00)) ,
 
-EFM8UB3_USB_PID = 0xEACB
-EFM8UB3_DEVICES = {
-    EFM8UB3_PREFIX | 0x00 : EFM8Info(0x00 , "EFM8UB30F40G_QFN20"  , 40 * 2**10 , 20 , "qfn20"  , 512 , 0x9A00) ,
-    EFM8UB3_PREFIX | 0x01 : EFM8Info(0x01 , "EFM8UB31F40G_QFN24"  , 40 * 2**10 , 24 , "qfn24"  , 512 , 0x9A00) ,
-    EFM8UB3_PREFIX | 0x02 : EFM8Info(0x02 , "EFM8UB31F40G_QSOP24" , 40 * 2**10 , 24 , "qsop24" , 512 , 0x9A00) ,
-}
-
-EFM8UB_HID_DEVICES = {
-    EFM8UB1_USB_PID : EFM8UB1_DEVICES,
-    EFM8UB2_USB_PID : EFM8UB2_DEVICES,
-    EFM8UB3_USB_PID : EFM8UB3_DEVICES,
-}
+    ("EFM8UB2" , EFM8Info(0x60 , "EFM8UB20F64G_QFP48"  , 64 * 2**10 , 48 , "qfp48"  , 512 , 0xF600)) ,
+    ("EFM8UB2" , EFM8Info(0x61 , "EFM8UB20F64G_QFP32"  , 64 * 2**10 , 32 , "qfp32"  , 512 , 0xF600)) ,
+    ("EFM8UB2" , EFM8Info(0x62 , "EFM8UB20F64G_QFN32"  , 64 * 2**10 , 32 , "qfn32"  , 512 , 0xF600)) ,
+    ("EFM8UB2" , EFM8Info(0x63 , "EFM8UB20F32G_QFP48"  , 32 * 2**10 , 48 , "qfp48"  , 512 , 0x7A00)) ,
+    ("EFM8UB2" , EFM8Info(0x64 , "EFM8UB20F32G_QFP32"  , 32 * 2**10 , 32 , "qfp32"  , 512 , 0x7A00)) ,
+    ("EFM8UB2" , EFM8Info(0x65 , "EFM8UB20F32G_QFN32"  , 32 * 2**10 , 32 , "qfn32"  , 512 , 0x7A00)) ,
+
+    ("EFM8UB3" , EFM8Info(0x00 , "EFM8UB30F40G_QFN20"  , 40 * 2**10 , 20 , "qfn20"  , 512 , 0x9A00)) ,
+    ("EFM8UB3" , EFM8Info(0x01 , "EFM8UB31F40G_QFN24"  , 40 * 2**10 , 24 , "qfn24"  , 512 , 0x9A00)) ,
+    ("EFM8UB3" , EFM8Info(0x02 , "EFM8UB31F40G_QSOP24" , 40 * 2**10 , 24 , "qsop24" , 512 , 0x9A00)) ,
+]
+
+EFM8Part = namedtuple('EFM8Part', "family usbPid identId info")
+
+class EFM8Registry(object):
+    """
+    Index of the known EFM8 parts by name, chip ID, family and USB PID.
+    """
+
+    def __init__(self):
+        self._families = {}
+        self.byName = {}
+        self.byChipID = {}
+        self.byFamily = {}
+        self.byPid = {}
+
+    @classmethod
+    def from_tables(cls, familyTable, partTable):
+        registry = cls()
+        for (family, usbPid, identPrefix) in familyTable:
+            registry.add_family(family, usbPid, identPrefix)
+        for (family, info) in partTable:
+            registry.add_part(family, info)
+        return registry
+
+    def add_family(self, family, usbPid, identPrefix):
+        """
+        Register a family of parts that share a bootloader USB PID.
+        """
+        self._families[family] = (usbPid, identPrefix)
+        self.byFamily.setdefault(family, {})
+        self.byPid.setdefault(usbPid, {})
+
+    def add_part(self, family, info):
+        """
+        Register a part of a family added with `add_family()`.
+        """
+        (usbPid, identPrefix) = self._families[family]
+        identId = identPrefix | info.chipID
+        part = EFM8Part(family, usbPid, identId, info)
+
+        self.byName[info.name] = part
+        self.byChipID.setdefault(info.chipID, []).append(part)
+        self.byFamily[family][identId] = info
+        self.byPid[usbPid][identId] = info
+
+    def part(self, name):
+        """
+        Return the `EFM8Part` with the given name, or None if it is unknown.
+        """
+        return self.byName.get(name)
+
+    def parts_for_pid(self, usbPid):
+        """
+        Return a dict mapping identify IDs to `EFM8Info` for all the parts
+        that use the given bootloader USB PID.
+        """
+        return self.byPid.get(usbPid, {})
+
+    def pid_has_part(self, usbPid, name):
+        """
+        Check if a bootloader with the given USB PID can be the named part.
+        """
+        part = self.byName.get(name)
+        return part is not None and part.usbPid == usbPid
+
+REGISTRY = EFM8Registry.from_tables(EFM8_FAMILY_TABLE, EFM8_PART_TABLE)
+
+EFM8UB1_DEVICES = REGISTRY.byFamily["EFM8UB1"]
+EFM8UB2_DEVICES = REGISTRY.byFamily["EFM8UB2"]
+EFM8UB3_DEVICES = REGISTRY.byFamily["EFM8UB3"]
+
+EFM8UB_HID_DEVICES = REGISTRY.byPid
+
+def get_part_info(name):
+    """
+    Find the `EFM8Info` of a part by its name.
+
+    Returns:
+        The `EFM8Info` of the part, or None if the part is unknown
+    """
+    part = REGISTRY.part(name)
+    if part is None:
+        return None
+    return part.info
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Firmware images with memoized page maps, CRCs and encoded records.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+import hashlib
+import io
+import struct
+import sys
+import threading
+
+import crcmod
+import intelhex
+
+import efm8boot.bootloader
+from efm8boot.records import BANK_SIZE
+
+compute_crc = crcmod.predefined.mkCrcFun('xmodem')
+
+# python 2 memoryviews don't work with `bytes.join()` or crcmod
+PY2 = sys.version_info[0] < 3
+
+def crc_combine(crcA, crcB, lengthB):
+    """
+    Return the CRC of the concatenation of two blocks of data from their
+    CRCs, where `lengthB` is the length of the second block.
+
+    This works because the XModem CRC starts from zero and has no final XOR,
+    so it is linear in the data.
+    """
+    return compute_crc(b'\x00' * lengthB, crcA) ^ crcB
+
+def page_crc_ranges(pages):
+    """
+    Return the CRC of each run of consecutive pages. Runs are split at flash
+    bank boundaries, as a verify can't cross them.
+
+    Parameters:
+        pages: a list of tuples `(pageAddr, pageData)` in address order
+
+    Returns:
+        A list of tuples `(start, end, crc)`, with `end` inclusive.
+    """
+    ranges = []
+    runStart = None
+    runData = []
+    nextPage = None
+
+    for (pageAddr, pageData) in pages:
+        if (pageAddr != nextPage or pageAddr % BANK_SIZE == 0) and runData:
+            ranges.append((runStart, nextPage - 1, compute_crc(b''.join(runData))))
+            runData = []
+        if not runData:
+            runStart = pageAddr
+        runData.append(pageData)
+        nextPage = pageAddr + len(pageData)
+
+    if runData:
+        ranges.append((runStart, nextPage - 1, compute_crc(b''.join(runData))))
+
+    return ranges
+
+def _is_content(source):
+    # On python 2, `str` is used for file names, so only accept bytearrays
+    return isinstance(source, bytearray) or \
+        (bytes is not str and isinstance(source, bytes))
+
+def _ihex_digest(ihex):
+    digest = hashlib.sha256()
+    for (start, end) in ihex.segments():
+        digest.update(struct.pack('< I I', start, end))
+        digest.update(ihex.tobinstr(start, end - 1))
+    return digest.hexdigest()
+
+def _read_source(source, hexFormat):
+    """
+    Return a tuple `(key, parse)` for a hex file source, where `key` is a hash
+    of its contents and `parse()` returns it as an `intelhex.IntelHex`.
+    """
+    if isinstance(source, FirmwareImage):
+        return (source.digest, lambda: source.ihex)
+    if isinstance(source, intelhex.IntelHex):
+        return (_ihex_digest(source), lambda: source)
+
+    if _is_content(source):
+        raw = bytes(source)
+    elif hasattr(source, 'read'):
+        raw = source.read()
+    else:
+        with open(source, 'rb') as f:
+            raw = f.read()
+    if not isinstance(raw, bytes):
+        # text file-like object
+        raw = raw.encode('ascii')
+
+    def parse():
+        ihex = intelhex.IntelHex()
+        if hexFormat == 'bin':
+            ihex.frombytes(bytearray(raw))
+        else:
+            ihex.loadhex(io.StringIO(raw.decode('ascii')))
+        return ihex
+
+    key = hashlib.sha256(hexFormat.encode('ascii') + b':' + raw).hexdigest()
+    return (key, parse)
+
+def _merge(hexes, names):
+    merged = intelhex.IntelHex()
+    usedAddrs = set()
+
+    for (name, ihex) in zip(names, hexes):
+        addrs = ihex.addresses()
+        conflicts = [
+            addr for addr in addrs
+            if addr in usedAddrs and merged[addr] != ihex[addr]
+        ]
+        if conflicts:
+            raise efm8boot.bootloader.EFM8BootloaderHexError(
+                "Hex file {} overlaps a previous hex file in the address "
+                "range 0x{:04X}-0x{:04X}".format(
+                    name, min(conflicts), max(conflicts)
+                )
+            )
+
+        merged.merge(ihex, overlap='ignore')
+        usedAddrs.update(addrs)
+
+    return merged
+
+def _source_names(sources):
+    return [
+        source if isinstance(source, str) else "#{}".format(index)
+        for (index, source) in enumerate(sources)
+    ]
+
+def load_hex(hexFiles, hexFormat='hex'):
+    """
+    Load one or more hex files and merge them into a single image.
+
+    Parameters:
+        hexFiles: a file name, file-like object or `intelhex.IntelHex` object,
+            or a list of them
+        hexFormat: file format ('hex' or 'bin')
+
+    Returns:
+        An `intelhex.IntelHex` object containing the data from all the files.
+
+    Raises:
+        EFM8BootloaderHexError: if two of the files write different data to
+            the same address
+    """
+    if not isinstance(hexFiles, (list, tuple)):
+        hexFiles = [hexFiles]
+
+    hexes = [_read_source(hexFile, hexFormat)[1]() for hexFile in hexFiles]
+    return _merge(hexes, _source_names(hexFiles))
+
+class FirmwareImage(object):
+    """
+    A firmware image that can be flashed to many devices.
+
+    The page map, CRCs and encoded records of the image are computed when
+    first needed and kept, so flashing the same image again doesn't redo the
+    work. The image must not be modified after it is created.
+
+    Parameters:
+        ihex: an `intelhex.IntelHex` object with the image contents
+    """
+
+    def __init__(self, ihex):
+        self.ihex = ihex
+        self._memo = {}
+
+    @classmethod
+    def from_source(cls, source, hexFormat='hex'):
+        """
+        Create an image from a file name, file-like object, bytes of a hex file
+        or `intelhex.IntelHex` object, or a list of them to merge.
+        """
+        return cls(load_hex(source, hexFormat))
+
+    def memoize(self, key, func):
+        """
+        Return the value stored for `key`, calling `func()` to compute it the
+        first time.
+        """
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = func()
+            self._memo[key] = value
+            return value
+
+    def get_memo(self, key):
+        return self._memo.get(key)
+
+    def set_memo(self, key, value):
+        self._memo[key] = value
+
+    @property
+    def digest(self):
+        """
+        SHA-256 hash of the image contents.
+        """
+        return self.memoize('digest', lambda: _ihex_digest(self.ihex))
+
+    def minaddr(self):
+        return self.ihex.minaddr()
+
+    def maxaddr(self):
+        return self.ihex.maxaddr()
+
+    def pages(self, pageSize):
+        """
+        Return the pages of the image that contain data.
+
+        Returns:
+            A list of tuples `(pageAddr, pageData)`, with unused bytes in
+            the pages set to 0xFF.
+        """
+        return self.memoize(('pages', pageSize), lambda: self._pages(pageSize))
+
+    def _pages(self, pageSize):
+        pageAddrs = []
+        for (start, end) in self.ihex.segments():
+            firstPage = start - start % pageSize
+            for pageAddr in range(firstPage, end, pageSize):
+                if not pageAddrs or pageAddrs[-1] < pageAddr:
+                    pageAddrs.append(pageAddr)
+
+        # All the pages are kept in one read-only buffer that the devices
+        # writing the image share, each page is a view into it
+        buf = b''.join(
+            self.ihex.tobinstr(start=pageAddr, size=pageSize)
+            for pageAddr in pageAddrs
+        )
+        if not PY2:
+            buf = memoryview(buf)
+        return [
+            (pageAddr, buf[index * pageSize : (index + 1) * pageSize])
+            for (index, pageAddr) in enumerate(pageAddrs)
+        ]
+
+    def verify_ranges(self, pageSize):
+        """
+        Return the flash regions to verify after writing the image.
+
+        Pages are always written in full, so the padding between the data in
+        the image is known and runs of consecutive pages can be checked with a
+        single CRC.
+
+        Returns:
+            A list of tuples `(start, end, crc)`, with `end` inclusive.
+        """
+        return self.memoize(
+            ('verify_ranges', pageSize),
+            lambda: self._verify_ranges(pageSize)
+        )
+
+    def _verify_ranges(self, pageSize):
+        return page_crc_ranges(self.pages(pageSize))
+
+    def segment_crcs(self):
+        """
+        Return the CRC of each contiguous segment of data in the image.
+
+        Returns:
+            A list of tuples `(start, end, crc)`, with `end` inclusive.
+        """
+        return self.memoize('segment_crcs', lambda: [
+            (start, end - 1, compute_crc(self.ihex.tobinstr(start, end - 1)))
+            for (start, end) in self.ihex.segments()
+        ])
+
+    def patched(self, patch):
+        """
+        Return a new image with an `efm8boot.patch.ImagePatch` applied.
+        """
+        ihex = intelhex.IntelHex(self.ihex)
+        patch.apply(ihex)
+        return FirmwareImage(ihex)
+
+    def select_pages(self, pageAddrs, pageSize):
+        """
+        Return a new image holding only the given pages of this image, with
+        unused bytes in them set to 0xFF.
+        """
+        ihex = intelhex.IntelHex()
+        for pageAddr in pageAddrs:
+            ihex.puts(pageAddr, self.ihex.tobinstr(start=pageAddr, size=pageSize))
+        return FirmwareImage(ihex)
+
+    def blank_frames(self, pageSize, frameSize=None):
+        """
+        Return which frames of each page only contain 0xFF, and so don't need
+        to be written after the page is erased.
+
+        Returns:
+            A dict mapping page addresses to a tuple with a bool for each frame
+        """
+        if frameSize is None:
+            frameSize = efm8boot.bootloader.FRAME_SIZE
+        return self.memoize(
+            ('blank_frames', pageSize, frameSize),
+            lambda: self._blank_frames(pageSize, frameSize)
+        )
+
+    def _blank_frames(self, pageSize, frameSize):
+        blankFrame = b'\xff' * frameSize
+        return dict(
+            (pageAddr, tuple(
+                pageData[offset : offset + frameSize] == blankFrame
+                for offset in range(0, pageSize, frameSize)
+            ))
+            for (pageAddr, pageData) in self.pages(pageSize)
+        )
+
+class ImageCache(object):
+    """
+    Process wide LRU cache of firmware images keyed by a hash of the source
+    file contents.
+
+    Parameters:
+        maxEntries: the number of images to keep
+    """
+
+    def __init__(self, maxEntries=16):
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, key):
+        with self._lock:
+            image = self._images.pop(key, None)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images[key] = image
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            self._images.pop(key, None)
+            self._images[key] = image
+            while len(self._images) > self.maxEntries:
+                self._images.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+
+DEFAULT_CACHE = ImageCache()
+
+def load_image(source, hexFormat='hex', cache=DEFAULT_CACHE):
+    """
+    Load a firmware image, reusing a cached image if the same contents were
+    loaded before.
+
+    Parameters:
+        source: a `FirmwareImage`, file name, file-like object, bytes of a
+            hex file or `intelhex.IntelHex` object, or a list of them to merge
+        hexFormat: file format ('hex' or 'bin')
+        cache: the `ImageCache` to use, or None to always load the image
+
+    Returns:
+        A `FirmwareImage`
+    """
+    if isinstance(source, FirmwareImage):
+        return source
+
+    sources = source if isinstance(source, (list, tuple)) else [source]
+    loaded = [_read_source(item, hexFormat) for item in sources]
+
+    if len(loaded) == 1:
+        key = loaded[0][0]
+    else:
+        key = hashlib.sha256(
+            "|".join(itemKey for (itemKey, _) in loaded).encode('ascii')
+        ).hexdigest()
+
+    if cache is not None:
+        image = cache.get(key)
+        if image is not None:
+            return image
+
+    image = FirmwareImage(_merge(
+        [parse() for (_, parse) in loaded],
+        _source_names(sources),
+    ))
+
+    if cache is not None:
+        cache.put(key, image)
+    return image
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Operational metrics for flash sessions in the Prometheus text format.
+
+Example:
+
+    metrics = FlashMetrics(station="line-3")
+    boot.observers.append(metrics)
+    boot.write_flash_hex("app.hex")
+    metrics.write_textfile("/var/lib/node_exporter/efm8boot.prom")
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import re
+import threading
+
+from efm8boot.bootloader import (
+    EFM8BootloaderObserver, EFM8BootloaderProtocolError
+)
+from efm8boot.records import (
+    CMD_ERASE, CMD_TO_STRING, ERROR_TO_STRING
+)
+import efm8boot.ids
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+SUMMARY = 'summary'
+
+METRICS = [
+    ('efm8boot_flashes_started', COUNTER, "Flashes started"),
+    ('efm8boot_flashes_succeeded', COUNTER, "Flashes that completed"),
+    ('efm8boot_flashes_failed', COUNTER, "Flashes that failed, by error"),
+    ('efm8boot_bytes_written', COUNTER, "Bytes of flash written"),
+    ('efm8boot_phase_seconds', SUMMARY, "Time spent in each bootloader phase"),
+    ('efm8boot_device_bytes_per_second', GAUGE, "Throughput of the last flash of a device"),
+    ('efm8boot_time_to_app_seconds', SUMMARY, "Time from the reset to the application enumerating"),
+    ('efm8boot_app_starts_failed', COUNTER, "Resets after which the application didn't start, by error"),
+]
+
+_LINE_RE = re.compile(r'^([a-z0-9_]+)\{(.*)\} (\S+)$')
+_LABEL_RE = re.compile(r'([a-z_]+)="((?:[^"\\]|\\.)*)"')
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _unescape(value):
+    return value.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\')
+
+def _parse_value(text):
+    # counts are written as integers, keep them that way across reloads
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+class FlashMetrics(EFM8BootloaderObserver):
+    """
+    Collects metrics from the bootloaders it observes.
+
+    Each thread updates its own set of values, so bootloaders flashing in
+    parallel don't wait on a lock. The values are added together when the
+    metrics are exported.
+
+    Parameters:
+        station: name of the station added as a label to every metric
+    """
+
+    def __init__(self, station=""):
+        self.station = station
+        self._local = threading.local()
+        self._shards = []
+        self._shardsLock = threading.Lock()
+        self._gauges = {}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            self._local.shard = shard
+            with self._shardsLock:
+                self._shards.append(shard)
+            return shard
+
+    def _add(self, name, labels, value):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def _family(self, boot):
+        # Don't use `boot.info` here, as it sends records when it is unknown
+        if not boot._hasLoadedInfo:
+            return "unknown"
+        part = efm8boot.ids.REGISTRY.part(boot._info.name)
+        return part.family if part else "unknown"
+
+    def record_finished(self, boot, record, resp, elapsed):
+        if record.cmd == CMD_ERASE and len(record.data) > 2:
+            phase = "write"
+        else:
+            phase = CMD_TO_STRING.get(record.cmd, "other")
+        labels = (
+            ('station', self.station),
+            ('family', self._family(boot)),
+            ('phase', phase),
+        )
+        self._add('efm8boot_phase_seconds_sum', labels, elapsed)
+        self._add('efm8boot_phase_seconds_count', labels, 1)
+
+    def flash_started(self, boot):
+        labels = (('station', self.station), ('family', self._family(boot)))
+        self._add('efm8boot_flashes_started_total', labels, 1)
+
+    def flash_finished(self, boot, nbytes, elapsed, error):
+        labels = (('station', self.station), ('family', self._family(boot)))
+
+        if error is None:
+            self._add('efm8boot_flashes_succeeded_total', labels, 1)
+            self._add('efm8boot_bytes_written_total', labels, nbytes)
+            if elapsed > 0:
+                device = (
+                    ('station', self.station),
+                    ('device', str(getattr(boot, 'path', ''))),
+                )
+                self._gauges[('efm8boot_device_bytes_per_second', device)] = nbytes / elapsed
+        else:
+            if isinstance(error, EFM8BootloaderProtocolError):
+                errorName = ERROR_TO_STRING.get(error.code, str(error.code))
+            else:
+                errorName = type(error).__name__
+            self._add(
+                'efm8boot_flashes_failed_total',
+                labels + (('error', errorName),),
+                1
+            )
+
+    def app_started(self, boot, elapsed, error):
+        labels = (('station', self.station), ('family', self._family(boot)))
+
+        if error is None:
+            self._add('efm8boot_time_to_app_seconds_sum', labels, elapsed)
+            self._add('efm8boot_time_to_app_seconds_count', labels, 1)
+        else:
+            self._add(
+                'efm8boot_app_starts_failed_total',
+                labels + (('error', type(error).__name__),),
+                1
+            )
+
+    def values(self):
+        """
+        Return a dict mapping `(name, labels)` to the current metric values.
+        """
+        with self._shardsLock:
+            shards = list(self._shards)
+
+        totals = {}
+        for shard in shards:
+            for (key, value) in shard.copy().items():
+                totals[key] = totals.get(key, 0) + value
+        totals.update(self._gauges.copy())
+        return totals
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus/OpenMetrics text format.
+        """
+        values = self.values()
+        lines = []
+        for (baseName, metricType, description) in METRICS:
+            samples = sorted(
+                (key, value) for (key, value) in values.items()
+                if key[0].rsplit('_', 1)[0] == baseName or key[0] == baseName
+            )
+            if not samples:
+                continue
+            lines.append("# HELP {} {}".format(baseName, description))
+            lines.append("# TYPE {} {}".format(baseName, metricType))
+            for ((name, labels), value) in samples:
+                lines.append("{}{{{}}} {}".format(
+                    name,
+                    ",".join('{}="{}"'.format(k, _escape(v)) for (k, v) in labels),
+                    repr(float(value)) if isinstance(value, float) else value,
+                ))
+        return "\n".join(lines) + "\n"
+
+    def load_textfile(self, fileName):
+        """
+        Add the counters from a previously written text file.
+
+        This allows processes that flash a single device, like
+        `efm8boot-cli`, to keep counting across runs.
+        """
+        if not os.path.exists(fileName):
+            return
+        with open(fileName) as f:
+            for line in f:
+                match = _LINE_RE.match(line.strip())
+                if not match:
+                    continue
+                (name, labelText, value) = match.groups()
+                labels = tuple(
+                    (k, _unescape(v)) for (k, v) in _LABEL_RE.findall(labelText)
+                )
+                if name.startswith('efm8boot_device_bytes_per_second'):
+                    self._gauges.setdefault((name, labels), float(value))
+                else:
+                    self._add(name, labels, _parse_value(value))
+
+    def write_textfile(self, fileName):
+        """
+        Write the metrics to a file for the node_exporter textfile collector.
+
+        The file is replaced atomically, so the collector never reads a
+        partially written file.
+        """
+        tmpName = "{}.{}.tmp".format(fileName, os.getpid())
+        with open(tmpName, 'w') as f:
+            f.write(self.render())
+        getattr(os, 'replace', os.rename)(tmpName, fileName)
+
+    def serve(self, port, addr=''):
+        """
+        Serve the metrics over HTTP for Prometheus to scrape.
+
+        The server runs on a daemon thread.
+
+        Returns:
+            The `HTTPServer` object, call `shutdown()` on it to stop serving.
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((addr, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
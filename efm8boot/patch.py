@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Per unit patches, like serial numbers, applied on top of a common image.
+
+Example:
+
+    serial = SerialTemplate(0x3C00, "SN{:08d}")
+    boot.write_patch(serial.patch(1234), "app.hex")
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import binascii
+import struct
+
+class ImagePatch(object):
+    """
+    A list of bytes to write over an image at given addresses.
+
+    Where chunks overlap, the chunk added last is used.
+
+    Parameters:
+        chunks: a list of `(addr, data)` tuples
+    """
+
+    def __init__(self, chunks=()):
+        self.chunks = []
+        for (addr, data) in chunks:
+            self.add(addr, data)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add(self, addr, data):
+        """
+        Add bytes to write at `addr`.
+        """
+        self.chunks.append((addr, bytes(bytearray(data))))
+
+    def extend(self, patch):
+        """
+        Add the chunks of another patch to this one.
+        """
+        self.chunks.extend(patch.chunks)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Create a patch from text of the form `ADDR=HEXBYTES`, for example
+        `0x3C00=DEADBEEF`.
+        """
+        try:
+            (addr, data) = text.split('=', 1)
+            return cls([(int(addr, 0), binascii.unhexlify(data.strip()))])
+        except (ValueError, TypeError, binascii.Error):
+            raise ValueError("Bad patch '{}', expected ADDR=HEXBYTES".format(text))
+
+    def page_addrs(self, pageSize):
+        """
+        Return the sorted addresses of the pages the patch writes to.
+        """
+        pageAddrs = set()
+        for (addr, data) in self.chunks:
+            for pageAddr in range(addr - addr % pageSize, addr + len(data), pageSize):
+                pageAddrs.add(pageAddr)
+        return sorted(pageAddrs)
+
+    def apply(self, ihex):
+        """
+        Write the patch into an `intelhex.IntelHex` object.
+        """
+        for (addr, data) in self.chunks:
+            ihex.puts(addr, data)
+
+class SerialTemplate(object):
+    """
+    Creates the patch holding the serial number of a unit.
+
+    If `template` starts with one of the `struct` byte order characters
+    (`<`, `>`, `=`, `!` or `@`), the serial is packed with `struct.pack`,
+    otherwise it is formatted with `str.format` and encoded as ASCII.
+
+    Parameters:
+        addr: the address of the serial number in flash
+        template: e.g. `"SN{:08d}"` or `"<I"`
+    """
+
+    def __init__(self, addr, template):
+        self.addr = addr
+        self.template = template
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Create a template from text of the form `ADDR:TEMPLATE`, for example
+        `0x3C00:SN{:08d}`.
+        """
+        try:
+            (addr, template) = text.split(':', 1)
+            return cls(int(addr, 0), template)
+        except ValueError:
+            raise ValueError(
+                "Bad serial template '{}', expected ADDR:TEMPLATE".format(text)
+            )
+
+    def render(self, serial):
+        """
+        Return the bytes of a serial number.
+        """
+        if self.template[:1] in ('<', '>', '=', '!', '@'):
+            return struct.pack(self.template, serial)
+        return self.template.format(serial).encode('ascii')
+
+    def patch(self, serial):
+        """
+        Return the `ImagePatch` for a serial number.
+        """
+        return ImagePatch([(self.addr, self.render(serial))])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Background preparation of bootloader records.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class RecordPipeline(object):
+    """
+    Prepares records on a background thread while the previous ones are sent.
+
+    While the device is busy erasing or writing flash, the thread using the
+    bootloader is blocked waiting for the response. The pipeline uses this
+    time to build and encode the next records, so when the response arrives
+    the next HID reports are ready to send.
+
+    Iterating over the pipeline yields `(record, reports)` tuples in the same
+    order as the given records.
+
+    Parameters:
+        records: an iterable of records, evaluated on the background thread
+        prepare: function that returns the list of HID reports for a record
+        depth: number of prepared records to keep ready
+    """
+
+    _DONE = object()
+
+    def __init__(self, records, prepare, depth=2):
+        self._records = records
+        self._prepare = prepare
+        self._queue = queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce)
+        self._thread.daemon = True
+
+    def _put(self, item):
+        # Don't block forever if the consumer stopped early
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            for record in self._records:
+                if not self._put((record, self._prepare(record))):
+                    return
+        except Exception:
+            self._put((self._DONE, sys.exc_info()))
+            return
+        self._put((self._DONE, None))
+
+    def __iter__(self):
+        self._thread.start()
+        try:
+            while True:
+                (record, reports) = self._queue.get()
+                if record is self._DONE:
+                    if reports is not None:
+                        # re-raise the error from the producer thread
+                        raise reports[1]
+                    return
+                yield (record, reports)
+        finally:
+            self._stopped.set()
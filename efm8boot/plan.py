@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Plan the operations needed to flash a hex file without a device attached.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple
+import json
+import math
+
+from efm8boot.bootloader import EFM8Bootloader
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.records import (
+    ACK, CMD_ERASE, CMD_WRITE, CMD_VERIFY, CMD_TO_STRING,
+    RECORD_HEADER_SIZE,
+)
+import efm8boot.trace
+
+# Default time for one HID report on the control endpoint (seconds)
+DEFAULT_REPORT_TIME = 0.001
+
+PlanStep = namedtuple('PlanStep', "cmd name addr dataSize outReports inReports")
+
+class LatencyProfile(object):
+    """
+    Timing model used to estimate the time a flash plan takes.
+
+    Parameters:
+        reportTime: time taken by each HID report sent or read
+        commandTimes: a dict mapping command names (e.g. 'erase') to the
+            extra time taken by the device to process that command
+    """
+
+    def __init__(self, reportTime=DEFAULT_REPORT_TIME, commandTimes=None):
+        self.reportTime = reportTime
+        self.commandTimes = dict(commandTimes or {})
+
+    def step_time(self, step):
+        reports = step.outReports + step.inReports
+        return reports * self.reportTime + self.commandTimes.get(step.name, 0.0)
+
+    def to_dict(self):
+        return {
+            'reportTime': self.reportTime,
+            'commandTimes': self.commandTimes,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data.get('reportTime', DEFAULT_REPORT_TIME),
+            data.get('commandTimes'),
+        )
+
+    @classmethod
+    def load(cls, fileName):
+        """
+        Load a latency profile from a JSON file or a trace file recorded with
+        `efm8boot.trace`.
+        """
+        with open(fileName, 'rb') as f:
+            isTrace = f.read(len(efm8boot.trace.TRACE_MAGIC)) == efm8boot.trace.TRACE_MAGIC
+        if isTrace:
+            return cls.from_trace(fileName)
+        with open(fileName) as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def from_trace(cls, traceFile):
+        """
+        Measure a latency profile from a recorded trace.
+
+        The report time is taken from the fastest record per report, and the
+        remaining time of each command is averaged into `commandTimes`.
+        """
+        (_, events) = efm8boot.trace.read_trace(traceFile)
+
+        measured = []
+        writes = []
+        lastTime = events[0].time if events else 0.0
+        for event in events:
+            if event.kind == efm8boot.trace.TRACE_WRITE:
+                writes.append(event)
+                continue
+            if writes:
+                cmd = writes[0].data[2]
+                measured.append((cmd, len(writes) + 1, event.time - lastTime))
+            writes = []
+            lastTime = event.time
+
+        if not measured:
+            return cls()
+
+        reportTime = min(duration / reports for (_, reports, duration) in measured)
+        extraTimes = {}
+        for (cmd, reports, duration) in measured:
+            name = CMD_TO_STRING.get(cmd, "unknown")
+            extraTimes.setdefault(name, []).append(duration - reports * reportTime)
+        commandTimes = dict(
+            (name, sum(times) / len(times)) for (name, times) in extraTimes.items()
+        )
+        return cls(reportTime, commandTimes)
+
+class FlashPlan(object):
+    """
+    The list of records the bootloader would send for an operation.
+    """
+
+    def __init__(self, info, steps, outReportSize, inReportSize, records=None):
+        self.info = info
+        self.steps = steps
+        self.records = records or []
+        self.outReportSize = outReportSize
+        self.inReportSize = inReportSize
+
+    def summary(self):
+        """
+        Return a dict with the number of operations in the plan.
+        """
+        outReports = sum(step.outReports for step in self.steps)
+        inReports = sum(step.inReports for step in self.steps)
+        return {
+            'records': len(self.steps),
+            'erases': sum(1 for step in self.steps if step.cmd == CMD_ERASE),
+            'writeFrames': sum(
+                1 for step in self.steps
+                if step.cmd in (CMD_ERASE, CMD_WRITE) and step.dataSize > 0
+            ),
+            'dataBytes': sum(
+                step.dataSize for step in self.steps
+                if step.cmd in (CMD_ERASE, CMD_WRITE)
+            ),
+            'hidReports': outReports + inReports,
+            'verifyRanges': [
+                (step.addr[0], step.addr[1]) for step in self.steps
+                if step.cmd == CMD_VERIFY
+            ],
+            'wireBytes': outReports * self.outReportSize + inReports * self.inReportSize,
+        }
+
+    def estimate_time(self, profile=None):
+        """
+        Estimate the time taken to run the plan in seconds.
+
+        Parameters:
+            profile: a `LatencyProfile`, if not given the default one is used
+        """
+        if profile is None:
+            profile = LatencyProfile()
+        return sum(profile.step_time(step) for step in self.steps)
+
+    def format(self):
+        """
+        Return a text listing of the plan, one record per line.
+        """
+        lines = []
+        for step in self.steps:
+            if step.cmd == CMD_VERIFY:
+                where = "0x{:04X}-0x{:04X}".format(*step.addr)
+            elif step.addr is not None:
+                where = "0x{:04X}".format(step.addr)
+            else:
+                where = ""
+            lines.append("{:8} {:13} {:3} bytes  {} report(s)".format(
+                step.name, where, step.dataSize, step.outReports + step.inReports,
+            ))
+        return "\n".join(lines)
+
+class EFM8BootloaderPlanner(EFM8Bootloader):
+    """
+    A bootloader that records the records it would send instead of talking to
+    a device. Every record is answered with an ACK.
+
+    Parameters:
+        info: the `EFM8Info` of the target
+        maxPacketSize: the largest report the transport can send
+        inReportSize: the size of the response report
+    """
+
+    def __init__(self, info, maxPacketSize=EFM8BootloaderHID.HID_OUT_SIZE,
+                 inReportSize=EFM8BootloaderHID.HID_IN_SIZE):
+        super(EFM8BootloaderPlanner, self).__init__()
+        self._info = info
+        self._hasLoadedInfo = True
+        self._isConnected = True
+        self._maxPacketSize = maxPacketSize
+        self._inReportSize = inReportSize
+        self.steps = []
+        self.records = []
+
+    def connect(self):
+        pass
+
+    def disconnet(self):
+        pass
+
+    def _write_record(self, record, raiseError=True, reports=None):
+        dataSize = len(record.data)
+        addr = None
+        if record.cmd == CMD_VERIFY:
+            addr = (record.start, record.end)
+            dataSize = 0
+        elif record.cmd in (CMD_ERASE, CMD_WRITE):
+            addr = record.addr
+            dataSize -= 2
+
+        recordSize = len(record.data) + RECORD_HEADER_SIZE
+        self.records.append(record)
+        self.steps.append(PlanStep(
+            record.cmd,
+            CMD_TO_STRING.get(record.cmd, "unknown"),
+            addr,
+            dataSize,
+            int(math.ceil(recordSize / self._maxPacketSize)),
+            1,
+        ))
+
+        if not raiseError:
+            return ACK
+
+    def plan(self):
+        return FlashPlan(
+            self._info, self.steps, self._maxPacketSize, self._inReportSize,
+            self.records
+        )
+
+def plan_flash_hex(hexFile, info, hexFormat='hex', reset=True, verifyEvery=None):
+    """
+    Plan the records `write_flash_hex` would send to a device.
+
+    Parameters:
+        hexFile: a `FirmwareImage`, file name or file-like object, or a list
+            of them
+        info: the `EFM8Info` of the target
+        hexFormat: file format ('hex' or 'bin')
+        reset: include the reset after flashing in the plan
+        verifyEvery: see `EFM8Bootloader.write_flash_hex()`
+
+    Returns:
+        A `FlashPlan`
+
+    Raises:
+        EFM8BootloaderHexError: if the hex files overlap or don't fit in the
+            application section
+    """
+    planner = EFM8BootloaderPlanner(info)
+    planner.write_flash_hex(hexFile, hexFormat, verifyEvery)
+    if reset:
+        planner.reset_mcu()
+    return planner.plan()
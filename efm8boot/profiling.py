@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Break down where the time of a bootloader session goes.
+
+Host side phases, like parsing a hex file, are timed with `phase()`. The
+records sent to the device are timed by observing the bootloader, so for
+them the difference between the wall time and the host CPU time is the time
+spent waiting on the device.
+
+Example:
+
+    profiler = PhaseProfiler()
+    with profiler.phase('parse'):
+        image = load_image("app.hex")
+    profiler.attach(boot)
+    boot.write_flash_hex(image)
+    print(profiler.format())
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+import functools
+import math
+import pstats
+import threading
+import time
+
+from timeit import default_timer
+
+from efm8boot.bootloader import EFM8BootloaderObserver
+from efm8boot.records import CMD_ERASE, CMD_TO_STRING, RECORD_HEADER_SIZE
+
+if hasattr(time, 'thread_time'):
+    thread_time = time.thread_time
+elif hasattr(time, 'process_time'):
+    thread_time = time.process_time
+else:
+    thread_time = time.clock
+
+if hasattr(time, 'process_time'):
+    process_time = time.process_time
+else:
+    process_time = time.clock
+
+# Order of the phases in reports, other phases are listed after them
+PHASES = [
+    'startup', 'enumerate', 'identify', 'parse', 'packetize',
+    'setup', 'erase', 'write', 'verify', 'lock', 'reset',
+]
+
+class _PhaseStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.reports = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+class PhaseProfiler(EFM8BootloaderObserver):
+    """
+    Collects call counts, HID report counts, wall time and host CPU time for
+    each phase of a bootloader session.
+
+    Host CPU time is measured per thread where the platform supports it, so
+    work done on other threads, like the record pipeline, is not counted in
+    the phases of the thread using the bootloader. As the 'packetize' phase
+    runs on the pipeline thread while the device is busy, the total wall
+    time can be more than the time the session took.
+
+    Parameters:
+        cprofile: also run `cProfile` during the host side phases, see
+            `dump_stats()`
+    """
+
+    def __init__(self, cprofile=False):
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cprofile = cprofile
+        self._profiles = []
+
+    def add(self, name, calls=1, reports=0, wall=0.0, cpu=0.0):
+        """
+        Add a measurement to a phase.
+        """
+        with self._lock:
+            stats = self._phases.setdefault(name, _PhaseStats())
+            stats.calls += calls
+            stats.reports += reports
+            stats.wall += wall
+            stats.cpu += cpu
+
+    def _profile(self):
+        try:
+            return self._local.profile
+        except AttributeError:
+            profile = cProfile.Profile()
+            self._local.profile = profile
+            with self._lock:
+                self._profiles.append(profile)
+            return profile
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that times a host side phase.
+        """
+        # only the outermost phase of a thread controls cProfile
+        depth = getattr(self._local, 'depth', 0)
+        profile = self._profile() if self._cprofile and depth == 0 else None
+        self._local.depth = depth + 1
+        startWall = default_timer()
+        startCpu = thread_time()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            self._local.depth = depth
+            self.add(
+                name,
+                wall=default_timer() - startWall,
+                cpu=thread_time() - startCpu,
+            )
+
+    def wrap(self, name, func):
+        """
+        Return a function that calls `func` in the phase `name`.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def attach(self, boot):
+        """
+        Profile the records sent by a bootloader and the encoding of them.
+        """
+        boot.observers.append(self)
+        boot._prepareHook = self.wrap('packetize', boot._encode_record)
+
+    def record_started(self, boot, record):
+        self._local.recordCpu = thread_time()
+
+    def record_finished(self, boot, record, resp, elapsed):
+        if record.cmd == CMD_ERASE and len(record.data) > 2:
+            name = 'write'
+        else:
+            name = CMD_TO_STRING.get(record.cmd, 'other')
+        recordSize = len(record.data) + RECORD_HEADER_SIZE
+        self.add(
+            name,
+            # the reports sent and the response read back
+            reports=int(math.ceil(recordSize / boot._maxPacketSize)) + 1,
+            wall=elapsed,
+            cpu=thread_time() - self._local.recordCpu,
+        )
+
+    def report(self):
+        """
+        Return the measurements as a dict that can be serialized to JSON.
+        """
+        with self._lock:
+            names = [name for name in PHASES if name in self._phases]
+            names += sorted(name for name in self._phases if name not in PHASES)
+            phases = OrderedDict(
+                (name, OrderedDict([
+                    ('calls', self._phases[name].calls),
+                    ('reports', self._phases[name].reports),
+                    ('wall', self._phases[name].wall),
+                    ('cpu', self._phases[name].cpu),
+                ]))
+                for name in names
+            )
+        return OrderedDict([
+            ('phases', phases),
+            ('wall', sum(phase['wall'] for phase in phases.values())),
+            ('cpu', sum(phase['cpu'] for phase in phases.values())),
+        ])
+
+    def format(self):
+        """
+        Return the measurements as a text table.
+        """
+        report = self.report()
+        lines = ["{:10} {:>6} {:>8} {:>10} {:>10} {:>10}".format(
+            "phase", "calls", "reports", "wall (s)", "cpu (s)", "wait (s)"
+        )]
+        for (name, phase) in report['phases'].items():
+            lines.append("{:10} {:6} {:8} {:10.4f} {:10.4f} {:10.4f}".format(
+                name, phase['calls'], phase['reports'], phase['wall'],
+                phase['cpu'], max(phase['wall'] - phase['cpu'], 0.0),
+            ))
+        lines.append("{:10} {:6} {:8} {:10.4f} {:10.4f} {:10.4f}".format(
+            "total", "", "", report['wall'], report['cpu'],
+            max(report['wall'] - report['cpu'], 0.0),
+        ))
+        return "\n".join(lines)
+
+    def dump_stats(self, fileName):
+        """
+        Write the `cProfile` data of the host side phases of all threads to
+        a file that can be read with `pstats`.
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(fileName)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Waiting for a device to start its application after a reset.
+
+After the `RunAppRecord` sent by `reset_mcu()`, the bootloader waits 100 ms,
+resets the MCU and the device re-enumerates with the USB identity of the
+application. `AppWatcher` waits for that identity to appear. It wakes up on
+udev events when pyudev is installed, and polls the HID enumeration
+otherwise.
+
+Example:
+
+    watcher = AppWatcher(vid=0x1209, pid=0x0001, timeout=5.0)
+    with boot:
+        boot.write_flash_hex("app.hex")
+        elapsed = boot.reset_mcu(appWatcher=watcher)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from timeit import default_timer
+import sys
+import time
+
+import easyhid
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+from efm8boot.bootloader import (
+    EFM8BootloaderAppTimeoutError, EFM8BootloaderFallbackError
+)
+import efm8boot.hidraw
+import efm8boot.ids
+
+DEFAULT_TIMEOUT = 5.0
+POLL_INTERVAL = 0.05
+
+# Longest wait between enumerations when using udev events, in case the
+# device isn't listed yet when its event arrives
+UDEV_RECHECK = 0.5
+
+class PollingMonitor(object):
+    """
+    Change source that wakes up every `interval` seconds.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+
+    def start(self):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(max(0.0, min(timeout, self.interval)))
+
+    def stop(self):
+        pass
+
+class UdevMonitor(object):
+    """
+    Change source that wakes up when udev reports that a device of
+    `subsystem` was added or removed. Needs pyudev.
+    """
+
+    def __init__(self, subsystem='hidraw'):
+        if pyudev is None:
+            raise ImportError(
+                "UdevMonitor needs pyudev, install it with `pip install pyudev`"
+            )
+        self.subsystem = subsystem
+        self._monitor = None
+
+    def start(self):
+        # Started before the reset, so the events of the device aren't missed
+        self._monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        self._monitor.filter_by(self.subsystem)
+        self._monitor.start()
+
+    def wait(self, timeout):
+        self._monitor.poll(timeout=max(0.0, min(timeout, UDEV_RECHECK)))
+
+    def stop(self):
+        self._monitor = None
+
+def default_monitor():
+    """
+    Return a `UdevMonitor` on Linux when pyudev is installed, otherwise a
+    `PollingMonitor`.
+    """
+    if pyudev is not None and sys.platform.startswith('linux'):
+        return UdevMonitor()
+    return PollingMonitor()
+
+class AppWatcher(object):
+    """
+    Waits for a device to re-enumerate as its application after a reset.
+
+    The application is found by its USB VID/PID, its HID path, or both.
+    Devices with that identity that were already connected before the reset
+    are ignored. If the device comes back as an EFM8 bootloader instead, the
+    application didn't start, for example because it jumped back to the
+    bootloader, and `EFM8BootloaderFallbackError` is raised.
+
+    Parameters:
+        vid: USB vendor id of the application, 0 to match any
+        pid: USB product id of the application, 0 to match any
+        path: HID path of the application, or None to match any
+        timeout: seconds from the reset to wait for the application
+        backend: 'hidapi' or 'hidraw', see `efm8boot.find_devices()`
+        monitor: the change source used between enumerations, by default
+            from `default_monitor()`
+        enumeration: called like `easyhid.Enumeration(vid=vid, pid=pid)` to
+            list the HID devices, instead of the one given by `backend`
+    """
+
+    def __init__(self, vid=0, pid=0, path=None, timeout=DEFAULT_TIMEOUT,
+                 backend='hidapi', monitor=None, enumeration=None):
+        if not (vid or pid or path):
+            raise ValueError("AppWatcher needs a VID/PID or a HID path")
+        self.vid = vid
+        self.pid = pid
+        self.path = path
+        self.timeout = timeout
+        self.backend = backend
+        self.monitor = monitor if monitor is not None else default_monitor()
+        self.enumeration = enumeration
+
+        # HID path of the application once it is found
+        self.appPath = None
+
+        self._otherApps = set()
+        self._otherBootloaders = set()
+        self._bootloaderGone = False
+
+    def _find(self, vid, pid, path=None):
+        if self.enumeration is not None:
+            en = self.enumeration(vid=vid, pid=pid)
+        elif self.backend == 'hidraw':
+            en = efm8boot.hidraw.Enumeration(vid=vid, pid=pid)
+        else:
+            en = easyhid.Enumeration(vid=vid, pid=pid)
+        return en.find(path=path)
+
+    def _app_paths(self):
+        return set(dev.path for dev in self._find(self.vid, self.pid, self.path))
+
+    def _bootloader_paths(self):
+        return set(
+            dev.path for dev in self._find(efm8boot.ids.SILICON_LABS_USB_ID, 0)
+            if dev.product_id in efm8boot.ids.EFM8UB_HID_DEVICES
+        )
+
+    def start(self, boot):
+        """
+        Called by `reset_mcu()` before the reset, to note the devices that
+        are already connected.
+        """
+        self.appPath = None
+        self._otherApps = self._app_paths()
+        self._otherBootloaders = self._bootloader_paths()
+        self._otherBootloaders.discard(getattr(boot, 'path', None))
+        self._bootloaderGone = False
+        self.monitor.start()
+
+    def stop(self):
+        self.monitor.stop()
+
+    def poll(self):
+        """
+        Check the connected devices once.
+
+        Returns:
+            True if the application has enumerated
+
+        Raises:
+            EFM8BootloaderFallbackError: if a bootloader appeared after the
+                one that was reset went away
+        """
+        newApps = self._app_paths() - self._otherApps
+        if newApps:
+            self.appPath = sorted(newApps)[0]
+            return True
+
+        # The bootloader that was reset is still listed until the MCU resets
+        bootloaders = self._bootloader_paths() - self._otherBootloaders
+        if not bootloaders:
+            self._bootloaderGone = True
+        elif self._bootloaderGone:
+            raise EFM8BootloaderFallbackError(sorted(bootloaders)[0])
+        return False
+
+    def wait(self, startTime=None):
+        """
+        Wait for the application to enumerate.
+
+        Parameters:
+            startTime: `default_timer()` when the reset was sent, the
+                timeout and the returned time are counted from it
+
+        Returns:
+            The time from `startTime` to the application enumerating
+
+        Raises:
+            EFM8BootloaderAppTimeoutError: if the application didn't enumerate
+                before the timeout
+            EFM8BootloaderFallbackError: if the device came back as the
+                bootloader
+        """
+        if startTime is None:
+            startTime = default_timer()
+        deadline = startTime + self.timeout
+        while True:
+            if self.poll():
+                return default_timer() - startTime
+            remaining = deadline - default_timer()
+            if remaining <= 0:
+                raise EFM8BootloaderAppTimeoutError(self.timeout)
+            self.monitor.wait(remaining)
@@ -20,6 +20,16 @@ CMD_VERIFY   = 0x34
 CMD_LOCK     = 0x35
 CMD_RUN_APP  = 0x36
 
+CMD_TO_STRING = {
+    CMD_IDENTIFY : "identify",
+    CMD_SETUP : "setup",
+    CMD_ERASE : "erase",
+    CMD_WRITE : "write",
+    CMD_VERIFY : "verify",
+    CMD_LOCK : "lock",
+    CMD_RUN_APP : "reset",
+}
+
 # Command response values
 ACK = 0x40
 RANGE_ERROR = 0x41
@@ -35,6 +45,10 @@ ERROR_TO_STRING = {
 
 RECORD_HEADER_SIZE = 3
 
+# Records hold 16 bit addresses, flash above 64 kB is reached by selecting
+# a bank with a setup record
+BANK_SIZE = 0x10000
+
 class Record(object):
     """
     Base class for EFM8 bootloader records.
@@ -63,6 +77,30 @@ class Record(object):
             self.cmd,
         ]) + bytearray(self.data)
 
+    @staticmethod
+    def from_bytes(data):
+        """
+        Decode a record encoded with `to_bytes()`.
+        """
+        data = bytearray(data)
+        if len(data) < RECORD_HEADER_SIZE + 2 or data[0] != FRAME_START_BYTE \
+                or data[1] != len(data) - 2:
+            raise ValueError("Bad record: {}".format(bytes(data)))
+
+        cmd = data[2]
+        payload = bytes(data[3:])
+        if cmd == CMD_VERIFY:
+            return VerifyRecord(*struct.unpack('> H H H', payload[:6]))
+        elif cmd in (CMD_ERASE, CMD_WRITE):
+            (addr,) = struct.unpack('> H', payload[:2])
+            if cmd == CMD_ERASE:
+                return EraseRecord(addr, payload[2:])
+            return WriteRecord(addr, payload[2:])
+        elif cmd == CMD_SETUP and len(payload) == 3:
+            (keys, bank) = struct.unpack('> H B', payload)
+            return SetupRecord(bank, keys)
+        return Record(cmd, payload)
+
 class IdentifyRecord(Record):
     """
     Command used to identify the device.
@@ -86,6 +124,8 @@ class SetupRecord(Record):
     """
     def __init__(self, bank=0x00, keys=FLASH_KEYS):
         data = struct.pack('> H B', keys, bank)
+        self.bank = bank
+        self.keys = keys
         super(SetupRecord, self).__init__(CMD_SETUP, data)
 
 class EraseRecord(Record):
@@ -103,6 +143,7 @@ class EraseRecord(Record):
         address = struct.pack('> H', addr)
         assert(0 <= len(data) <= 128)
         record_data = address + bytearray(data)
+        self.addr = addr
         super(EraseRecord, self).__init__(CMD_ERASE, record_data)
 
 class WriteRecord(Record):
@@ -120,6 +161,7 @@ class WriteRecord(Record):
         address = struct.pack('> H', addr)
         assert(1 <= len(data) <= 128)
         record_data = address + bytearray(data)
+        self.addr = addr
         super(WriteRecord, self).__init__(CMD_WRITE, record_data)
 
 class VerifyRecord(Record):
@@ -133,6 +175,9 @@ class VerifyRecord(Record):
     """
     def __init__(self, addr1, addr2, crc):
         record_data = struct.pack('> H H H', addr1, addr2, crc)
+        self.start = addr1
+        self.end = addr2
+        self.crc = crc
         super(VerifyRecord, self).__init__(CMD_VERIFY, record_data)
 
 class LockRecord(Record):
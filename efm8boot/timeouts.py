@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Deadlines for records, adapted to the measured latency of each device.
+
+Example:
+
+    boot.timeouts = AdaptiveTimeouts()
+    with boot:
+        boot.write_flash_hex("app.hex")
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import deque
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from efm8boot.records import CMD_ERASE, CMD_WRITE, CMD_VERIFY, CMD_RUN_APP
+
+# Used until a command has enough samples, in seconds
+INITIAL_TIMEOUTS = {
+    CMD_ERASE: 2.0,
+    CMD_WRITE: 1.0,
+    CMD_VERIFY: 2.0,
+}
+DEFAULT_INITIAL_TIMEOUT = 1.0
+
+# Lower bound of the adapted timeouts, so a device that was very fast for a
+# while isn't given up on after a short hiccup of the host, in seconds
+MIN_TIMEOUTS = {
+    CMD_ERASE: 0.25,
+    CMD_WRITE: 0.1,
+    CMD_VERIFY: 0.1,
+}
+DEFAULT_MIN_TIMEOUT = 0.05
+
+# The time a verify takes grows with the size of the range, so its samples
+# are kept per block of this many bytes
+VERIFY_BLOCK_SIZE = 512
+
+class AdaptiveTimeouts(object):
+    """
+    Per command timeouts for the records sent to one device.
+
+    The round trip times of the last `window` records of each command are
+    kept, and the timeout of the command is `multiplier` times the
+    `percentile` of them. Until `minSamples` round trips have been seen,
+    the initial timeout of the command is used.
+
+    When the response to a record doesn't arrive in time, the bootloader
+    waits `backoff` times as long again, or sends the record again if the
+    transport reported an error, up to `retries` times. After that, it
+    raises `EFM8BootloaderTimeoutError`.
+
+    Parameters:
+        multiplier: timeout as a multiple of the measured latency
+        percentile: percentile of the recent round trip times used, 0 to 1
+        window: number of recent round trip times kept per command
+        minSamples: number of round trips needed before adapting
+        maxTimeout: upper bound of the timeouts, in seconds
+        retries: number of extra attempts for one record
+        backoff: how much longer each extra wait for a response is
+        initial: dict of command IDs to their initial timeouts
+        minimum: dict of command IDs to their smallest timeouts
+    """
+
+    __slots__ = (
+        'multiplier', 'percentile', 'window', 'minSamples', 'maxTimeout',
+        'retries', 'backoff', 'initial', 'minimum', '_samples',
+    )
+
+    def __init__(self, multiplier=4.0, percentile=0.95, window=32, minSamples=4,
+                 maxTimeout=10.0, retries=1, backoff=2.0, initial=None,
+                 minimum=None):
+        self.multiplier = multiplier
+        self.percentile = percentile
+        self.window = window
+        self.minSamples = minSamples
+        self.maxTimeout = maxTimeout
+        self.retries = retries
+        self.backoff = backoff
+        self.initial = dict(INITIAL_TIMEOUTS)
+        self.initial.update(initial or {})
+        self.minimum = dict(MIN_TIMEOUTS)
+        self.minimum.update(minimum or {})
+        self._samples = {}
+
+    def _units(self, record):
+        if record.cmd == CMD_VERIFY:
+            return max(1, (record.end - record.start + 1) // VERIFY_BLOCK_SIZE)
+        return 1
+
+    def latency(self, cmd):
+        """
+        Return the latency estimate of a command, or None if there aren't
+        enough samples yet.
+        """
+        samples = self._samples.get(cmd)
+        if not samples or len(samples) < self.minSamples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(round(self.percentile * (len(ordered) - 1)))]
+
+    def timeout(self, record):
+        """
+        Return the time to wait for the response to a record, in seconds.
+        """
+        cmd = record.cmd
+        latency = self.latency(cmd)
+        if latency is None:
+            timeout = self.initial.get(cmd, DEFAULT_INITIAL_TIMEOUT)
+        else:
+            timeout = max(
+                self.multiplier * latency,
+                self.minimum.get(cmd, DEFAULT_MIN_TIMEOUT),
+            )
+        return min(timeout * self._units(record), self.maxTimeout)
+
+    def add(self, record, elapsed):
+        """
+        Add the round trip time of a record that was answered.
+        """
+        samples = self._samples.get(record.cmd)
+        if samples is None:
+            samples = self._samples[record.cmd] = deque(maxlen=self.window)
+        samples.append(elapsed / self._units(record))
+
+    def can_resend(self, record):
+        """
+        Return true if the record can be sent again after a transport error.
+        All records except reset can be repeated without changing the result.
+        """
+        return record.cmd != CMD_RUN_APP
+
+class TransferThread(object):
+    """
+    Runs the transfers of one device on a background thread, so the thread
+    using the bootloader can stop waiting for them.
+
+    A transfer that never finishes keeps the thread blocked, so `busy`
+    stays true and no more transfers can be started.
+    """
+
+    __slots__ = ('busy', '_requests', '_done', '_result', '_thread')
+
+    def __init__(self):
+        self.busy = False
+        self._requests = queue.Queue()
+        self._done = threading.Event()
+        self._result = None
+        self._thread = None
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            (func, args) = request
+            try:
+                self._result = (func(*args), None)
+            except Exception as err:
+                self._result = (None, err)
+            self._done.set()
+
+    def start(self, func, *args):
+        """
+        Start calling `func(*args)` on the thread.
+        """
+        assert not self.busy
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self.busy = True
+        self._done.clear()
+        self._requests.put((func, args))
+
+    def wait(self, timeout):
+        """
+        Wait for the transfer to finish.
+
+        Returns:
+            True if it finished, False if the timeout expired first
+        """
+        if not self.busy:
+            return True
+        if not self._done.wait(timeout):
+            return False
+        self.busy = False
+        return True
+
+    def result(self):
+        """
+        Return the result of the finished transfer, or raise its error.
+        """
+        (result, err) = self._result
+        self._result = None
+        if err is not None:
+            raise err
+        return result
+
+    def stop(self):
+        """
+        Stop the thread once it is idle.
+        """
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread = None
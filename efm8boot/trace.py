@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Capture and replay of the HID reports exchanged with an EFM8 bootloader.
+
+A trace file starts with a header, followed by one event per HID report:
+
+    header: magic(8 bytes) vid(uint16) pid(uint16)
+    event:  kind(uint8) timestamp in ns(uint64) length(uint8) data
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from binascii import hexlify
+from collections import namedtuple
+from timeit import default_timer
+import struct
+import time
+
+from efm8boot.bootloader import EFM8BootloaderError
+
+TRACE_MAGIC = b'EFM8TRC1'
+TRACE_HEADER = struct.Struct('< 8s H H')
+TRACE_EVENT = struct.Struct('< B Q B')
+
+TRACE_WRITE = 0x57 # 'W'
+TRACE_READ = 0x52 # 'R'
+
+TraceHeader = namedtuple('TraceHeader', "vid pid")
+TraceEvent = namedtuple('TraceEvent', "kind time data")
+
+class EFM8BootloaderTraceError(EFM8BootloaderError):
+    """
+    Error used when a trace file is invalid or a replay doesn't match it.
+    """
+    pass
+
+def _open_trace(traceFile, mode):
+    if hasattr(traceFile, 'read') or hasattr(traceFile, 'write'):
+        return (traceFile, False)
+    else:
+        return (open(traceFile, mode), True)
+
+def read_trace(traceFile):
+    """
+    Read a trace file.
+
+    Parameters:
+        traceFile: file name or binary file-like object
+
+    Returns:
+        A tuple `(header, events)` where `header` is a `TraceHeader` and
+        `events` is a list of `TraceEvent`s. Event times are in seconds since
+        the start of the trace.
+    """
+    (f, shouldClose) = _open_trace(traceFile, 'rb')
+    try:
+        raw = f.read()
+    finally:
+        if shouldClose:
+            f.close()
+
+    if len(raw) < TRACE_HEADER.size:
+        raise EFM8BootloaderTraceError("Trace file is truncated")
+    (magic, vid, pid) = TRACE_HEADER.unpack_from(raw, 0)
+    if magic != TRACE_MAGIC:
+        raise EFM8BootloaderTraceError("Not an efm8boot trace file")
+
+    events = []
+    offset = TRACE_HEADER.size
+    while offset < len(raw):
+        (kind, timestamp, length) = TRACE_EVENT.unpack_from(raw, offset)
+        offset += TRACE_EVENT.size
+        data = bytearray(raw[offset:offset+length])
+        if len(data) != length:
+            raise EFM8BootloaderTraceError("Trace file is truncated")
+        offset += length
+        events.append(TraceEvent(kind, timestamp * 1e-9, data))
+
+    return (TraceHeader(vid, pid), events)
+
+class TraceRecorder(object):
+    """
+    Wraps a HID device and logs every report sent to and read from it.
+
+    The recorder can be used anywhere an `easyhid.HIDDevice` is expected, for
+    example `EFM8BootloaderHID(TraceRecorder(hidDevice, "session.trace"))`.
+
+    Parameters:
+        hidDevice: the HID device to wrap
+        traceFile: file name or binary file-like object to write the trace to
+    """
+
+    def __init__(self, hidDevice, traceFile):
+        self._hidDevice = hidDevice
+        (self._traceFile, self._ownsFile) = _open_trace(traceFile, 'wb')
+        self._startTime = default_timer()
+
+        self._traceFile.write(TRACE_HEADER.pack(
+            TRACE_MAGIC, hidDevice.vendor_id, hidDevice.product_id
+        ))
+
+    def __getattr__(self, name):
+        # Pass through attributes like `path`, `vendor_id` and `product_id`
+        return getattr(self._hidDevice, name)
+
+    def _log(self, kind, data):
+        timestamp = int((default_timer() - self._startTime) * 1e9)
+        self._traceFile.write(TRACE_EVENT.pack(kind, timestamp, len(data)))
+        self._traceFile.write(bytes(data))
+
+    def open(self):
+        self._hidDevice.open()
+
+    def close(self):
+        self._hidDevice.close()
+        self._traceFile.flush()
+
+    def stop(self):
+        """
+        Stop recording and close the trace file if it was opened by the
+        recorder.
+        """
+        self._traceFile.flush()
+        if self._ownsFile:
+            self._traceFile.close()
+
+    def send_feature_report(self, data, report_id=0x00):
+        self._log(TRACE_WRITE, data)
+        return self._hidDevice.send_feature_report(data, report_id)
+
+    def get_feature_report(self, size, report_id=0x00):
+        data = self._hidDevice.get_feature_report(size, report_id)
+        self._log(TRACE_READ, data)
+        return data
+
+    def write(self, data, report_id=0x00):
+        self._log(TRACE_WRITE, data)
+        return self._hidDevice.write(data, report_id)
+
+    def read(self, size=64, timeout=None):
+        data = self._hidDevice.read(size, timeout)
+        self._log(TRACE_READ, data)
+        return data
+
+def record_trace(boot, traceFile):
+    """
+    Start recording the HID reports of a bootloader to a trace file.
+
+    Parameters:
+        boot: an `EFM8BootloaderHID` object
+        traceFile: file name or binary file-like object
+
+    Returns:
+        The `TraceRecorder` used. Call `stop()` on it to finish the trace.
+    """
+    recorder = TraceRecorder(boot._hidDevice, traceFile)
+    boot._hidDevice = recorder
+    return recorder
+
+class TraceReplayDevice(object):
+    """
+    A HID device that plays back a recorded trace.
+
+    Reports written to the device are checked byte for byte against the
+    trace, and reads return the recorded responses.
+
+    Parameters:
+        traceFile: file name or binary file-like object
+        realtime: if true, wait so that each report happens at the same time
+            offset as in the recording, otherwise replay as fast as possible
+    """
+
+    def __init__(self, traceFile, realtime=False):
+        (header, self.events) = read_trace(traceFile)
+        self.vendor_id = header.vid
+        self.product_id = header.pid
+        self.path = "trace:{}".format(getattr(traceFile, 'name', traceFile))
+        self.realtime = realtime
+        self.position = 0
+        self._startTime = None
+
+    @property
+    def finished(self):
+        return self.position == len(self.events)
+
+    def open(self):
+        if self._startTime is None:
+            self._startTime = default_timer()
+
+    def close(self):
+        pass
+
+    def _next_event(self, kind):
+        if self.finished:
+            raise EFM8BootloaderTraceError(
+                "Replay went past the end of the trace at event {}"
+                .format(self.position)
+            )
+        event = self.events[self.position]
+        if event.kind != kind:
+            raise EFM8BootloaderTraceError(
+                "Replay expected a {} at event {}, but got a {}".format(
+                    "write" if event.kind == TRACE_WRITE else "read",
+                    self.position,
+                    "write" if kind == TRACE_WRITE else "read",
+                )
+            )
+
+        if self.realtime:
+            delay = self._startTime + event.time - default_timer()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.position += 1
+        return event
+
+    def send_feature_report(self, data, report_id=0x00):
+        event = self._next_event(TRACE_WRITE)
+        if bytearray(data) != event.data:
+            raise EFM8BootloaderTraceError(
+                "Report {} doesn't match the trace: expected {}, got {}".format(
+                    self.position - 1,
+                    hexlify(bytes(event.data)).decode('ascii'),
+                    hexlify(bytes(bytearray(data))).decode('ascii'),
+                )
+            )
+        return len(data) + 1
+
+    def get_feature_report(self, size, report_id=0x00):
+        return bytearray(self._next_event(TRACE_READ).data[:size])
+
+    def write(self, data, report_id=0x00):
+        return self.send_feature_report(data, report_id)
+
+    def read(self, size=64, timeout=None):
+        return self.get_feature_report(size)
@@ -38,6 +38,10 @@ setup(
     include_package_data=True,
     author='jem',
     install_requires=install_requires,
+    extras_require={
+        'analysis': ['numpy'],
+        'udev': ['pyudev'],
+    },
     dependency_links=dependency_links,
     author_email='jem@seethis.link'
 )
@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Benchmarks for the flashing pipeline.
+
+Run with `python -m tests.bench_pipeline`. Results are written as JSON so
+the output of two commits can be compared with `--compare`:
+
+    $ python -m tests.bench_pipeline -o before.json
+    $ git checkout other-branch
+    $ python -m tests.bench_pipeline -o after.json --compare before.json
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import contextmanager
+from timeit import default_timer
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import intelhex
+
+import efm8boot.hid_bootloader
+import efm8boot.ids
+from efm8boot.flight import FlightRecorder
+from efm8boot.hid_bootloader import EFM8BootloaderHID, find_devices
+from efm8boot.image import FirmwareImage
+from efm8boot.records import (
+    Record, IdentifyRecord, RunAppRecord, SetupRecord, EraseRecord,
+    WriteRecord, LockRecord, VerifyRecord, ACK,
+)
+
+from tests.fake_device import FakeEFM8, FakeEnumeration, LatencyModel
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+if hasattr(time, 'process_time'):
+    process_time = time.process_time
+else:
+    process_time = time.clock
+
+def measure(func, iterations, units=1):
+    """
+    Time `func` over the given number of iterations.
+
+    Returns:
+        A dict with the wall and cpu time per unit of work, where each call to
+        `func` does `units` units of work.
+    """
+    wallTimes = []
+    cpuTimes = []
+    for _ in range(iterations):
+        wallStart = default_timer()
+        cpuStart = process_time()
+        func()
+        cpuTimes.append(process_time() - cpuStart)
+        wallTimes.append(default_timer() - wallStart)
+
+    wallTimes.sort()
+    cpuTimes.sort()
+    wall = wallTimes[len(wallTimes) // 2] / units
+    cpu = cpuTimes[len(cpuTimes) // 2] / units
+    return {
+        'iterations': iterations,
+        'wall_per_unit': wall,
+        'cpu_per_unit': cpu,
+        'units_per_second': (1.0 / wall) if wall else None,
+    }
+
+def make_image(size, seed=0x5A):
+    """
+    Return an IntelHex image with `size` bytes of data starting at 0x0000.
+    """
+    ihex = intelhex.IntelHex()
+    data = bytearray((seed + i * 7) & 0xff for i in range(size))
+    ihex.puts(0x0000, bytes(data))
+    return ihex
+
+def hex_text(ihex):
+    f = io.StringIO()
+    ihex.write_hex_file(f)
+    return f.getvalue()
+
+def connected_boot(fake):
+    boot = EFM8BootloaderHID(fake)
+    boot.connect()
+    boot.info
+    return boot
+
+@contextmanager
+def fake_enumeration(devices):
+    original = efm8boot.hid_bootloader.easyhid.Enumeration
+    efm8boot.hid_bootloader.easyhid.Enumeration = FakeEnumeration(devices)
+    try:
+        yield
+    finally:
+        efm8boot.hid_bootloader.easyhid.Enumeration = original
+
+def bench_load_image(iterations):
+    info = FakeEFM8().info
+    text = hex_text(make_image(info.bootloaderStart))
+
+    def run():
+        image = FirmwareImage.from_source(io.StringIO(text))
+        image.pages(info.pageSize)
+
+    return measure(run, iterations)
+
+def bench_records(iterations):
+    frame = bytearray(range(128))
+    recordTypes = [
+        ('Record', lambda: Record(cmd=0x00, data=[0x00, 0x00])),
+        ('IdentifyRecord', lambda: IdentifyRecord(0x3241)),
+        ('SetupRecord', lambda: SetupRecord()),
+        ('EraseRecord', lambda: EraseRecord(0x0200, frame)),
+        ('WriteRecord', lambda: WriteRecord(0x0280, frame)),
+        ('VerifyRecord', lambda: VerifyRecord(0x0000, 0x01ff, 0x1234)),
+        ('LockRecord', lambda: LockRecord(sig=0x00)),
+        ('RunAppRecord', lambda: RunAppRecord()),
+    ]
+    results = {}
+    count = 1000
+    for (name, makeRecord) in recordTypes:
+        record = makeRecord()
+        def run():
+            for _ in range(count):
+                record.to_bytes()
+        results['record_to_bytes.' + name] = measure(run, iterations, count)
+    return results
+
+def bench_crc(iterations):
+    boot = EFM8BootloaderHID(FakeEFM8())
+    data = bytes(bytearray(range(256)) * 64)
+
+    def run():
+        boot.compute_crc(data)
+
+    return measure(run, iterations, len(data))
+
+def bench_write_flash_hex(iterations, latency, recorder='on'):
+    """
+    Parameters:
+        recorder: 'on' to use the default flight recorder, 'raw' to also
+            record the HID reports and 'off' to turn it off
+    """
+    fake = FakeEFM8(latency=latency)
+    boot = connected_boot(fake)
+    if recorder == 'off':
+        boot.flightRecorder = None
+    elif recorder == 'raw':
+        boot.flightRecorder = FlightRecorder(raw=True)
+    ihex = make_image(fake.info.bootloaderStart)
+    stats = {}
+
+    def run():
+        # a new image each time, so the page map and the encoded records of
+        # the last iteration aren't reused from the image cache
+        image = FirmwareImage(ihex)
+        reportsBefore = len(fake.log)
+        boot.write_flash_hex(image)
+        stats['records'] = len(fake.log) - reportsBefore
+
+    result = measure(run, iterations)
+    result['records'] = stats['records']
+    result['records_per_second'] = stats['records'] / result['wall_per_unit']
+    result['cpu_per_record'] = result['cpu_per_unit'] / stats['records']
+    return result
+
+def bench_flight_recorder(iterations):
+    recorder = FlightRecorder()
+    record = WriteRecord(0x0200, bytearray(range(128)))
+    count = 1000
+
+    def run():
+        for _ in range(count):
+            recorder.add(record, 0x40)
+
+    return measure(run, iterations, count)
+
+def bench_find_devices(iterations, deviceCount):
+    devices = []
+    for i in range(deviceCount):
+        pid = sorted(efm8boot.ids.EFM8UB_HID_DEVICES)[i % 3]
+        devices.append(FakeEFM8(pid=pid, path="fake-{}".format(i)))
+    target = devices[-1].info.name
+
+    def run():
+        with fake_enumeration(devices):
+            found = find_devices(mcu=target)
+        assert found
+
+    return measure(run, iterations, deviceCount)
+
+class AckDevice(object):
+    """
+    HID device that acknowledges every record without keeping any state, so
+    only the memory used by the bootloader objects is measured.
+    """
+    __slots__ = ('path',)
+
+    ACK_REPORT = bytearray([ACK, 0, 0, 0])
+
+    def __init__(self, path):
+        self.path = path
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_feature_report(self, data, report_id=0x00):
+        return len(data)
+
+    def get_feature_report(self, size, report_id=0x00):
+        return self.ACK_REPORT
+
+def resident_memory():
+    """
+    Return the resident memory of the process in bytes, or None if it
+    can't be read.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak rather than current, in kB on Linux and bytes on macOS
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss if sys.platform == 'darwin' else maxRss * 1024
+
+def bench_device_memory(deviceCount):
+    """
+    Measure the memory used by each additional device that is kept connected
+    after writing the same image, like in a large gang.
+    """
+    info = FakeEFM8().info
+    image = FirmwareImage(make_image(info.bootloaderStart))
+
+    def open_device(index):
+        boot = EFM8BootloaderHID(AckDevice("ack-{}".format(index)))
+        boot._info = info
+        boot._hasLoadedInfo = True
+        boot.connect()
+        boot.write_flash_hex(image)
+        return boot
+
+    # the first flash builds the records that all the devices share
+    open_device(-1).disconnet()
+
+    gc.collect()
+    tracing = tracemalloc is not None and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    rssBefore = resident_memory()
+    tracedBefore = tracemalloc.get_traced_memory()[0] if tracing else None
+    wallStart = default_timer()
+    cpuStart = process_time()
+
+    devices = [open_device(index) for index in range(deviceCount)]
+
+    cpu = (process_time() - cpuStart) / deviceCount
+    wall = (default_timer() - wallStart) / deviceCount
+    gc.collect()
+    rssAfter = resident_memory()
+    tracedAfter = tracemalloc.get_traced_memory()[0] if tracing else None
+    if tracing:
+        tracemalloc.stop()
+
+    result = {
+        'iterations': 1,
+        'devices': len(devices),
+        'wall_per_unit': wall,
+        'cpu_per_unit': cpu,
+        'units_per_second': (1.0 / wall) if wall else None,
+        'rss_per_device': None,
+        'traced_per_device': None,
+    }
+    if rssBefore is not None and rssAfter is not None:
+        result['rss_per_device'] = (rssAfter - rssBefore) / deviceCount
+    if tracedBefore is not None:
+        result['traced_per_device'] = (tracedAfter - tracedBefore) / deviceCount
+    return result
+
+def run_benchmarks(iterations=20, latency=None, deviceCount=64,
+                   memoryDevices=200):
+    """
+    Run all the benchmarks.
+
+    Parameters:
+        iterations: number of times to run each benchmark
+        latency: `LatencyModel` used by the fake device for `write_flash_hex`
+        deviceCount: number of fake devices to use for `find_devices`
+        memoryDevices: number of devices kept alive to measure the memory
+            used per device
+
+    Returns:
+        A dict mapping the benchmark names to their results
+    """
+    if latency is None:
+        latency = LatencyModel()
+
+    results = {}
+    results['load_image'] = bench_load_image(iterations)
+    results.update(bench_records(iterations))
+    results['crc_per_byte'] = bench_crc(iterations)
+    results['write_flash_hex'] = bench_write_flash_hex(iterations, latency)
+    for recorder in ('off', 'raw'):
+        results['write_flash_hex.recorder_' + recorder] = bench_write_flash_hex(
+            iterations, latency, recorder
+        )
+    results['flight_recorder_add'] = bench_flight_recorder(iterations)
+    results['find_devices_per_device'] = bench_find_devices(iterations, deviceCount)
+    results['device_memory'] = bench_device_memory(memoryDevices)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT,
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """
+    Print the change in time per unit against a baseline.
+
+    Returns:
+        The names of the benchmarks that got slower by more than `threshold`
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['wall_per_unit']
+        new = results[name]['wall_per_unit']
+        change = (new - old) / old if old else 0.0
+        print("{:40} {:+7.1%}".format(name, change))
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-o', dest='output', default=None,
+                        help='File to write the JSON results to')
+    parser.add_argument('-n', dest='iterations', type=int, default=20,
+                        help='Number of iterations of each benchmark')
+    parser.add_argument('--round-trip', type=float, default=0.0,
+                        help='Fake device round trip latency in seconds')
+    parser.add_argument('--erase-time', type=float, default=0.0,
+                        help='Fake device page erase time in seconds')
+    parser.add_argument('--devices', type=int, default=64,
+                        help='Number of fake devices for find_devices')
+    parser.add_argument('--memory-devices', type=int, default=200,
+                        help='Number of devices kept alive to measure memory')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slow down reported as a regression')
+    args = parser.parse_args(argv)
+
+    latency = LatencyModel(roundTrip=args.round_trip, erase=args.erase_time)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'latency': {'round_trip': args.round_trip, 'erase': args.erase_time},
+        'results': run_benchmarks(
+            args.iterations, latency, args.devices, args.memory_devices
+        ),
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(report['results'], baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
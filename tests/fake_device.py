@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+An in-process fake of an EFM8 HID bootloader, used by the tests.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+import struct
+import time
+
+from timeit import default_timer
+
+import crcmod
+import intelhex
+
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+import efm8boot.ids
+import efm8boot.records as records
+
+BOOTLOADER_VERSION = 0x90
+
+# A part with two flash banks, which none of the parts in `efm8boot.ids` have
+BIG_PART = efm8boot.ids.EFM8Info(
+    0x7F, "TEST128K", 128 * 2**10, 48, "qfp48", 512, 0x1FA00
+)
+
+class LatencyModel(object):
+    """
+    Round trip latency of the fake bootloader.
+
+    Parameters:
+        roundTrip: time in seconds between sending a record and its response
+        erase: extra time taken by records that erase a page
+        write: extra time taken by records that write flash
+    """
+
+    def __init__(self, roundTrip=0.0, erase=0.0, write=0.0):
+        self.roundTrip = roundTrip
+        self.erase = erase
+        self.write = write
+
+    def delay(self, cmd, data):
+        delay = self.roundTrip
+        if cmd == records.CMD_ERASE:
+            delay += self.erase
+        if cmd in (records.CMD_ERASE, records.CMD_WRITE) and len(data) > 2:
+            delay += self.write
+        return delay
+
+class FakeEFM8(object):
+    """
+    Emulates the flash and record handling of an EFM8 HID bootloader.
+
+    The object mimics the parts of `easyhid.HIDDevice` used by
+    `EFM8BootloaderHID`, so it can be passed in place of a real device.
+
+    Parameters:
+        pid: the USB PID of the bootloader
+        identId: the identify ID of the part, defaults to the first part of
+            the family matching `pid`
+        path: the HID path of the device
+        latency: a `LatencyModel`, if not given responses are immediate
+        info: the `EFM8Info` of the part, for parts that aren't in
+            `efm8boot.ids`
+    """
+
+    def __init__(self, pid=efm8boot.ids.EFM8UB1_USB_PID, identId=None,
+                 path="fake-efm8", latency=None, info=None):
+        family = efm8boot.ids.EFM8UB_HID_DEVICES[pid]
+        if identId is None:
+            identId = sorted(family)[0]
+        if info is None:
+            info = family[identId]
+
+        self.vendor_id = efm8boot.ids.SILICON_LABS_USB_ID
+        self.product_id = pid
+        self.path = path
+        self.identId = identId
+        self.info = info
+        self.latency = latency
+
+        self.flash = bytearray([0xff] * self.info.flashSize)
+        self.isOpen = False
+        self.writingEnabled = False
+        self.bank = 0
+        self.hasReset = False
+        self.log = []
+        # maps addresses of bad flash cells to the bits that are stuck at 0
+        self.badCells = {}
+
+        self._partial = bytearray()
+        self._responses = []
+        self._crc = crcmod.predefined.mkCrcFun('xmodem')
+
+    def open(self):
+        self.isOpen = True
+
+    def close(self):
+        self.isOpen = False
+
+    def send_feature_report(self, data, report_id=0x00):
+        self._receive(bytearray(data))
+        return len(data) + 1
+
+    def get_feature_report(self, size, report_id=0x00):
+        if not self._responses:
+            # like a stalled control transfer
+            raise IOError("no response from device")
+        (readyTime, resp) = self._responses.pop(0)
+        if readyTime is not None:
+            delay = readyTime - default_timer()
+            if delay > 0:
+                time.sleep(delay)
+        return bytearray([resp]) + bytearray(size - 1)
+
+    def write(self, data, report_id=0x00):
+        return self.send_feature_report(data, report_id)
+
+    def read(self, size=64, timeout=None):
+        return self.get_feature_report(size)
+
+    def _receive(self, report):
+        """
+        Collect HID reports until a complete record has been received.
+        """
+        if not self._partial:
+            if report[0] != records.FRAME_START_BYTE:
+                return
+        self._partial += report
+
+        recordSize = self._partial[1] + 2
+        if len(self._partial) < recordSize:
+            return
+
+        record = self._partial[:recordSize]
+        self._partial = bytearray()
+        (cmd, data) = (record[2], bytes(record[3:]))
+
+        readyTime = None
+        if self.latency is not None:
+            readyTime = default_timer() + self.latency.delay(cmd, data)
+        self._responses.append((readyTime, self._handle(cmd, data)))
+
+    def _handle(self, cmd, data):
+        addr = None
+        if cmd in (records.CMD_ERASE, records.CMD_WRITE, records.CMD_VERIFY):
+            addr = struct.unpack('>H', data[:2])[0] + self.bank * records.BANK_SIZE
+        self.log.append((cmd, addr))
+
+        if cmd == records.CMD_IDENTIFY:
+            (ident,) = struct.unpack('>H', data[:2])
+            return records.ACK if ident == self.identId else records.BADID
+        elif cmd == records.CMD_SETUP:
+            (keys, bank) = struct.unpack('>HB', data[:3])
+            self.writingEnabled = (keys == records.FLASH_KEYS)
+            self.bank = bank
+            return records.ACK
+        elif cmd in (records.CMD_ERASE, records.CMD_WRITE):
+            payload = bytearray(data[2:])
+            if not self.writingEnabled or \
+                    addr + len(payload) > self.info.bootloaderStart:
+                return records.RANGE_ERROR
+            if cmd == records.CMD_ERASE:
+                pageStart = addr - addr % self.info.pageSize
+                pageEnd = pageStart + self.info.pageSize
+                self.flash[pageStart:pageEnd] = bytearray([0xff] * self.info.pageSize)
+            for (offset, value) in enumerate(payload):
+                self.flash[addr + offset] &= value
+            for (cellAddr, stuckBits) in self.badCells.items():
+                self.flash[cellAddr] &= ~stuckBits & 0xff
+            return records.ACK
+        elif cmd == records.CMD_VERIFY:
+            (start, end, crc) = struct.unpack('>HHH', data[:6])
+            start += self.bank * records.BANK_SIZE
+            end += self.bank * records.BANK_SIZE
+            if self._crc(bytes(self.flash[start:end+1])) == crc:
+                return records.ACK
+            else:
+                return records.CRC_ERROR
+        elif cmd == records.CMD_LOCK:
+            return records.ACK
+        elif cmd == records.CMD_RUN_APP:
+            self.hasReset = True
+            return records.ACK
+        else:
+            return BOOTLOADER_VERSION
+
+    def count(self, cmd):
+        """
+        Return the number of records with the given command ID received.
+        """
+        return sum(1 for (logCmd, _) in self.log if logCmd == cmd)
+
+class FaultModel(object):
+    """
+    Faults injected by `FaultInjectingHIDDevice`. The probabilities are per
+    record sent.
+
+    Parameters:
+        drop: probability that a record is lost before it reaches the device
+        corruptAck: probability that a bit of the response code is flipped
+        spuriousError: probability that the device handles a record but
+            answers CRC_ERROR or RANGE_ERROR
+        spike: probability of a latency spike before the response
+        spikeTime: length of a latency spike in seconds
+        disconnect: probability that the device disconnects when sent a
+            write record, which is always in the middle of a page
+        midRecord: probability that a report after the first one of a record
+            sent in several reports is lost, leaving the start of the record
+            in the device
+    """
+
+    def __init__(self, drop=0.0, corruptAck=0.0, spuriousError=0.0, spike=0.0,
+                 spikeTime=0.02, disconnect=0.0, midRecord=0.0):
+        self.drop = drop
+        self.corruptAck = corruptAck
+        self.spuriousError = spuriousError
+        self.spike = spike
+        self.spikeTime = spikeTime
+        self.disconnect = disconnect
+        self.midRecord = midRecord
+
+    def scaled(self, factor):
+        """
+        Return a copy with all the probabilities multiplied by `factor`.
+        """
+        return FaultModel(
+            drop=min(1.0, self.drop * factor),
+            corruptAck=min(1.0, self.corruptAck * factor),
+            spuriousError=min(1.0, self.spuriousError * factor),
+            spike=min(1.0, self.spike * factor),
+            spikeTime=self.spikeTime,
+            disconnect=min(1.0, self.disconnect * factor),
+            midRecord=min(1.0, self.midRecord * factor),
+        )
+
+    def to_dict(self):
+        return dict(
+            drop=self.drop, corruptAck=self.corruptAck,
+            spuriousError=self.spuriousError, spike=self.spike,
+            spikeTime=self.spikeTime, disconnect=self.disconnect,
+            midRecord=self.midRecord,
+        )
+
+class FaultInjectingHIDDevice(object):
+    """
+    Wraps a HID device and injects the faults of a `FaultModel` into the
+    records sent through it.
+
+    Faults are chosen per record, when the first report of a record is sent.
+    A dropped record never reaches the device and reading its response
+    raises `IOError`, like a stalled control transfer. After a disconnect
+    every transfer raises `IOError` until the device is closed and opened
+    again. A record cut off in the middle raises `IOError` when the lost
+    report is sent, and the device keeps the reports it already received.
+
+    Parameters:
+        device: the wrapped device, like a `FakeEFM8`
+        faults: the `FaultModel`
+        seed: seed of the random faults
+    """
+
+    def __init__(self, device, faults, seed=0):
+        self.device = device
+        self.faults = faults
+        self.rng = random.Random(seed)
+        # number of each fault injected
+        self.injected = dict(
+            (name, 0) for name in
+            ('drop', 'corruptAck', 'spuriousError', 'spike', 'disconnect',
+             'midRecord')
+        )
+        self.isDisconnected = False
+
+        self._recordLeft = 0
+        # reports of the record left until the one that is lost
+        self._cutAfter = None
+        self._dropRecord = False
+        self._lost = False
+        self._pending = []
+
+    @property
+    def vendor_id(self):
+        return self.device.vendor_id
+
+    @property
+    def product_id(self):
+        return self.device.product_id
+
+    @property
+    def path(self):
+        return self.device.path
+
+    def open(self):
+        # opening the device again is how the host recovers from a disconnect
+        self.isDisconnected = False
+        self.device.open()
+
+    def close(self):
+        self.device.close()
+
+    def _chance(self, name):
+        probability = getattr(self.faults, name)
+        if probability and self.rng.random() < probability:
+            self.injected[name] += 1
+            return True
+        return False
+
+    def _start_record(self, report):
+        """
+        Choose the faults for the record that starts with `report`.
+        """
+        cmd = report[2]
+        if cmd == records.CMD_WRITE and self._chance('disconnect'):
+            # the record is abandoned, the next session starts a new one
+            self.isDisconnected = True
+            return
+        self._recordLeft = report[1] + 2
+        self._cutAfter = None
+        if self._recordLeft > len(report) and self._chance('midRecord'):
+            reportCount = -(-self._recordLeft // len(report))
+            self._cutAfter = self.rng.randrange(1, reportCount)
+        self._dropRecord = self._chance('drop')
+        self._lost = self._dropRecord
+
+        # decided now, so the response faults use the same random sequence
+        # whatever order the reports and responses are interleaved in
+        fault = None
+        if self._chance('spuriousError'):
+            fault = ('replace', self.rng.choice([records.CRC_ERROR, records.RANGE_ERROR]))
+        elif self._chance('corruptAck'):
+            fault = ('xor', 1 << self.rng.randrange(8))
+        spike = self.faults.spikeTime if self._chance('spike') else 0.0
+        if not self._dropRecord:
+            self._pending.append((fault, spike))
+
+    def send_feature_report(self, data, report_id=0x00):
+        if self.isDisconnected:
+            raise IOError("device disconnected")
+        report = bytearray(data)
+        if self._recordLeft <= 0:
+            if report[0] != records.FRAME_START_BYTE:
+                return self.device.send_feature_report(data, report_id)
+            self._start_record(report)
+            if self.isDisconnected:
+                raise IOError("device disconnected")
+        elif self._cutAfter is not None:
+            self._cutAfter -= 1
+            if self._cutAfter == 0:
+                # the host abandons the record, so it gets no response
+                self._recordLeft = 0
+                self._cutAfter = None
+                self._lost = False
+                if not self._dropRecord:
+                    self._pending.pop()
+                raise IOError("report lost")
+        self._recordLeft -= len(report)
+        if self._dropRecord:
+            return len(data) + 1
+        return self.device.send_feature_report(data, report_id)
+
+    def get_feature_report(self, size, report_id=0x00):
+        if self.isDisconnected:
+            raise IOError("device disconnected")
+        if self._lost:
+            self._lost = False
+            raise IOError("no response from device")
+
+        response = bytearray(self.device.get_feature_report(size, report_id))
+        (fault, spike) = self._pending.pop(0) if self._pending else (None, 0.0)
+        if fault is not None:
+            (kind, value) = fault
+            response[0] = value if kind == 'replace' else response[0] ^ value
+        if spike:
+            time.sleep(spike)
+        return response
+
+    def write(self, data, report_id=0x00):
+        return self.send_feature_report(data, report_id)
+
+    def read(self, size=64, timeout=None):
+        return self.get_feature_report(size)
+
+class FakeEnumeration(object):
+    """
+    Stands in for `easyhid.Enumeration` and returns a fixed list of devices.
+    """
+
+    def __init__(self, devices):
+        self.devices = devices
+
+    def __call__(self, vid=0, pid=0):
+        self.vid = vid
+        self.pid = pid
+        return self
+
+    def find(self, path=None):
+        return [
+            dev for dev in self.devices
+            if (self.vid == 0 or dev.vendor_id == self.vid) and
+               (self.pid == 0 or dev.product_id == self.pid) and
+               (path is None or dev.path == path)
+        ]
+
+def make_hex(addr, data):
+    """
+    Return an `intelhex.IntelHex` holding the byte values in `data` at `addr`.
+    """
+    ihex = intelhex.IntelHex()
+    ihex.puts(addr, bytes(bytearray(data)))
+    return ihex
+
+def make_boot(info=None, faults=None, seed=0):
+    """
+    Return a `FakeEFM8` and an `EFM8BootloaderHID` using it.
+
+    Parameters:
+        info: the `EFM8Info` of a part that isn't in `efm8boot.ids`, like
+            `BIG_PART`. The bootloader is given it instead of identifying
+            the part
+        faults: a `FaultModel`, if given the reports go through a
+            `FaultInjectingHIDDevice`
+        seed: seed of the injected faults
+
+    Returns:
+        A tuple `(fake, boot)`
+    """
+    if info is None:
+        fake = FakeEFM8()
+    else:
+        fake = FakeEFM8(pid=efm8boot.ids.EFM8UB2_USB_PID, info=info)
+    device = fake if faults is None else FaultInjectingHIDDevice(fake, faults, seed)
+    boot = EFM8BootloaderHID(device)
+    if info is not None:
+        boot._info = info
+        boot._hasLoadedInfo = True
+    return (fake, boot)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2018 jem@seethis.link
+# Licensed under the MIT license (http://opensource.org/licenses/MIT)
+
+"""
+Soak test of flashing through a transport that injects faults.
+
+Runs erase and write cycles against the in-process fake bootloader through
+`FaultInjectingHIDDevice`, and reports the success rate, the flash times
+and how much of the time went to recovering from faults. A failed operation
+is recovered by opening a new session with the device and running the
+operation again.
+
+Run with `python -m tests.soak`, `--sweep` scales the fault rates to show
+how the throughput degrades:
+
+    $ python -m tests.soak -n 2000 --timeouts
+    $ python -m tests.soak -n 500 --sweep 0,1,2,4 -o soak.json
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from timeit import default_timer
+import argparse
+import json
+import sys
+
+from efm8boot.bootloader import EFM8BootloaderError
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.image import FirmwareImage
+from efm8boot.timeouts import AdaptiveTimeouts
+
+from tests.bench_pipeline import git_revision, make_image
+from tests.fake_device import (
+    FakeEFM8, FaultInjectingHIDDevice, FaultModel, LatencyModel
+)
+
+# Errors after which a new session is opened and the operation run again
+RECOVERABLE_ERRORS = (EFM8BootloaderError, IOError, OSError)
+
+# Fault rates per record for a flaky USB connection
+DEFAULT_FAULTS = FaultModel(
+    drop=0.001, corruptAck=0.0002, spuriousError=0.0002, spike=0.001,
+    spikeTime=0.02, disconnect=0.0001,
+)
+
+def time_stats(times):
+    """
+    Return the mean and tail of a list of times.
+    """
+    if not times:
+        return None
+    times = sorted(times)
+    def percentile(fraction):
+        return times[min(len(times) - 1, int(fraction * len(times)))]
+    return {
+        'mean': sum(times) / len(times),
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': times[-1],
+    }
+
+class SoakSession(object):
+    """
+    The bootloader session with the device, replaced after each failure
+    like a station opening the device again.
+    """
+
+    def __init__(self, device, timeouts=None):
+        self.device = device
+        self.timeouts = timeouts
+        self.boot = None
+        self.open()
+
+    def open(self):
+        self.boot = EFM8BootloaderHID(self.device)
+        # latencies learned by earlier sessions are kept
+        self.boot.timeouts = self.timeouts
+        self.boot.connect()
+
+    def reopen(self):
+        self.boot.disconnet()
+        self.open()
+
+    def close(self):
+        self.boot.disconnet()
+
+def run_with_recovery(session, func, attempts, errors):
+    """
+    Run `func(boot)`, recovering from failures up to `attempts` times.
+
+    Returns:
+        A tuple `(ok, elapsed, recoveryTime)`, where `recoveryTime` is the
+        time spent in failed attempts and opening new sessions
+    """
+    startTime = default_timer()
+    recoveryTime = 0.0
+    for _ in range(attempts):
+        attemptStart = default_timer()
+        try:
+            func(session.boot)
+            return (True, default_timer() - startTime, recoveryTime)
+        except RECOVERABLE_ERRORS as err:
+            name = type(err).__name__
+            errors[name] = errors.get(name, 0) + 1
+            session.reopen()
+            recoveryTime += default_timer() - attemptStart
+    return (False, default_timer() - startTime, recoveryTime)
+
+def soak(cycles=1000, faults=None, latency=None, attempts=3, timeouts=False,
+         seed=0):
+    """
+    Run erase and write cycles through a `FaultInjectingHIDDevice`.
+
+    Parameters:
+        cycles: number of `erase_application_flash()` and `write_flash_hex()`
+            cycles
+        faults: the `FaultModel`, `DEFAULT_FAULTS` if not given
+        latency: `LatencyModel` of the fake device
+        attempts: number of times each operation is tried
+        timeouts: use `AdaptiveTimeouts`, which resend records after
+            transport errors
+        seed: seed of the injected faults
+
+    Returns:
+        A dict with the results
+    """
+    if faults is None:
+        faults = DEFAULT_FAULTS
+    fake = FakeEFM8(latency=latency)
+    device = FaultInjectingHIDDevice(fake, faults, seed)
+    image = FirmwareImage(make_image(fake.info.bootloaderStart))
+    pages = image.pages(fake.info.pageSize)
+    nbytes = sum(len(pageData) for (_, pageData) in pages)
+
+    session = SoakSession(device, AdaptiveTimeouts() if timeouts else None)
+    errors = {}
+    flashTimes = []
+    cycleTimes = []
+    recoveryTotal = 0.0
+    succeeded = 0
+    recovered = 0
+    corrupted = 0
+
+    startTime = default_timer()
+    for _ in range(cycles):
+        cycleStart = default_timer()
+        cycleRecovery = 0.0
+        ok = True
+        for (name, func) in (
+                ('erase', lambda boot: boot.erase_application_flash()),
+                ('flash', lambda boot: boot.write_flash_hex(image))):
+            (opOk, elapsed, recoveryTime) = run_with_recovery(
+                session, func, attempts, errors
+            )
+            cycleRecovery += recoveryTime
+            if not opOk:
+                ok = False
+                break
+            if name == 'flash':
+                flashTimes.append(elapsed)
+
+        recoveryTotal += cycleRecovery
+        cycleTimes.append(default_timer() - cycleStart)
+        if not ok:
+            continue
+        # a flash that reported success must have written the image
+        if any(bytes(fake.flash[pageAddr:pageAddr + len(pageData)]) != bytes(pageData)
+               for (pageAddr, pageData) in pages):
+            corrupted += 1
+            continue
+        succeeded += 1
+        if cycleRecovery:
+            recovered += 1
+    elapsed = default_timer() - startTime
+    session.close()
+
+    return {
+        'cycles': cycles,
+        'succeeded': succeeded,
+        'success_rate': succeeded / cycles if cycles else None,
+        'recovered': recovered,
+        'corrupted': corrupted,
+        'flash_time': time_stats(flashTimes),
+        'cycle_time': time_stats(cycleTimes),
+        'recovery_time': recoveryTotal,
+        'recovery_fraction': recoveryTotal / elapsed if elapsed else 0.0,
+        'throughput_bytes_per_second': succeeded * nbytes / elapsed if elapsed else None,
+        'errors': errors,
+        'faults_injected': dict(device.injected),
+        'faults': faults.to_dict(),
+    }
+
+def sweep(scales, faults=None, **kwargs):
+    """
+    Run `soak()` with the fault rates multiplied by each of `scales`.
+
+    Returns:
+        A list of `(scale, result)`
+    """
+    if faults is None:
+        faults = DEFAULT_FAULTS
+    return [(scale, soak(faults=faults.scaled(scale), **kwargs)) for scale in scales]
+
+def format_results(results):
+    """
+    Return a table of `sweep()` results, with the throughput relative to the
+    first row.
+    """
+    lines = ["{:>6} {:>8} {:>10} {:>10} {:>9} {:>10}".format(
+        "scale", "success", "mean(ms)", "p99(ms)", "recovery", "throughput"
+    )]
+    baseline = results[0][1]['throughput_bytes_per_second'] if results else None
+    for (scale, result) in results:
+        flashTime = result['flash_time'] or {'mean': 0.0, 'p99': 0.0}
+        throughput = result['throughput_bytes_per_second']
+        relative = throughput / baseline if baseline else 0.0
+        lines.append("{:>6g} {:>8.2%} {:>10.2f} {:>10.2f} {:>9.2%} {:>10.2%}".format(
+            scale, result['success_rate'], flashTime['mean'] * 1000,
+            flashTime['p99'] * 1000, result['recovery_fraction'], relative
+        ))
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-o', dest='output', default=None,
+                        help='File to write the JSON results to')
+    parser.add_argument('-n', dest='cycles', type=int, default=1000,
+                        help='Number of erase and write cycles')
+    parser.add_argument('--attempts', type=int, default=3,
+                        help='Number of times each operation is tried')
+    parser.add_argument('--timeouts', action='store_true',
+                        help='Use adaptive timeouts, which resend records')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the injected faults')
+    parser.add_argument('--sweep', default="1",
+                        help='Comma separated multipliers of the fault rates')
+    parser.add_argument('--round-trip', type=float, default=0.0,
+                        help='Fake device round trip latency in seconds')
+    parser.add_argument('--erase-time', type=float, default=0.0,
+                        help='Fake device page erase time in seconds')
+    for (name, value) in sorted(DEFAULT_FAULTS.to_dict().items()):
+        flag = '--' + ''.join('-' + c.lower() if c.isupper() else c for c in name)
+        parser.add_argument(flag, dest=name, type=float, default=value,
+                            help='Default {}'.format(value))
+    args = parser.parse_args(argv)
+
+    faults = FaultModel(**dict(
+        (name, getattr(args, name)) for name in DEFAULT_FAULTS.to_dict()
+    ))
+    latency = LatencyModel(roundTrip=args.round_trip, erase=args.erase_time)
+    scales = [float(scale) for scale in args.sweep.split(',')]
+    results = sweep(
+        scales, faults, cycles=args.cycles, latency=latency,
+        attempts=args.attempts, timeouts=args.timeouts, seed=args.seed,
+    )
+    print(format_results(results))
+
+    if args.output:
+        report = {
+            'revision': git_revision(),
+            'attempts': args.attempts,
+            'timeouts': args.timeouts,
+            'results': [
+                dict(result, scale=scale) for (scale, result) in results
+            ],
+        }
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
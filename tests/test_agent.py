@@ -0,0 +1,99 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+import efm8boot.plan
+from efm8boot.agent import FlashAgent, RemoteBootloader, EFM8BootloaderAgentError
+from efm8boot.bootloader import EFM8BootloaderVerifyError
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.records import LockRecord
+import efm8boot.records as records
+
+from tests.fake_device import FakeEFM8, make_hex
+
+APP_HEX = make_hex(0x0000, bytearray(range(256)) * 3)
+
+def start_agent(token=None):
+    fake = FakeEFM8()
+
+    def find_devices(vid, pid, mcu, path):
+        # the agent identifies the devices itself, under the device lock
+        assert mcu is None
+        if path not in (None, fake.path):
+            return []
+        return [EFM8BootloaderHID(fake)]
+
+    agent = FlashAgent('127.0.0.1', 0, find_devices, progressInterval=0.0,
+                       token=token)
+    agent.fake = fake
+    agent.start()
+    return agent
+
+@pytest.fixture
+def agent():
+    agent = start_agent()
+    yield agent
+    agent.shutdown()
+
+def test_remote_flash(agent):
+    remote = RemoteBootloader(*agent.address)
+    updates = []
+
+    result = remote.write_flash_hex(
+        APP_HEX, reset=True, progress=lambda *args: updates.append(args)
+    )
+
+    assert agent.fake.flash[:0x300] == bytearray(range(256)) * 3
+    assert agent.fake.hasReset
+    # the erased frames at the end of the last page aren't written
+    assert result['bytes'] == 0x300
+    assert updates[-1][1] == 0x300
+    assert remote.verify_flash_hex(APP_HEX)
+
+def test_remote_errors(agent):
+    agent.fake.badCells[0x0010] = 0x10
+    with pytest.raises(EFM8BootloaderVerifyError) as excinfo:
+        RemoteBootloader(*agent.address).write_flash_hex(APP_HEX)
+    assert excinfo.value.start == 0x0000
+
+    with pytest.raises(EFM8BootloaderAgentError):
+        RemoteBootloader(*agent.address, path="missing").write_flash_hex(APP_HEX)
+
+def test_remote_plan(agent):
+    plan = efm8boot.plan.plan_flash_hex(APP_HEX, agent.fake.info)
+    RemoteBootloader(*agent.address).run_plan(plan)
+
+    assert agent.fake.flash[:0x300] == bytearray(range(256)) * 3
+    assert agent.fake.hasReset
+
+def test_remote_mcu(agent):
+    remote = RemoteBootloader(*agent.address, mcu=agent.fake.info.name)
+    remote.write_flash_hex(APP_HEX)
+    assert agent.fake.flash[:0x300] == bytearray(range(256)) * 3
+
+    with pytest.raises(EFM8BootloaderAgentError):
+        RemoteBootloader(*agent.address, mcu="EFM8UB20F64G_QFP48").write_flash_hex(APP_HEX)
+
+def test_plan_refuses_lock(agent):
+    plan = efm8boot.plan.plan_flash_hex(APP_HEX, agent.fake.info)
+    plan.records.append(LockRecord(sig=0x00))
+    with pytest.raises(EFM8BootloaderAgentError):
+        RemoteBootloader(*agent.address).run_plan(plan)
+    # nothing from the plan was sent, only the identify to check the part
+    assert set(cmd for (cmd, _) in agent.fake.log) == set([records.CMD_IDENTIFY])
+
+def test_token():
+    with pytest.raises(ValueError):
+        FlashAgent('0.0.0.0', 0)
+
+    agent = start_agent(token="s3cret")
+    try:
+        for token in (None, "wrong"):
+            with pytest.raises(EFM8BootloaderAgentError):
+                RemoteBootloader(*agent.address, token=token).write_flash_hex(APP_HEX)
+        assert agent.fake.log == []
+
+        RemoteBootloader(*agent.address, token="s3cret").write_flash_hex(APP_HEX)
+        assert agent.fake.flash[:0x300] == bytearray(range(256)) * 3
+    finally:
+        agent.shutdown()
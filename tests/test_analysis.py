@@ -0,0 +1,93 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import random
+
+import intelhex
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import efm8boot.ids
+from efm8boot.analysis import ImageBatch
+from efm8boot.image import FirmwareImage
+from efm8boot.plan import LatencyProfile, plan_flash_hex
+
+def make_images():
+    rng = random.Random(45)
+    images = []
+
+    # page 0 with blank frames, a gap, then a run of two pages
+    ihex = intelhex.IntelHex()
+    ihex.puts(0x0000, bytes(bytearray(rng.randrange(256) for _ in range(300))))
+    ihex.puts(0x0800, bytes(bytearray(rng.randrange(256) for _ in range(700))))
+    images.append(FirmwareImage(ihex))
+
+    # doesn't touch page 0, and has a blank first frame
+    ihex = intelhex.IntelHex()
+    ihex.puts(0x1000, b'\xff' * 128 + b'\x01\x02\x03')
+    images.append(FirmwareImage(ihex))
+
+    # too large for the 16 kB parts
+    ihex = intelhex.IntelHex()
+    ihex.puts(0x3F00, b'\x55' * 16)
+    images.append(FirmwareImage(ihex))
+
+    images.append(FirmwareImage(intelhex.IntelHex()))
+    return images
+
+def test_batch_matches_single_image():
+    images = make_images()
+    batch = ImageBatch.load(images, names=['a', 'b', 'c', 'empty'])
+    pageSize = 512
+
+    for (index, image) in enumerate(images):
+        pages = image.pages(pageSize)
+        assert batch.page_counts(pageSize)[index] == len(pages)
+        assert batch.verify_ranges(pageSize)[index] == image.verify_ranges(pageSize)
+
+        blank = batch.blank_frames(pageSize)[index]
+        for (pageAddr, frames) in image.blank_frames(pageSize).items():
+            assert tuple(blank[pageAddr // pageSize]) == frames
+
+def test_flash_cost_matches_plan():
+    images = make_images()
+    batch = ImageBatch.load(images)
+    info = efm8boot.ids.get_part_info("EFM8UB20F64G_QFP48")
+    profile = LatencyProfile(0.001, {'erase': 0.02, 'write': 0.005})
+
+    cost = batch.flash_cost(info)
+    times = batch.estimate_time(info, profile)
+    for (index, image) in enumerate(images):
+        plan = plan_flash_hex(image, info)
+        summary = plan.summary()
+        assert cost['records'][index] == summary['records']
+        assert cost['erases'][index] == summary['erases']
+        assert cost['writeFrames'][index] == summary['writeFrames']
+        assert cost['dataBytes'][index] == summary['dataBytes']
+        assert cost['hidReports'][index] == summary['hidReports']
+        assert cost['verifies'][index] == len(summary['verifyRanges'])
+        assert times[index] == pytest.approx(plan.estimate_time(profile))
+
+def test_report_fits_and_json():
+    batch = ImageBatch.load(make_images(), names=['a', 'b', 'c', 'empty'])
+    targets = [
+        efm8boot.ids.get_part_info("EFM8UB10F8G_QFN20"),
+        efm8boot.ids.get_part_info("EFM8UB10F16G_QFN28"),
+        efm8boot.ids.get_part_info("EFM8UB20F64G_QFP48"),
+    ]
+    report = json.loads(json.dumps(batch.report(targets)))
+
+    fits = dict(
+        ((result['image'], result['target']), result['fits'])
+        for result in report['results']
+    )
+    assert fits[('a', "EFM8UB10F8G_QFN20")]
+    assert not fits[('c', "EFM8UB10F8G_QFN20")]
+    assert not fits[('c', "EFM8UB10F16G_QFN28")]
+    assert fits[('c', "EFM8UB20F64G_QFP48")]
+
+    layout = report['images'][0]['layouts']['512']
+    assert layout['pageMap'][:6] == "100011"
+    assert layout['blankFrames']['0x0000'] == [False, False, False, True]
+    assert sorted(layout['pageCrcs']) == ['0x0000', '0x0800', '0x0A00']
@@ -0,0 +1,106 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import intelhex
+
+from efm8boot.bootloader import EFM8BootloaderObserver
+from efm8boot.image import FirmwareImage
+import efm8boot.records as records
+
+from tests.fake_device import BIG_PART, make_boot
+
+def make_image():
+    ihex = intelhex.IntelHex()
+    ihex.puts(0x0000, b'\x01' * 200)
+    # crosses from bank 0 into bank 1
+    ihex.puts(0xFF00, b'\x02' * 0x200)
+    ihex.puts(0x12000, b'\x03' * 300)
+    return FirmwareImage(ihex)
+
+def test_verify_ranges_split_at_banks():
+    ranges = make_image().verify_ranges(512)
+    assert [(start, end) for (start, end, _) in ranges] == [
+        (0x0000, 0x01FF), (0xFE00, 0xFFFF), (0x10000, 0x101FF), (0x12000, 0x121FF),
+    ]
+
+class RecordLog(EFM8BootloaderObserver):
+    def __init__(self):
+        self.records = []
+
+    def record_started(self, boot, record):
+        self.records.append(record)
+
+def test_write_two_banks():
+    (fake, boot) = make_boot(BIG_PART)
+    log = RecordLog()
+    boot.observers.append(log)
+    image = make_image()
+    with boot:
+        boot.write_flash_hex(image)
+        assert boot.verify_flash_hex(image)
+
+    for (pageAddr, pageData) in image.pages(512):
+        assert bytes(fake.flash[pageAddr:pageAddr + 512]) == bytes(pageData)
+
+    # page 0 is erased first, then bank 1 is written and verified, then
+    # bank 0 with page 0 last, each bank selected once
+    steps = []
+    for record in log.records:
+        if record.cmd == records.CMD_SETUP:
+            steps.append(('setup', record.bank, record.keys != 0))
+        elif record.cmd == records.CMD_VERIFY:
+            steps.append(('verify', record.start, record.end))
+        else:
+            steps.append((records.CMD_TO_STRING[record.cmd], record.addr))
+    assert steps == [
+        ('setup', 0, True),
+        ('erase', 0x0000),
+        ('setup', 1, True),
+        ('erase', 0x0000),
+        ('write', 0x0080),
+        ('erase', 0x2000),
+        ('write', 0x2080),
+        ('write', 0x2100),
+        ('verify', 0x0000, 0x01FF),
+        ('verify', 0x2000, 0x21FF),
+        ('setup', 0, True),
+        ('erase', 0xFE00),
+        ('write', 0xFF00),
+        ('write', 0xFF80),
+        ('write', 0x0000),
+        ('write', 0x0080),
+        ('verify', 0x0000, 0x01FF),
+        ('verify', 0xFE00, 0xFFFF),
+        ('setup', 0, False),
+        # verify_flash_hex
+        ('verify', 0x0000, 0x01FF),
+        ('verify', 0xFE00, 0xFFFF),
+        ('setup', 1, False),
+        ('verify', 0x0000, 0x01FF),
+        ('verify', 0x2000, 0x21FF),
+    ]
+
+def test_verify_detects_bank_1_mismatch():
+    (fake, boot) = make_boot(BIG_PART)
+    image = make_image()
+    with boot:
+        boot.write_flash_hex(image)
+        fake.flash[0x12010] = 0x00
+        assert not boot.verify_flash_hex(image)
+
+def test_single_ops_select_bank_once():
+    (fake, boot) = make_boot(BIG_PART)
+    with boot:
+        boot.enable_modifications()
+        boot.erase_page(0x10200)
+        boot.write_packet(0x10200, b'\x11\x22', erase=False)
+        boot.write_packet(0x10202, b'\x33', erase=False)
+        boot.erase_page(0x0200)
+        boot.disable_modifications()
+
+    assert fake.flash[0x10200:0x10203] == bytearray(b'\x11\x22\x33')
+    assert fake.count(records.CMD_SETUP) == 4
+
+def test_setup_record_round_trip():
+    record = records.Record.from_bytes(records.SetupRecord(2).to_bytes())
+    assert isinstance(record, records.SetupRecord)
+    assert (record.bank, record.keys) == (2, records.FLASH_KEYS)
@@ -0,0 +1,95 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import crcmod
+
+import efm8boot.records as records
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.image import crc_combine
+
+from tests.fake_device import BIG_PART, FakeEFM8, make_boot
+
+crc = crcmod.predefined.mkCrcFun('xmodem')
+
+def test_crc_combine():
+    (a, b) = (b'hello ', b'world!')
+    assert crc_combine(crc(a), crc(b), len(b)) == crc(a + b)
+
+def test_batch_merges_operations():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+
+    with boot:
+        boot.info
+        del fake.log[:]
+        with boot.batch():
+            boot.erase_page(0x0400)
+            for addr in range(0x0400, 0x0440, 4):
+                boot.write_packet(addr, [addr & 0xff] * 4, erase=False)
+            boot.erase_page(0x0400)
+            boot.write_packet(0x0410, b'\x01\x02', erase=False)
+            boot.write_packet(0x0420, b'\x03\x04', erase=False)
+            boot.write_packet(0x0200, b'\x0f', erase=True)
+            boot.write_packet(0x0200, b'\xf1', erase=False)
+            boot.verify(0x0410, 0x0411, crc(b'\x01\x02'))
+            boot.verify(0x0412, 0x041F, crc(b'\xff' * 14))
+            boot.verify(0x0410, 0x0411, crc(b'\x01\x02'))
+            assert fake.log == []
+
+    assert fake.flash[0x0200] == 0x01
+    assert fake.flash[0x0410:0x0412] == b'\x01\x02'
+    assert fake.flash[0x0412:0x0420] == b'\xff' * 14
+    assert fake.flash[0x0420:0x0422] == b'\x03\x04'
+    assert fake.log == [
+        (records.CMD_SETUP, None),
+        (records.CMD_ERASE, 0x0200),
+        (records.CMD_ERASE, 0x0410),
+        (records.CMD_VERIFY, 0x0410),
+        (records.CMD_SETUP, None),
+    ]
+
+def test_batch_page_zero_last():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+
+    with boot:
+        with boot.batch():
+            boot.write_page(0x0000, b'\x11' * 512)
+            boot.write_page(0x0200, b'\x22' * 512)
+
+    erases = [addr for (cmd, addr) in fake.log if cmd == records.CMD_ERASE]
+    writes = [addr for (cmd, addr) in fake.log if cmd == records.CMD_WRITE]
+    assert erases == [0x0000, 0x0200]
+    assert writes[-1] < 0x0200
+    assert fake.flash[:0x0400] == b'\x11' * 512 + b'\x22' * 512
+
+def test_batch_two_banks():
+    (fake, boot) = make_boot(BIG_PART)
+
+    with boot:
+        with boot.batch():
+            boot.write_packet(0x10200, b'\x11\x22', erase=True)
+            boot.write_packet(0x0000, b'\x01', erase=True)
+            boot.verify(0x10200, 0x10201, crc(b'\x11\x22'))
+            boot.verify(0x0000, 0x0000, crc(b'\x01'))
+            boot.verify(0xFF00, 0xFFFF, crc(b'\xff' * 0x100))
+            boot.verify(0x10000, 0x101FF, crc(b'\xff' * 0x200))
+
+    assert fake.flash[0x10200:0x10202] == b'\x11\x22'
+    assert fake.flash[0x0000] == 0x01
+    # page 0 is erased first and written last, and the verifies of bank 0
+    # aren't merged with the ones of bank 1
+    assert [(cmd, addr) for (cmd, addr) in fake.log] == [
+        (records.CMD_SETUP, None),
+        (records.CMD_ERASE, 0x0000),
+        (records.CMD_SETUP, None),
+        (records.CMD_ERASE, 0x10200),
+        (records.CMD_SETUP, None),
+        (records.CMD_WRITE, 0x0000),
+        (records.CMD_VERIFY, 0x0000),
+        (records.CMD_VERIFY, 0xFF00),
+        (records.CMD_SETUP, None),
+        # 0x10000-0x101FF and 0x10200-0x10201 merged
+        (records.CMD_VERIFY, 0x10000),
+        (records.CMD_SETUP, None),
+    ]
+    assert fake.bank == 0
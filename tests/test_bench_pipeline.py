@@ -0,0 +1,10 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from tests.bench_pipeline import run_benchmarks
+
+def test_benchmarks_run():
+    results = run_benchmarks(iterations=1, deviceCount=6)
+
+    assert results['write_flash_hex']['records'] > 0
+    for result in results.values():
+        assert result['wall_per_unit'] >= 0
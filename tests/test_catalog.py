@@ -0,0 +1,59 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import intelhex
+
+import efm8boot.records as records
+from efm8boot.catalog import FirmwareCatalog
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+
+from tests.fake_device import BIG_PART, FakeEFM8, make_boot
+
+def make_version(version):
+    ihex = intelhex.IntelHex()
+    ihex.puts(0x0000, bytes(bytearray([0x11] * 0x0C00)))
+    # each version changes a different page
+    ihex.puts(0x0200 * version, bytes(bytearray([version])))
+    return ihex
+
+def test_identify():
+    catalog = FirmwareCatalog()
+    versions = [make_version(version) for version in range(6)]
+    for (version, ihex) in enumerate(versions):
+        catalog.add("v{}".format(version), ihex)
+
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    with boot:
+        boot.write_flash_hex(versions[4])
+        del fake.log[:]
+        assert catalog.identify(boot) == "v4"
+        probes = fake.count(records.CMD_VERIFY)
+
+        # a version that isn't in the catalog
+        boot.write_flash_hex(versions[1])
+        fake.flash[0x0A00] = 0x00
+        assert catalog.identify(boot) is None
+
+    # 3 probes to pick one of 6 images, and 1 to confirm it
+    assert probes == 4
+
+def test_identify_two_banks():
+    catalog = FirmwareCatalog()
+    versions = []
+    for version in range(4):
+        ihex = intelhex.IntelHex()
+        ihex.puts(0x0000, b'\x11' * 0x200)
+        # the pages on either side of the bank boundary differ
+        ihex.puts(0xFE00, bytes(bytearray([version & 1])))
+        ihex.puts(0x10000, bytes(bytearray([version >> 1])))
+        versions.append(ihex)
+        catalog.add("v{}".format(version), ihex)
+
+    for (start, end, _) in catalog._probe_ranges(512):
+        assert start // records.BANK_SIZE == end // records.BANK_SIZE
+
+    (fake, boot) = make_boot(BIG_PART)
+    with boot:
+        for (version, ihex) in enumerate(versions):
+            boot.write_flash_hex(ihex)
+            assert catalog.identify(boot) == "v{}".format(version)
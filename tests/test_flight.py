@@ -0,0 +1,61 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import io
+
+import pytest
+
+from efm8boot.bootloader import EFM8BootloaderProtocolError
+from efm8boot.flight import FlightRecorder
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+import efm8boot.records as records
+
+from tests.fake_device import FakeEFM8
+
+def test_dump_on_protocol_error():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    dumpFile = io.StringIO()
+    boot.flightRecorder = FlightRecorder(size=4, raw=True, dumpFile=dumpFile)
+
+    with boot:
+        boot.enable_modifications()
+        boot.erase_page(0x0200)
+        boot.write_packet(0x0200, b'\x01\x02', erase=False)
+        boot.disable_modifications()
+        with pytest.raises(EFM8BootloaderProtocolError) as excinfo:
+            boot.write_packet(0x0200, b'\x00', erase=False)
+
+    entries = boot.flightRecorder.entries()
+    assert [entry.cmd for entry in entries] == [
+        records.CMD_ERASE, records.CMD_WRITE, records.CMD_SETUP, records.CMD_WRITE
+    ]
+    assert entries[-1].resp == records.RANGE_ERROR
+    assert entries[1].sent[:3] == b'\x24\x05\x33'
+    assert entries[1].received[:1] == b'\x40'
+    assert excinfo.value.flightLog == dumpFile.getvalue()
+    assert "RANGE_ERROR" in dumpFile.getvalue()
+    assert "sent     2405330200" in dumpFile.getvalue()
+
+def test_dump_on_transport_error():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+
+    def fail(size, report_id=0x00):
+        raise IOError("timed out")
+
+    with boot:
+        boot.info
+        fake.get_feature_report = fail
+        with pytest.raises(IOError) as excinfo:
+            boot.reset_mcu()
+
+    assert boot.flightRecorder.entries()[-1].resp is None
+    assert "reset" in excinfo.value.flightLog
+    assert "no response" in excinfo.value.flightLog
+
+def test_disabled():
+    boot = EFM8BootloaderHID(FakeEFM8())
+    boot.flightRecorder.enabled = False
+    with boot:
+        boot.info
+    assert len(boot.flightRecorder) == 0
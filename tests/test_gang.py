@@ -0,0 +1,95 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import threading
+import time
+
+
+from efm8boot.gang import (
+    GangFlasher, usb_location, group_by_bus, _share_image, _SharedImage
+)
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.image import FirmwareImage
+
+from tests.fake_device import FakeEFM8, make_hex
+
+def add_hidraw(root, name, usbPath):
+    device = os.path.join(root, 'devices', usbPath, '0003:10C4:EAC9.0001')
+    os.makedirs(device)
+    os.makedirs(os.path.join(root, 'hidraw', name))
+    os.symlink(device, os.path.join(root, 'hidraw', name, 'device'))
+
+def test_usb_location(tmpdir):
+    root = str(tmpdir)
+    add_hidraw(root, 'hidraw0', 'pci0000:00/usb1/1-2/1-2:1.0')
+    add_hidraw(root, 'hidraw1', 'pci0000:00/usb1/1-3/1-3.4/1-3.4:1.0')
+    sysfs = os.path.join(root, 'hidraw')
+
+    assert usb_location('/dev/hidraw0', sysfs) == ('usb1', 'usb1')
+    assert usb_location('/dev/hidraw1', sysfs) == ('usb1', '1-3')
+    assert usb_location('0002:0005:00') == ('usb2', 'usb2')
+    assert usb_location('other') == ('other', 'other')
+
+    groups = group_by_bus(['/dev/hidraw0', '0002:0005:00', '/dev/hidraw1'], sysfs)
+    assert list(groups) == ['usb1', 'usb2']
+    assert groups['usb1'] == [('/dev/hidraw0', 'usb1'), ('/dev/hidraw1', '1-3')]
+
+def test_gang_limits_devices_per_hub():
+    paths = ['0001:00{:02x}:00'.format(i) for i in range(4)] + ['0002:0001:00']
+    fakes = dict((path, FakeEFM8(path=path)) for path in paths)
+    active = {'usb1': 0, 'usb2': 0}
+    peak = {'usb1': 0, 'usb2': 0}
+    lock = threading.Lock()
+
+    class TrackedBootloader(EFM8BootloaderHID):
+        def write_flash_hex(self, *args, **kwargs):
+            bus = 'usb' + self.path[3]
+            with lock:
+                active[bus] += 1
+                peak[bus] = max(peak[bus], active[bus])
+            time.sleep(0.02)
+            try:
+                super(TrackedBootloader, self).write_flash_hex(*args, **kwargs)
+            finally:
+                with lock:
+                    active[bus] -= 1
+
+    app = make_hex(0x0000, range(200))
+    gang = GangFlasher(
+        app, maxPerHub=2, useProcesses=False,
+        openDevice=lambda path: TrackedBootloader(fakes[path]),
+    )
+    report = gang.run(paths + ['0003:0001:00'])
+
+    assert peak == {'usb1': 2, 'usb2': 1}
+    assert len(report.succeeded) == 5
+    assert [result.path for result in report.failed] == ['0003:0001:00']
+    for path in paths:
+        assert fakes[path].flash[:200] == bytearray(range(200))
+        assert fakes[path].hasReset
+
+def open_fake(path):
+    return EFM8BootloaderHID(FakeEFM8(path=path))
+
+def test_gang_processes():
+    app = make_hex(0x0000, range(200))
+    gang = GangFlasher(app, openDevice=open_fake)
+    report = gang.run(['0001:0001:00', '0002:0001:00'])
+
+    assert [result.error for result in report.results] == [None, None]
+    assert [result.nbytes for result in report.results] == [512, 512]
+
+def test_shared_image():
+    ihex = make_hex(0x0010, range(200))
+    ihex.puts(0x0400, b'\x12\x34')
+    image = FirmwareImage(ihex)
+    shared = _SharedImage(_share_image(image, 512))
+
+    assert [(pageAddr, bytes(pageData)) for (pageAddr, pageData) in shared.pages(512)] == \
+        [(pageAddr, bytes(pageData)) for (pageAddr, pageData) in image.pages(512)]
+    assert (shared.minaddr(), shared.maxaddr()) == (0x0010, 0x0401)
+    assert shared.verify_ranges(512) == image.verify_ranges(512)
+    # other page sizes are built from the shared pages, padding included
+    assert shared.ihex.tobinstr(0x0010, 0x00D7) == bytes(bytearray(range(200)))
+    assert [pageAddr for (pageAddr, _) in shared.pages(256)] == \
+        [0x0000, 0x0100, 0x0400, 0x0500]
@@ -0,0 +1,113 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+
+from efm8boot.hid_bootloader import EFM8BootloaderHID, find_devices
+from efm8boot.hidraw import (
+    HidrawDevice, Enumeration, HIDIOCSFEATURE, HIDIOCGFEATURE
+)
+import efm8boot.hidraw
+import efm8boot.ids
+
+from tests.fake_device import FakeEFM8
+
+class FakeIoctl(object):
+    """
+    Passes the feature report ioctls on to a `FakeEFM8`.
+    """
+    def __init__(self, fake):
+        self.fake = fake
+        self.calls = []
+
+    def __call__(self, fd, request, buf, mutate):
+        self.calls.append((fd, request, buf))
+        assert buf[0] == 0x00
+        if request == HIDIOCSFEATURE(len(buf)):
+            self.fake.send_feature_report(bytes(buf[1:]))
+        elif request == HIDIOCGFEATURE(len(buf)):
+            report = self.fake.get_feature_report(len(buf) - 1)
+            buf[1:1 + len(report)] = report
+        else:
+            raise AssertionError("unexpected ioctl 0x{:08X}".format(request))
+        return len(buf)
+
+def make_device(fake):
+    ioctl = FakeIoctl(fake)
+    dev = HidrawDevice(
+        '/dev/hidraw3', 0x10C4, 0xEAC9, ioctl=ioctl,
+        openFile=lambda path, flags: 42, closeFile=lambda fd: None,
+    )
+    return (dev, ioctl)
+
+def test_ioctl_numbers():
+    # values from <linux/hidraw.h> for a 65 byte buffer
+    assert HIDIOCSFEATURE(65) == 0xC0414806
+    assert HIDIOCGFEATURE(65) == 0xC0414807
+
+def test_bootloader_over_hidraw(monkeypatch):
+    # feature reports are used whatever the platform
+    monkeypatch.setattr(sys, 'platform', 'darwin')
+    fake = FakeEFM8()
+    (dev, ioctl) = make_device(fake)
+    boot = EFM8BootloaderHID(dev)
+    assert not boot._useOutputReports
+
+    with boot:
+        boot.enable_modifications()
+        boot.erase_page(0x0200)
+        boot.write_packet(0x0200, b'\x01\x02\x03', erase=False)
+
+    assert fake.flash[0x0200:0x0203] == bytearray(b'\x01\x02\x03')
+    assert all(fd == 42 for (fd, _, _) in ioctl.calls)
+
+    # one buffer for each direction, reused for every report
+    sendBuffers = set(id(buf) for (_, request, buf) in ioctl.calls
+                      if request == HIDIOCSFEATURE(len(buf)))
+    getBuffers = set(id(buf) for (_, request, buf) in ioctl.calls
+                     if request == HIDIOCGFEATURE(len(buf)))
+    assert len(sendBuffers) == 1
+    assert len(getBuffers) == 1
+
+def test_get_feature_report_returns_copy():
+    fake = FakeEFM8()
+    (dev, ioctl) = make_device(fake)
+    dev.open()
+    dev.send_feature_report(bytearray(b'\x24\x03\x30\x00\x00') + bytearray(59))
+    first = dev.get_feature_report(4)
+    ioctl.calls[-1][2][1] = 0xFF
+    assert first[0] != 0xFF
+
+def write_uevent(root, name, hidId):
+    deviceDir = os.path.join(root, name, 'device')
+    os.makedirs(deviceDir)
+    with open(os.path.join(deviceDir, 'uevent'), 'w') as f:
+        f.write("DRIVER=hid-generic\nHID_ID={}\nHID_NAME=test\n".format(hidId))
+
+def test_enumeration(tmpdir):
+    root = str(tmpdir)
+    write_uevent(root, 'hidraw0', '0003:0000046D:0000C52B')
+    write_uevent(root, 'hidraw1', '0003:000010C4:0000EAC9')
+    write_uevent(root, 'hidraw2', '0003:000010C4:0000EACA')
+
+    devices = Enumeration(vid=0x10C4, sysfsRoot=root).find()
+    assert [dev.path for dev in devices] == ['/dev/hidraw1', '/dev/hidraw2']
+    assert (devices[0].vendor_id, devices[0].product_id) == (0x10C4, 0xEAC9)
+
+    devices = Enumeration(vid=0x10C4, sysfsRoot=root).find(path='/dev/hidraw2')
+    assert [dev.product_id for dev in devices] == [0xEACA]
+
+    assert Enumeration(sysfsRoot=os.path.join(root, 'missing')).find() == []
+
+def test_find_devices_hidraw(monkeypatch, tmpdir):
+    root = str(tmpdir)
+    write_uevent(root, 'hidraw1', '0003:000010C4:0000EAC9')
+    monkeypatch.setattr(
+        efm8boot.hidraw, 'Enumeration',
+        lambda vid, pid: Enumeration(vid, pid, sysfsRoot=root)
+    )
+
+    devices = find_devices(backend='hidraw')
+    assert [(dev.path, dev.pid) for dev in devices] == [
+        ('/dev/hidraw1', efm8boot.ids.EFM8UB1_USB_PID)
+    ]
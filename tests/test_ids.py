@@ -0,0 +1,37 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import efm8boot.ids
+import efm8boot.hid_bootloader
+import efm8boot.records as records
+from efm8boot.hid_bootloader import find_devices
+
+from tests.fake_device import FakeEFM8, FakeEnumeration
+
+def test_registry_indexes():
+    registry = efm8boot.ids.REGISTRY
+    part = registry.part("EFM8UB20F32G_QFN32")
+
+    assert part.family == "EFM8UB2"
+    assert part.usbPid == efm8boot.ids.EFM8UB2_USB_PID
+    assert part.identId == efm8boot.ids.EFM8UB2_PREFIX | 0x65
+    assert part in registry.byChipID[0x65]
+    assert efm8boot.ids.EFM8UB2_DEVICES[part.identId] == part.info
+    assert registry.pid_has_part(efm8boot.ids.EFM8UB2_USB_PID, part.info.name)
+    assert not registry.pid_has_part(efm8boot.ids.EFM8UB1_USB_PID, part.info.name)
+
+def test_find_devices_by_mcu():
+    ub1 = FakeEFM8(pid=efm8boot.ids.EFM8UB1_USB_PID, path="ub1")
+    ub2 = FakeEFM8(pid=efm8boot.ids.EFM8UB2_USB_PID, path="ub2")
+
+    original = efm8boot.hid_bootloader.easyhid.Enumeration
+    efm8boot.hid_bootloader.easyhid.Enumeration = FakeEnumeration([ub1, ub2])
+    try:
+        found = find_devices(mcu=ub2.info.name)
+    finally:
+        efm8boot.hid_bootloader.easyhid.Enumeration = original
+
+    assert [boot.path for boot in found] == ["ub2"]
+    assert found[0].info == ub2.info
+    # the other family is never opened and the match needs one identify
+    assert ub1.log == []
+    assert ub2.log == [(records.CMD_IDENTIFY, None)]
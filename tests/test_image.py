@@ -0,0 +1,57 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import io
+
+
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.image import FirmwareImage, ImageCache, load_image
+
+from tests.fake_device import FakeEFM8, make_hex
+
+def make_hex_text(value, size=600):
+    f = io.StringIO()
+    make_hex(0x0000, [value] * size).write_hex_file(f)
+    return f.getvalue().encode('ascii')
+
+def test_image_cache_lru():
+    cache = ImageCache(maxEntries=2)
+    first = load_image(make_hex_text(1), cache=cache)
+
+    assert load_image(make_hex_text(1), cache=cache) is first
+    load_image(make_hex_text(2), cache=cache)
+    load_image(make_hex_text(3), cache=cache)
+
+    assert len(cache) == 2
+    assert load_image(make_hex_text(1), cache=cache) is not first
+    assert cache.hits == 1
+
+def test_image_pages_and_masks():
+    image = FirmwareImage.from_source(make_hex_text(0x12))
+
+    pages = image.pages(512)
+    assert [addr for (addr, _) in pages] == [0x0000, 0x0200]
+    assert image.pages(512) is pages
+    assert image.blank_frames(512)[0x0200] == (False, True, True, True)
+    assert image.segment_crcs()[0][:2] == (0x0000, 599)
+
+def test_image_reused_between_devices():
+    image = FirmwareImage.from_source(make_hex_text(0x34))
+
+    for _ in range(2):
+        fake = FakeEFM8()
+        boot = EFM8BootloaderHID(fake)
+        with boot:
+            boot.write_flash_hex(image)
+        assert fake.flash[:600] == bytearray([0x34] * 600)
+        assert fake.flash[600] == 0xff
+
+def test_devices_share_image_and_crc():
+    image = FirmwareImage.from_source(make_hex_text(0x56))
+    pages = image.pages(512)
+    # pages are views of one buffer, not a copy each
+    assert pages[0][1].obj is pages[1][1].obj
+    assert bytes(pages[1][1]) == b'\x56' * 88 + b'\xff' * 424
+
+    (bootA, bootB) = (EFM8BootloaderHID(FakeEFM8()), EFM8BootloaderHID(FakeEFM8()))
+    assert not hasattr(bootA, '__dict__')
+    assert bootA.compute_crc is bootB.compute_crc
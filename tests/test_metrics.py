@@ -0,0 +1,64 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+
+import pytest
+
+from efm8boot.bootloader import EFM8BootloaderProtocolError
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.metrics import FlashMetrics
+
+from tests.fake_device import FakeEFM8, make_hex
+
+APP_HEX = make_hex(0x0000, b'\x5a' * 600)
+
+def flash(metrics, ihex, path="fake-efm8"):
+    boot = EFM8BootloaderHID(FakeEFM8(path=path))
+    boot.observers.append(metrics)
+    with boot:
+        boot.write_flash_hex(ihex)
+
+def test_metrics_parallel_flashes():
+    metrics = FlashMetrics(station="s1")
+    threads = [
+        threading.Thread(target=flash, args=(metrics, APP_HEX, "dev{}".format(i)))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    labels = (('station', 's1'), ('family', 'EFM8UB1'))
+    values = metrics.values()
+    assert values[('efm8boot_flashes_started_total', labels)] == 4
+    assert values[('efm8boot_flashes_succeeded_total', labels)] == 4
+    assert values[('efm8boot_bytes_written_total', labels)] == 4 * 1024
+    assert values[('efm8boot_phase_seconds_count', labels + (('phase', 'verify'),))] == 4
+
+def test_metrics_failure_and_textfile(tmpdir):
+    metrics = FlashMetrics(station="s1")
+    with pytest.raises(EFM8BootloaderProtocolError):
+        # too big to fit in the fake, but not for the size check
+        fake = FakeEFM8()
+        fake.info = fake.info._replace(bootloaderStart=0x0100)
+        boot = EFM8BootloaderHID(fake)
+        boot.observers.append(metrics)
+        with boot:
+            boot.write_flash_hex(APP_HEX)
+
+    failedLine = 'efm8boot_flashes_failed_total{station="s1",family="EFM8UB1",error="RANGE_ERROR"} '
+    assert failedLine + '1' in metrics.render().splitlines()
+
+    fileName = str(tmpdir.join("efm8boot.prom"))
+    metrics.write_textfile(fileName)
+    reloaded = FlashMetrics(station="s1")
+    reloaded.load_textfile(fileName)
+    reloaded.write_textfile(fileName)
+    reloaded.load_textfile(fileName)
+    lines = reloaded.render().splitlines()
+    assert failedLine + '2' in lines
+    # counts stay integers across reloads, only the sums of seconds are floats
+    counts = [line for line in lines if '_total{' in line or '_count{' in line]
+    assert counts
+    assert not any(line.endswith('.0') for line in counts)
@@ -0,0 +1,55 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import intelhex
+import pytest
+
+import efm8boot.records as records
+from efm8boot.bootloader import EFM8BootloaderVerifyError
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.patch import ImagePatch, SerialTemplate
+
+from tests.fake_device import FakeEFM8
+
+def make_base():
+    ihex = intelhex.IntelHex()
+    ihex.puts(0x0000, bytes(bytearray([0x11] * 0x0800)))
+    ihex.puts(0x0C00, b'CAL0')
+    return ihex
+
+def test_parse():
+    assert ImagePatch.parse('0x0C04=0102').chunks == [(0x0C04, b'\x01\x02')]
+    with pytest.raises(ValueError):
+        ImagePatch.parse('0x0C04=012')
+    serial = SerialTemplate.parse('0x0C10:SN{:04d}')
+    assert serial.patch(42).chunks == [(0x0C10, b'SN0042')]
+    assert SerialTemplate(0x0C10, '<I').render(1) == b'\x01\x00\x00\x00'
+
+def test_write_patch_rewrites_only_patched_pages():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    base = make_base()
+    patch = SerialTemplate(0x0C10, 'SN{:04d}').patch(7)
+    patch.add(0x0C04, b'\xaa')
+
+    with boot:
+        boot.write_flash_hex(base)
+        del fake.log[:]
+        boot.write_patch(patch, base, verifyBase=True)
+
+    assert fake.flash[0x0C00:0x0C16] == b'CAL0\xaa' + b'\xff' * 11 + b'SN0007'
+    assert fake.flash[0x0000:0x0800] == b'\x11' * 0x0800
+    assert [addr for (cmd, addr) in fake.log if cmd == records.CMD_ERASE] == [0x0C00]
+    assert [addr for (cmd, addr) in fake.log if cmd == records.CMD_VERIFY] == \
+        [0x0000, 0x0C00]
+
+def test_write_patch_checks_base():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    patch = ImagePatch([(0x0C10, b'\x01')])
+
+    with boot:
+        with pytest.raises(EFM8BootloaderVerifyError) as excinfo:
+            boot.write_patch(patch, make_base(), verifyBase=True)
+
+    assert (excinfo.value.start, excinfo.value.end) == (0x0000, 0x07FF)
+    assert fake.count(records.CMD_ERASE) == 0
@@ -0,0 +1,25 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from efm8boot.pipeline import RecordPipeline
+
+def test_pipeline_order():
+    pipeline = RecordPipeline(iter(range(10)), lambda record: [record * 2])
+    assert list(pipeline) == [(i, [i * 2]) for i in range(10)]
+
+def test_pipeline_error():
+    def records():
+        yield 1
+        raise ValueError("bad record")
+
+    with pytest.raises(ValueError):
+        list(RecordPipeline(records(), lambda record: [record]))
+
+def test_pipeline_stops_early():
+    pipeline = RecordPipeline(iter(range(1000)), lambda record: [record])
+    for (record, _) in pipeline:
+        if record == 3:
+            break
+    pipeline._thread.join(1.0)
+    assert not pipeline._thread.is_alive()
@@ -0,0 +1,45 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import io
+
+import efm8boot.ids
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.plan import LatencyProfile, plan_flash_hex
+import efm8boot.records as records
+from efm8boot.trace import TraceRecorder
+
+from tests.fake_device import FakeEFM8, make_hex
+
+APP_HEX = make_hex(0x0000, b'\x12' * 600)
+
+def test_plan_matches_device():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    with boot:
+        boot.write_flash_hex(APP_HEX)
+        boot.reset_mcu()
+
+    plan = plan_flash_hex(APP_HEX, fake.info)
+    summary = plan.summary()
+
+    sent = [(cmd, addr) for (cmd, addr) in fake.log[1:] if cmd != records.CMD_VERIFY]
+    assert [(step.cmd, step.addr) for step in plan.steps
+            if step.cmd != records.CMD_VERIFY] == sent
+    assert summary['erases'] == 2
+    # the last two frames of the second page are blank and aren't written
+    assert summary['writeFrames'] == 5
+    assert summary['hidReports'] == 4 * 5 + 2 * (len(plan.steps) - 5)
+
+def test_latency_profile_from_trace():
+    traceFile = io.BytesIO()
+    boot = EFM8BootloaderHID(TraceRecorder(FakeEFM8(), traceFile))
+    with boot:
+        boot.write_flash_hex(APP_HEX)
+    traceFile.seek(0)
+
+    profile = LatencyProfile.from_trace(traceFile)
+    assert profile.reportTime > 0
+    assert 'erase' in profile.commandTimes
+
+    info = efm8boot.ids.get_part_info("EFM8UB10F16G_QFN28")
+    assert plan_flash_hex(APP_HEX, info).estimate_time(profile) > 0
@@ -0,0 +1,41 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pstats
+
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.image import load_image
+from efm8boot.profiling import PhaseProfiler
+
+from tests.fake_device import FakeEFM8, make_hex
+
+def test_profile_phases(tmpdir):
+    ihex = make_hex(0x0000, range(200))
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    profiler = PhaseProfiler(cprofile=True)
+
+    with profiler.phase('parse'):
+        image = load_image(ihex, cache=None)
+    profiler.attach(boot)
+    with boot:
+        boot.write_flash_hex(image)
+        boot.reset_mcu()
+
+    phases = profiler.report()['phases']
+    assert list(phases) == [
+        'identify', 'parse', 'packetize', 'setup', 'erase', 'write', 'verify', 'reset'
+    ]
+    assert phases['parse']['calls'] == 1
+    assert phases['setup'] == dict(phases['setup'], calls=2, reports=4)
+    # every record sent is encoded once
+    assert phases['packetize']['calls'] == sum(
+        phase['calls'] for (name, phase) in phases.items()
+        if name not in ('parse', 'packetize')
+    )
+    # a full frame takes 3 reports, plus the response
+    assert phases['write']['reports'] == 4 * phases['write']['calls']
+    assert 'total' in profiler.format()
+
+    dumpFile = str(tmpdir.join('profile.out'))
+    profiler.dump_stats(dumpFile)
+    assert pstats.Stats(dumpFile).total_calls > 0
@@ -0,0 +1,101 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import collections
+
+import pytest
+
+from efm8boot.bootloader import (
+    EFM8BootloaderAppTimeoutError, EFM8BootloaderFallbackError
+)
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.metrics import FlashMetrics
+from efm8boot.readiness import AppWatcher, PollingMonitor
+import efm8boot.records as records
+
+from tests.fake_device import FakeEFM8, FakeEnumeration
+
+APP_VID = 0x1209
+APP_PID = 0x0001
+
+AppDevice = collections.namedtuple('AppDevice', "vendor_id product_id path")
+
+class ScriptedMonitor(object):
+    """
+    Change source that runs one step of a re-enumeration each time it waits.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def wait(self, timeout):
+        if self.steps:
+            self.steps.pop(0)()
+
+    def stop(self):
+        self.started = False
+
+def make_watcher(devices, steps, **kwargs):
+    return AppWatcher(
+        APP_VID, APP_PID, monitor=ScriptedMonitor(steps),
+        enumeration=FakeEnumeration(devices), **kwargs
+    )
+
+def test_wait_for_app():
+    fake = FakeEFM8(path="boot-0")
+    # another unit already running the application is ignored
+    devices = [fake, AppDevice(APP_VID, APP_PID, "app-0")]
+    watcher = make_watcher(devices, [
+        lambda: None,
+        lambda: devices.remove(fake),
+        lambda: devices.append(AppDevice(APP_VID, APP_PID, "app-1")),
+    ])
+    metrics = FlashMetrics()
+
+    boot = EFM8BootloaderHID(fake)
+    boot.observers.append(metrics)
+    with boot:
+        elapsed = boot.reset_mcu(appWatcher=watcher)
+
+    assert elapsed >= 0
+    assert watcher.appPath == "app-1"
+    assert not watcher.monitor.started
+    assert fake.count(records.CMD_RUN_APP) == 1
+    count = [
+        value for ((name, _), value) in metrics.values().items()
+        if name == 'efm8boot_time_to_app_seconds_count'
+    ]
+    assert count == [1]
+
+def test_fallback_to_bootloader():
+    fake = FakeEFM8(path="boot-0")
+    other = FakeEFM8(path="boot-9")
+    devices = [fake, other]
+    watcher = make_watcher(devices, [
+        lambda: devices.remove(fake),
+        lambda: devices.append(FakeEFM8(path="boot-1")),
+    ])
+    metrics = FlashMetrics()
+
+    boot = EFM8BootloaderHID(fake)
+    boot.observers.append(metrics)
+    with boot:
+        with pytest.raises(EFM8BootloaderFallbackError) as excinfo:
+            boot.reset_mcu(appWatcher=watcher)
+    assert excinfo.value.path == "boot-1"
+    assert "efm8boot_app_starts_failed_total" in metrics.render()
+
+def test_app_timeout():
+    fake = FakeEFM8(path="boot-0")
+    watcher = AppWatcher(
+        APP_VID, APP_PID, timeout=0.05, monitor=PollingMonitor(0.01),
+        enumeration=FakeEnumeration([fake]),
+    )
+
+    boot = EFM8BootloaderHID(fake)
+    with boot:
+        with pytest.raises(EFM8BootloaderAppTimeoutError):
+            boot.reset_mcu(appWatcher=watcher)
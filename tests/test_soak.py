@@ -0,0 +1,79 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from efm8boot.bootloader import EFM8BootloaderProtocolError
+import efm8boot.records as records
+from efm8boot.timeouts import AdaptiveTimeouts
+
+from tests.fake_device import FaultModel, make_boot
+from tests.soak import soak, sweep, format_results
+
+def test_dropped_record_raises_io_error():
+    (fake, boot) = make_boot(faults=FaultModel(drop=1.0))
+    with boot:
+        with pytest.raises(IOError):
+            boot.identify(fake.identId)
+    assert fake.log == []
+    assert boot._hidDevice.injected['drop'] == 1
+
+def test_corrupted_ack_is_protocol_error():
+    (fake, boot) = make_boot(faults=FaultModel(corruptAck=1.0))
+    with boot:
+        with pytest.raises(EFM8BootloaderProtocolError) as excinfo:
+            boot.enable_modifications()
+    # the device still handled the record
+    assert fake.writingEnabled
+    assert excinfo.value.code != records.ACK
+    assert "EFM8 bootloader error" in str(excinfo.value)
+
+def test_unknown_response_code_message():
+    assert "0x7F" in str(EFM8BootloaderProtocolError(0x7F))
+
+def test_disconnect_until_reopened():
+    (fake, boot) = make_boot(faults=FaultModel(disconnect=1.0))
+    with boot:
+        boot.enable_modifications()
+        boot.erase_page(0x0200)
+        with pytest.raises(IOError):
+            boot.write_packet(0x0200, b'\x12\x34', erase=False)
+        with pytest.raises(IOError):
+            boot.identify(fake.identId)
+    with boot:
+        boot.identify(fake.identId)
+
+def test_cut_off_record_not_resent():
+    (fake, boot) = make_boot(faults=FaultModel(midRecord=1.0))
+    boot.timeouts = AdaptiveTimeouts(retries=3)
+    data = bytes(bytearray(range(128)))
+    with boot:
+        # records that fit in one report can't be cut off
+        boot.enable_modifications()
+        boot.erase_page(0x0200)
+        with pytest.raises(IOError):
+            boot.write_packet(0x0200, data, erase=False)
+    assert boot._hidDevice.injected['midRecord'] == 1
+    # resending the record would have completed the partial one in the
+    # device with the header of the new one
+    assert fake.count(records.CMD_WRITE) == 0
+    assert fake.flash[0x0200:0x0280] == bytearray([0xFF] * 128)
+
+def test_soak_without_faults():
+    result = soak(cycles=3, faults=FaultModel())
+    assert result['success_rate'] == 1.0
+    assert result['recovery_time'] == 0.0
+    assert result['flash_time']['p99'] >= result['flash_time']['p50']
+
+def test_soak_recovers_from_faults():
+    faults = FaultModel(drop=0.01, corruptAck=0.005, spuriousError=0.005,
+                        disconnect=0.005)
+    results = sweep([0, 1], faults, cycles=20, attempts=5, timeouts=True, seed=3)
+    (_, clean), (_, faulty) = results
+
+    assert clean['success_rate'] == 1.0
+    assert sum(faulty['faults_injected'].values()) > 0
+    assert faulty['recovered'] > 0
+    assert faulty['recovery_time'] > 0
+    assert faulty['corrupted'] == 0
+    assert faulty['succeeded'] + faulty['corrupted'] <= faulty['cycles']
+    assert len(format_results(results).splitlines()) == 3
@@ -0,0 +1,110 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from efm8boot.bootloader import EFM8BootloaderTimeoutError
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.records import EraseRecord, VerifyRecord, WriteRecord
+import efm8boot.records as records
+from efm8boot.timeouts import AdaptiveTimeouts
+
+from tests.fake_device import FakeEFM8
+
+def test_timeouts_adapt_to_latency():
+    timeouts = AdaptiveTimeouts(multiplier=4, percentile=0.5, minSamples=3)
+    write = WriteRecord(0x0200, b'\x00' * 16)
+    assert timeouts.timeout(write) == timeouts.initial[records.CMD_WRITE]
+
+    for elapsed in (0.020, 0.030, 0.040):
+        timeouts.add(write, elapsed)
+    assert timeouts.timeout(write) == pytest.approx(0.120)
+
+    # fast devices still get the minimum timeout
+    erase = EraseRecord(0x0200, b'')
+    for _ in range(3):
+        timeouts.add(erase, 0.001)
+    assert timeouts.timeout(erase) == timeouts.minimum[records.CMD_ERASE]
+
+    # verify samples are per block, so bigger ranges wait longer
+    for _ in range(3):
+        timeouts.add(VerifyRecord(0x0000, 0x01FF, 0), 0.1)
+    assert timeouts.timeout(VerifyRecord(0x0000, 0x07FF, 0)) == pytest.approx(1.6)
+    assert timeouts.timeout(VerifyRecord(0x0000, 0xFFFF, 0)) == timeouts.maxTimeout
+
+def hang_on(fake, cmd, release):
+    """
+    Make the response to the records with `cmd` block until `release` is set.
+    """
+    getFeatureReport = fake.get_feature_report
+    def get_feature_report(size, report_id=0x00):
+        if fake.log[-1][0] == cmd:
+            release.wait()
+        return getFeatureReport(size, report_id)
+    fake.get_feature_report = get_feature_report
+
+def test_hung_device_raises_timeout():
+    fake = FakeEFM8()
+    release = threading.Event()
+    hang_on(fake, records.CMD_ERASE, release)
+
+    boot = EFM8BootloaderHID(fake)
+    boot.timeouts = AdaptiveTimeouts(initial={
+        records.CMD_ERASE: 0.05, records.CMD_IDENTIFY: 0.05
+    }, retries=1)
+    try:
+        with boot:
+            boot.enable_modifications()
+            startTime = time.time()
+            with pytest.raises(EFM8BootloaderTimeoutError) as excinfo:
+                boot.erase_page(0x0200)
+            # one timeout, then one wait twice as long
+            assert time.time() - startTime < 1.0
+            assert excinfo.value.cmd == records.CMD_ERASE
+            assert "no response to erase" in excinfo.value.flightLog
+
+            # the device is still blocked, so later records fail too
+            with pytest.raises(EFM8BootloaderTimeoutError):
+                boot.identify(0x3200)
+        # the blocked transfer still uses the device, so it isn't closed
+        assert fake.isOpen
+    finally:
+        release.set()
+
+def test_slow_response_within_backoff():
+    fake = FakeEFM8()
+    release = threading.Event()
+    hang_on(fake, records.CMD_ERASE, release)
+    threading.Timer(0.1, release.set).start()
+
+    boot = EFM8BootloaderHID(fake)
+    boot.timeouts = AdaptiveTimeouts(initial={records.CMD_ERASE: 0.08}, retries=1)
+    with boot:
+        boot.enable_modifications()
+        boot.erase_page(0x0200)
+    assert fake.count(records.CMD_ERASE) == 1
+    assert not fake.isOpen
+
+def test_transport_error_resends_record():
+    fake = FakeEFM8()
+    sendFeatureReport = fake.send_feature_report
+    failures = [IOError("EPIPE")]
+    def send_feature_report(data, report_id=0x00):
+        if failures and bytearray(data)[2] == records.CMD_WRITE:
+            raise failures.pop()
+        return sendFeatureReport(data, report_id)
+    fake.send_feature_report = send_feature_report
+
+    boot = EFM8BootloaderHID(fake)
+    boot.timeouts = AdaptiveTimeouts(retries=1)
+    with boot:
+        boot.enable_modifications()
+        boot.erase_page(0x0200)
+        boot.write_packet(0x0200, b'\x12\x34', erase=False)
+
+    assert not failures
+    assert fake.flash[0x0200:0x0202] == bytearray(b'\x12\x34')
+    assert boot.timeouts.latency(records.CMD_WRITE) is None
+    assert len(boot.timeouts._samples[records.CMD_WRITE]) == 1
@@ -0,0 +1,45 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import io
+
+import pytest
+
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+from efm8boot.trace import (
+    EFM8BootloaderTraceError, TraceRecorder, TraceReplayDevice, read_trace,
+    TRACE_WRITE,
+)
+
+from tests.fake_device import FakeEFM8, make_hex
+
+def record_session(ihex):
+    traceFile = io.BytesIO()
+    recorder = TraceRecorder(FakeEFM8(), traceFile)
+    boot = EFM8BootloaderHID(recorder)
+    with boot:
+        boot.write_flash_hex(ihex)
+    traceFile.seek(0)
+    return traceFile
+
+def test_trace_round_trip():
+    traceFile = record_session(make_hex(0x0000, [0x12] * 600))
+
+    (header, events) = read_trace(traceFile)
+    assert header.pid == FakeEFM8().product_id
+    assert events[0].kind == TRACE_WRITE
+    assert all(a.time <= b.time for (a, b) in zip(events, events[1:]))
+
+    traceFile.seek(0)
+    replay = TraceReplayDevice(traceFile)
+    boot = EFM8BootloaderHID(replay)
+    with boot:
+        boot.write_flash_hex(make_hex(0x0000, [0x12] * 600))
+    assert replay.finished
+
+def test_trace_replay_mismatch():
+    traceFile = record_session(make_hex(0x0000, [0x12] * 600))
+
+    boot = EFM8BootloaderHID(TraceReplayDevice(traceFile))
+    with pytest.raises(EFM8BootloaderTraceError):
+        with boot:
+            boot.write_flash_hex(make_hex(0x0000, [0x34] * 600))
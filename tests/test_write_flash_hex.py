@@ -0,0 +1,101 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+import efm8boot.records as records
+from efm8boot.bootloader import (
+    EFM8BootloaderHexError, EFM8BootloaderVerifyError, load_hex
+)
+from efm8boot.hid_bootloader import EFM8BootloaderHID
+
+from tests.fake_device import FakeEFM8, make_hex
+
+def test_write_single_hex():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    app = make_hex(0x0000, range(200))
+
+    with boot:
+        boot.write_flash_hex(app)
+
+    assert fake.flash[:200] == bytearray(range(200))
+    assert fake.flash[200] == 0xff
+    assert not fake.writingEnabled
+
+def test_write_merged_hex_erases_each_page_once():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    app = make_hex(0x0000, [0x11] * 0x300)
+    cal = make_hex(0x0300, [0x22] * 16)
+
+    with boot:
+        boot.write_flash_hex([app, cal])
+
+    assert fake.flash[0x0000:0x0300] == bytearray([0x11] * 0x300)
+    assert fake.flash[0x0300:0x0310] == bytearray([0x22] * 16)
+    assert fake.count(records.CMD_SETUP) == 2
+    erased = [addr for (cmd, addr) in fake.log if cmd == records.CMD_ERASE]
+    assert sorted(erased) == [0x0000, 0x0200]
+    # page 0 is erased first and written last
+    writes = [addr for (cmd, addr) in fake.log if cmd == records.CMD_WRITE]
+    assert erased[0] == 0x0000
+    assert writes[-1] < 0x0200
+
+def test_load_hex_overlap():
+    app = make_hex(0x0000, [0x11] * 32)
+    cal = make_hex(0x0010, [0x22] * 32)
+
+    with pytest.raises(EFM8BootloaderHexError):
+        load_hex([app, cal])
+
+def test_load_hex_identical_overlap():
+    app = make_hex(0x0000, [0x11] * 32)
+    same = make_hex(0x0010, [0x11] * 32)
+
+    assert load_hex([app, same]).maxaddr() == 0x002F
+
+def test_verify_flash_hex():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    app = make_hex(0x0000, [0x11] * 0x300)
+    cal = make_hex(0x1000, [0x22] * 16)
+
+    with boot:
+        boot.write_flash_hex([app, cal])
+        del fake.log[:]
+        assert boot.verify_flash_hex([app, cal])
+
+    # one CRC for pages 0x0000-0x03FF and one for page 0x1000
+    assert fake.log == [(records.CMD_VERIFY, 0x0000), (records.CMD_VERIFY, 0x1000)]
+
+    fake.flash[0x1005] = 0x00
+    with boot:
+        assert not boot.verify_flash_hex([app, cal])
+
+def test_verify_every_page():
+    fake = FakeEFM8()
+    boot = EFM8BootloaderHID(fake)
+    app = make_hex(0x0000, [0x11] * 0x500)
+
+    with boot:
+        boot.write_flash_hex(app, verifyEvery=1)
+
+    verifies = [addr for (cmd, addr) in fake.log if cmd == records.CMD_VERIFY]
+    assert verifies == [0x0200, 0x0400, 0x0000]
+    assert fake.flash[:0x0500] == bytearray([0x11] * 0x500)
+
+def test_verify_every_fails_early():
+    fake = FakeEFM8()
+    fake.badCells[0x0210] = 0x01
+    boot = EFM8BootloaderHID(fake)
+    app = make_hex(0x0000, [0x11] * 0x1000)
+
+    with boot:
+        with pytest.raises(EFM8BootloaderVerifyError) as excinfo:
+            boot.write_flash_hex(app, verifyEvery=2)
+
+    assert (excinfo.value.start, excinfo.value.end) == (0x0200, 0x05FF)
+    assert excinfo.value.code == records.CRC_ERROR
+    # the pages after the failing group were never written
+    erased = [addr for (cmd, addr) in fake.log if cmd == records.CMD_ERASE]
+    assert max(erased) == 0x0400